@@ -0,0 +1,233 @@
+"""
+api.py - a read-only JSON API for scripts and external tools
+
+Each resource is filtered with the same parameters as the corresponding page
+of the site, using the same filter class. The other parameters are:
+
+fields
+    a comma separated list of the fields to return, which defaults to all of
+    the resource's fields
+limit
+    the number of records to return, up to `MAX_LIMIT`
+after
+    the cursor from the `next` value of the previous response
+
+The records are ordered by id and the response contains a `next` URL, which
+is null on the last page. Because the pages are found by seeking past the
+last id, new records can be fetched by polling the last `next` URL.
+
+Responses have an ETag and Last-Modified header that change whenever the
+database changes, and conditional requests that use these receive a 304 Not
+Modified response without the records being queried. Changes made by other
+processes are seen within SETTINGS_CACHE_TIMEOUT seconds. The ETag should be
+preferred as Last-Modified is only precise to a second.
+"""
+from __future__ import unicode_literals, division, absolute_import
+import hashlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.generic import View
+
+from .filters import (DataRequestFilter, DataFileFilter, ESGFDatasetFilter,
+                      RetrievalRequestFilter, ObservationDatasetFilter)
+from .models import (DataRequest, DataFile, ESGFDataset, RetrievalRequest,
+                     ObservationDataset)
+from .utils.table_views import (decode_cursor, encode_cursor,
+                                get_table_cache_modified,
+                                get_table_cache_version, keyset_filter)
+
+# The default number of records in each response
+DEFAULT_LIMIT = 100
+# The maximum number of records in each response
+MAX_LIMIT = 1000
+
+
+def api_etag(request, *args, **kwargs):
+    """
+    The ETag of a response, which changes when the database changes.
+    """
+    return hashlib.sha1('{} {}'.format(
+        get_table_cache_version(), request.get_full_path()
+    ).encode('utf-8')).hexdigest()
+
+
+def api_last_modified(request, *args, **kwargs):
+    """
+    The time that the database last changed.
+    """
+    return get_table_cache_modified()
+
+
+@method_decorator(condition(etag_func=api_etag,
+                            last_modified_func=api_last_modified),
+                  name='get')
+class ApiListView(View):
+    """
+    List the records of a model as JSON.
+    """
+    model = None
+    filter_class = None
+    # The fields that can be returned, which may include fields of related
+    # models
+    fields = None
+    # Many to many fields that can be returned as lists of ids
+    many_to_many_fields = ()
+    # Apply distinct() to the filtered records, which is only needed if a
+    # filter can join to more than one related row
+    distinct = True
+    # The maximum number of queries for a request, including the check of
+    # the cached Settings for the version of the database
+    query_budget = 2
+
+    def get_fields(self):
+        """
+        The fields requested, or all of the fields if none were.
+        """
+        all_fields = list(self.fields) + list(self.many_to_many_fields)
+        requested = self.request.GET.get('fields')
+        if not requested:
+            return all_fields
+        fields = [field.strip() for field in requested.split(',')
+                  if field.strip()]
+        unknown = [field for field in fields if field not in all_fields]
+        if unknown:
+            raise ValueError('Unknown fields: {}'.format(', '.join(unknown)))
+        return fields
+
+    def get_limit(self):
+        """
+        The number of records requested.
+        """
+        limit = self.request.GET.get('limit')
+        if not limit:
+            return DEFAULT_LIMIT
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        if limit < 1:
+            raise ValueError('limit must be positive')
+        return min(limit, MAX_LIMIT)
+
+    def get_queryset(self):
+        """
+        The records that match the filters in the request.
+        """
+        filter_set = self.filter_class(self.request.GET,
+                                       queryset=self.model.objects.all())
+        qs = filter_set.qs
+        if self.distinct:
+            qs = qs.distinct()
+        return qs
+
+    def _many_to_many_ids(self, field_name, pks):
+        """
+        The ids of the records related to each record in `pks` through the
+        many to many field `field_name`.
+        """
+        field = self.model._meta.get_field(field_name)
+        source = '{}_id'.format(field.m2m_field_name())
+        target = '{}_id'.format(field.m2m_reverse_field_name())
+        related = {pk: [] for pk in pks}
+        rows = (field.remote_field.through.objects.
+                filter(**{'{}__in'.format(source): pks}).
+                order_by(source, target).
+                values_list(source, target))
+        for pk, related_pk in rows:
+            related[pk].append(related_pk)
+        return related
+
+    def get(self, request, *args, **kwargs):
+        try:
+            fields = self.get_fields()
+            limit = self.get_limit()
+        except ValueError as exc:
+            return HttpResponseBadRequest(str(exc))
+        value_fields = [field for field in fields
+                        if field not in self.many_to_many_fields]
+
+        qs = self.get_queryset()
+        after = decode_cursor(request.GET.get('after'), 1)
+        if after is not None:
+            qs = qs.filter(keyset_filter(['pk'], after))
+        records = list(qs.order_by('pk').
+                       values('pk', *value_fields)[:limit + 1])
+        more_records = len(records) > limit
+        records = records[:limit]
+
+        pks = [record['pk'] for record in records]
+        for field_name in self.many_to_many_fields:
+            if field_name in fields:
+                related = self._many_to_many_ids(field_name, pks)
+                for record in records:
+                    record[field_name] = related[record['pk']]
+
+        next_url = None
+        if more_records:
+            params = request.GET.copy()
+            params['after'] = encode_cursor([pks[-1]])
+            next_url = request.build_absolute_uri(
+                '{}?{}'.format(request.path, params.urlencode())
+            )
+        return JsonResponse({
+            'next': next_url,
+            'results': [{field: record[field] for field in fields}
+                        for record in records]
+        }, encoder=DjangoJSONEncoder)
+
+
+class DataRequestApi(ApiListView):
+    model = DataRequest
+    filter_class = DataRequestFilter
+    fields = ('id', 'project__short_name', 'institute__short_name',
+              'climate_model__short_name', 'experiment__short_name',
+              'variable_request__table_name', 'variable_request__cmor_name',
+              'rip_code', 'request_start_time', 'request_end_time',
+              'time_units', 'calendar', 'cached_num_files', 'cached_size',
+              'cached_num_online', 'cached_num_offline')
+
+
+class DataFileApi(ApiListView):
+    model = DataFile
+    filter_class = DataFileFilter
+    fields = ('id', 'name', 'directory', 'version', 'size', 'online',
+              'tape_url', 'project__short_name', 'institute__short_name',
+              'climate_model__short_name', 'experiment__short_name',
+              'variable_request__table_name', 'variable_request__cmor_name',
+              'frequency', 'rip_code', 'grid', 'start_time', 'end_time',
+              'time_units', 'calendar', 'data_request_id',
+              'data_submission_id', 'esgf_dataset_id', 'ceda_dataset_id',
+              'esgf_download_url', 'ceda_download_url')
+    # each filter matches at most one row of any related table
+    distinct = False
+
+
+class ESGFDatasetApi(ApiListView):
+    model = ESGFDataset
+    filter_class = ESGFDatasetFilter
+    fields = ('id', 'status', 'version', 'directory', 'thredds_url',
+              'ceda_dataset_id', 'data_request_id', 'cached_drs_id',
+              'cached_out_name_drs_id')
+
+
+class RetrievalRequestApi(ApiListView):
+    model = RetrievalRequest
+    filter_class = RetrievalRequestFilter
+    fields = ('id', 'date_created', 'date_complete', 'date_deleted',
+              'requester__username', 'data_finished', 'start_year',
+              'end_year', 'cached_size', 'cached_online_size',
+              'cached_offline_size')
+    many_to_many_fields = ('data_request',)
+    query_budget = 3
+
+
+class ObservationDatasetApi(ApiListView):
+    model = ObservationDataset
+    filter_class = ObservationDatasetFilter
+    fields = ('id', 'name', 'version', 'url', 'summary', 'date_downloaded',
+              'doi', 'reference', 'license', 'cached_variables',
+              'cached_start_time', 'cached_end_time', 'cached_num_files',
+              'cached_directories')
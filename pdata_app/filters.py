@@ -1,9 +1,11 @@
 from __future__ import unicode_literals, division, absolute_import
 from django.db.models import Q
 import django_filters
+from django_filters.constants import EMPTY_VALUES
 from .models import (DataRequest, DataSubmission, DataFile, ESGFDataset,
                      CEDADataset, DataIssue, VariableRequest, RetrievalRequest,
                      ReplacedFile, ObservationDataset, ObservationFile)
+from .utils.substring_search import substring_search_lookups
 
 
 def patched_label():
@@ -32,6 +34,26 @@ if django_filters.__version__ == '1.1.0':
     django_filters.filters.Filter.label = patched_label
 
 
+class SubstringFilter(django_filters.CharFilter):
+    """
+    A case-insensitive substring filter that uses the field's substring
+    search index, if it has one, to find the matching rows.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('lookup_expr', 'icontains')
+        super(SubstringFilter, self).__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        if self.distinct:
+            qs = qs.distinct()
+        # a single call so that only one join is made to a related model
+        lookups = {'{}__{}'.format(self.field_name, self.lookup_expr): value}
+        lookups.update(substring_search_lookups(qs, self.field_name, value))
+        return self.get_method(qs)(**lookups)
+
+
 class DataRequestFilter(django_filters.FilterSet):
     class Meta:
         model = DataRequest
@@ -79,17 +101,14 @@ class DataFileFilter(django_filters.FilterSet):
                   'variable_request', 'institute', 'climate_model',
                   'experiment', 'rip_code']
 
-    name = django_filters.CharFilter(field_name='name',
-                                     lookup_expr='icontains')
+    name = SubstringFilter(field_name='name')
 
-    directory = django_filters.CharFilter(field_name='directory',
-                                          lookup_expr='icontains')
+    directory = SubstringFilter(field_name='directory')
 
     version = django_filters.CharFilter(field_name='version',
                                         lookup_expr='icontains')
 
-    tape_url = django_filters.CharFilter(field_name='tape_url',
-                                         lookup_expr='icontains')
+    tape_url = SubstringFilter(field_name='tape_url')
 
     data_submission = django_filters.NumberFilter(
         field_name='data_submission__id'
@@ -136,19 +155,14 @@ class DataSubmissionFilter(django_filters.FilterSet):
     status = django_filters.CharFilter(field_name='status',
                                        lookup_expr='icontains')
 
-    incoming_directory = django_filters.CharFilter(
-        field_name='incoming_directory',
-        lookup_expr='icontains'
-    )
+    incoming_directory = SubstringFilter(field_name='incoming_directory')
 
-    directory = django_filters.CharFilter(field_name='directory',
-                                          lookup_expr='icontains')
+    directory = SubstringFilter(field_name='directory')
 
     version = django_filters.CharFilter(field_name='datafile__version',
                                         lookup_expr='icontains')
 
-    tape_url = django_filters.CharFilter(field_name='datafile__tape_url',
-                                         lookup_expr='icontains')
+    tape_url = SubstringFilter(field_name='datafile__tape_url')
 
     user = django_filters.CharFilter(field_name='user__username',
                                      lookup_expr='icontains')
@@ -340,19 +354,14 @@ class ReplacedFileFilter(django_filters.FilterSet):
                   'institute', 'climate_model', 'experiment', 'mip_table',
                   'rip_code', 'cmor_name', 'grid')
 
-    name = django_filters.CharFilter(field_name='name',
-                                     lookup_expr='icontains')
+    name = SubstringFilter(field_name='name')
 
-    incoming_directory = django_filters.CharFilter(
-        field_name='incoming_directory',
-        lookup_expr='icontains'
-    )
+    incoming_directory = SubstringFilter(field_name='incoming_directory')
 
     version = django_filters.CharFilter(field_name='version',
                                         lookup_expr='icontains')
 
-    tape_url = django_filters.CharFilter(field_name='tape_url',
-                                         lookup_expr='icontains')
+    tape_url = SubstringFilter(field_name='tape_url')
 
     data_submission = django_filters.NumberFilter(
         field_name='data_submission__id'
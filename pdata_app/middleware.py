@@ -0,0 +1,164 @@
+"""
+middleware.py - record the number and duration of the SQL queries and the
+    time taken by each request.
+
+The measurements are logged as JSON by the `pdata_app.middleware` logger,
+added to the response in a Server-Timing header, so that they're shown by
+browsers' developer tools, and saved in `request.query_stats`.
+
+Views can declare the maximum number of queries that they should make in a
+`query_budget` attribute, or with the `query_budget()` decorator for function
+views. A warning is logged when a request exceeds its view's budget and the
+test suite checks that the budgets are met. Budgets include the query that
+checks the cached Settings for changes every SETTINGS_CACHE_TIMEOUT seconds
+if the view uses them, such as to look up the version of the cached tables.
+"""
+from __future__ import unicode_literals, division, absolute_import
+import json
+import logging
+import os
+import time
+import traceback
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# The number of slowest queries to record the SQL and call site of
+NUM_SLOWEST_QUERIES = 5
+# The number of frames of the call site to record
+CALL_SITE_DEPTH = 3
+
+
+def query_budget(budget):
+    """
+    A decorator that sets the query budget of a function view.
+
+    :param int budget: the maximum number of queries
+    """
+    def decorator(view_func):
+        view_func.query_budget = budget
+        return view_func
+    return decorator
+
+
+def get_query_budget(view_func):
+    """
+    Find the query budget of a view function returned by `as_view()` or
+    decorated with `query_budget()`.
+
+    :param view_func: the view
+    :returns: the budget or None if the view doesn't have one
+    :rtype: int
+    """
+    view_class = getattr(view_func, 'view_class', None)
+    if view_class is not None:
+        return getattr(view_class, 'query_budget', None)
+    return getattr(view_func, 'query_budget', None)
+
+
+def _call_site():
+    """
+    The frames of the app's code that made the current query, excluding
+    this module and Django.
+    """
+    base_dir = os.path.abspath(settings.BASE_DIR)
+    this_file = os.path.abspath(__file__)
+    frames = [
+        '{}:{} in {}'.format(os.path.relpath(frame.filename, base_dir),
+                             frame.lineno, frame.name)
+        for frame in traceback.extract_stack()
+        if (frame.filename.startswith(base_dir) and
+            'site-packages' not in frame.filename and
+            os.path.abspath(frame.filename) != this_file)
+    ]
+    return frames[-CALL_SITE_DEPTH:]
+
+
+class QueryRecorder(object):
+    """
+    A database execute wrapper that counts and times the queries.
+    """
+    def __init__(self):
+        self.num_queries = 0
+        self.sql_time = 0.
+        self.slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.num_queries += 1
+            self.sql_time += duration
+            if (len(self.slowest) < NUM_SLOWEST_QUERIES or
+                    duration > self.slowest[-1]['duration']):
+                # the stack is only extracted for the slowest queries as
+                # it's comparatively slow
+                self.slowest.append({'duration': duration, 'sql': sql,
+                                     'call_site': _call_site()})
+                self.slowest.sort(key=lambda query: query['duration'],
+                                  reverse=True)
+                del self.slowest[NUM_SLOWEST_QUERIES:]
+
+
+class QueryTimingMiddleware(object):
+    """
+    Record the queries made and the time taken by each request.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request.query_budget = None
+        request.view_end_time = None
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        end = time.perf_counter()
+
+        stats = {
+            'path': request.path,
+            'method': request.method,
+            'status': response.status_code,
+            'num_queries': recorder.num_queries,
+            'query_budget': request.query_budget,
+            'sql_time': recorder.sql_time,
+            'total_time': end - start,
+            'render_time': (end - request.view_end_time
+                            if request.view_end_time else None),
+            'slowest_queries': recorder.slowest,
+        }
+        request.query_stats = stats
+
+        timings = [
+            'db;dur={:.1f};desc="{} queries"'.format(
+                recorder.sql_time * 1000, recorder.num_queries
+            ),
+            'total;dur={:.1f}'.format(stats['total_time'] * 1000),
+        ]
+        if stats['render_time'] is not None:
+            timings.insert(1, 'render;dur={:.1f}'.format(
+                stats['render_time'] * 1000
+            ))
+        response['Server-Timing'] = ', '.join(timings)
+
+        budget = request.query_budget
+        if budget is not None and recorder.num_queries > budget:
+            logger.warning('{} made {} queries, exceeding its budget of {}'.
+                           format(request.path, recorder.num_queries, budget))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(stats))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func)
+
+    def process_template_response(self, request, response):
+        # called after the view has returned but before the template is
+        # rendered
+        request.view_end_time = time.perf_counter()
+        return response
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdata_app', '0046_variablerequest_out_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datarequest',
+            name='cached_num_files',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Data Files'),
+        ),
+        migrations.AddField(
+            model_name='datarequest',
+            name='cached_size',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Data Size'),
+        ),
+        migrations.AddField(
+            model_name='datarequest',
+            name='cached_num_online',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Files Online'),
+        ),
+        migrations.AddField(
+            model_name='datarequest',
+            name='cached_num_offline',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Files Offline'),
+        ),
+        migrations.AddField(
+            model_name='datarequest',
+            name='cached_num_issues',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Data Issues'),
+        ),
+        migrations.AddField(
+            model_name='datarequest',
+            name='cached_start_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='Start Time'),
+        ),
+        migrations.AddField(
+            model_name='datarequest',
+            name='cached_start_calendar',
+            field=models.CharField(blank=True, max_length=20, null=True, verbose_name='Start Calendar'),
+        ),
+        migrations.AddField(
+            model_name='datarequest',
+            name='cached_end_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='End Time'),
+        ),
+        migrations.AddField(
+            model_name='datarequest',
+            name='cached_end_calendar',
+            field=models.CharField(blank=True, max_length=20, null=True, verbose_name='End Calendar'),
+        ),
+        migrations.AddField(
+            model_name='datasubmission',
+            name='cached_num_files',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Data Files'),
+        ),
+        migrations.AddField(
+            model_name='datasubmission',
+            name='cached_size',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Data Size'),
+        ),
+        migrations.AddField(
+            model_name='datasubmission',
+            name='cached_num_online',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Files Online'),
+        ),
+        migrations.AddField(
+            model_name='datasubmission',
+            name='cached_num_offline',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Files Offline'),
+        ),
+        migrations.AddField(
+            model_name='datasubmission',
+            name='cached_num_issues',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Data Issues'),
+        ),
+        migrations.AddField(
+            model_name='datasubmission',
+            name='cached_start_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='Start Time'),
+        ),
+        migrations.AddField(
+            model_name='datasubmission',
+            name='cached_start_calendar',
+            field=models.CharField(blank=True, max_length=20, null=True, verbose_name='Start Calendar'),
+        ),
+        migrations.AddField(
+            model_name='datasubmission',
+            name='cached_end_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='End Time'),
+        ),
+        migrations.AddField(
+            model_name='datasubmission',
+            name='cached_end_calendar',
+            field=models.CharField(blank=True, max_length=20, null=True, verbose_name='End Calendar'),
+        ),
+        # Existing records keep null values, showing that their aggregations
+        # haven't been cached yet, and only new records default to zero
+        migrations.AlterField(
+            model_name='datarequest',
+            name='cached_num_files',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Data Files', default=0),
+        ),
+        migrations.AlterField(
+            model_name='datarequest',
+            name='cached_size',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Data Size', default=0),
+        ),
+        migrations.AlterField(
+            model_name='datarequest',
+            name='cached_num_online',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Files Online', default=0),
+        ),
+        migrations.AlterField(
+            model_name='datarequest',
+            name='cached_num_offline',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Files Offline', default=0),
+        ),
+        migrations.AlterField(
+            model_name='datarequest',
+            name='cached_num_issues',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Data Issues', default=0),
+        ),
+        migrations.AlterField(
+            model_name='datasubmission',
+            name='cached_num_files',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Data Files', default=0),
+        ),
+        migrations.AlterField(
+            model_name='datasubmission',
+            name='cached_size',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Data Size', default=0),
+        ),
+        migrations.AlterField(
+            model_name='datasubmission',
+            name='cached_num_online',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Files Online', default=0),
+        ),
+        migrations.AlterField(
+            model_name='datasubmission',
+            name='cached_num_offline',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Files Offline', default=0),
+        ),
+        migrations.AlterField(
+            model_name='datasubmission',
+            name='cached_num_issues',
+            field=models.IntegerField(blank=True, null=True, verbose_name='# Data Issues', default=0),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdata_app', '0047_cached_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='settings',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
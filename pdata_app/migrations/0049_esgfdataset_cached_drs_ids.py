@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdata_app', '0048_settings_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='esgfdataset',
+            name='cached_drs_id',
+            field=models.CharField(blank=True, max_length=500, null=True, verbose_name='DRS Id'),
+        ),
+        migrations.AddField(
+            model_name='esgfdataset',
+            name='cached_out_name_drs_id',
+            field=models.CharField(blank=True, max_length=500, null=True, verbose_name='Out Name DRS Id'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdata_app', '0049_esgfdataset_cached_drs_ids'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='datafile',
+            index=models.Index(fields=['data_request', 'online', 'start_time', 'end_time'], name='datafile_dreq_online_time'),
+        ),
+        migrations.AddIndex(
+            model_name='datafile',
+            index=models.Index(condition=models.Q(tape_url__isnull=False), fields=['tape_url'], name='datafile_tape_url'),
+        ),
+        migrations.AddIndex(
+            model_name='datafile',
+            index=models.Index(condition=models.Q(directory__isnull=False), fields=['directory'], name='datafile_directory'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdata_app', '0050_datafile_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='retrievalrequest',
+            name='cached_size',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Request Size'),
+        ),
+        migrations.AddField(
+            model_name='retrievalrequest',
+            name='cached_online_size',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Online Size'),
+        ),
+        migrations.AddField(
+            model_name='retrievalrequest',
+            name='cached_offline_size',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Offline Size'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from pdata_app.utils import substring_search
+
+
+def create_search_indexes(apps, schema_editor):
+    """
+    Create the substring search indexes for the database in use
+    """
+    substring_search.create_search_indexes(schema_editor.connection)
+
+
+def drop_search_indexes(apps, schema_editor):
+    """
+    Remove the substring search indexes
+    """
+    substring_search.drop_search_indexes(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdata_app', '0051_retrievalrequest_cached_sizes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes,
+                             reverse_code=drop_search_indexes),
+    ]
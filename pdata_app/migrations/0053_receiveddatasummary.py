@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_stale_summaries(apps, schema_editor):
+    """
+    Create a stale summary for each DataRequest with files. The Variables
+    Received page shows the values of stale summaries as unknown and so
+    scripts/cache_aggregates.py must be run after migrating to calculate
+    them.
+    """
+    DataFile = apps.get_model('pdata_app', 'DataFile')
+    ReceivedDataSummary = apps.get_model('pdata_app', 'ReceivedDataSummary')
+    data_request_ids = (DataFile.objects.order_by().
+                        values_list('data_request_id', flat=True).distinct())
+    ReceivedDataSummary.objects.bulk_create(
+        [ReceivedDataSummary(data_request_id=req_id)
+         for req_id in data_request_ids],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdata_app', '0052_substring_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceivedDataSummary',
+            fields=[
+                ('data_request', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='received_summary', serialize=False, to='pdata_app.DataRequest', verbose_name='Data Request')),
+                ('stale', models.BooleanField(db_index=True, default=True, verbose_name='Needs Refreshing?')),
+                ('num_files', models.IntegerField(default=0, verbose_name='# Data Files')),
+                ('size', models.BigIntegerField(default=0, verbose_name='Data Size')),
+                ('num_online', models.IntegerField(default=0, verbose_name='# Files Online')),
+                ('num_offline', models.IntegerField(default=0, verbose_name='# Files Offline')),
+                ('num_issues', models.IntegerField(default=0, verbose_name='# Data Issues')),
+                ('start_date', models.CharField(blank=True, max_length=10, null=True, verbose_name='Start Time')),
+                ('end_date', models.CharField(blank=True, max_length=10, null=True, verbose_name='End Time')),
+                ('tape_urls', models.TextField(blank=True, null=True, verbose_name='Tape URLs')),
+                ('versions', models.CharField(blank=True, max_length=500, null=True, verbose_name='File Versions')),
+            ],
+            options={
+                'verbose_name': 'Received Data Summary',
+                'verbose_name_plural': 'Received Data Summaries',
+            },
+        ),
+        migrations.RunPython(create_stale_summaries,
+                             reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdata_app', '0054_settings_table_cache_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='receiveddatasummary',
+            name='versions',
+            field=models.TextField(blank=True, null=True, verbose_name='File Versions'),
+        ),
+    ]
@@ -1,16 +1,30 @@
 from __future__ import unicode_literals, division, absolute_import
+from contextlib import contextmanager
 import re
+import threading
+import time
 
 import cf_units
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connection, connections, models, transaction
 from django.utils import timezone
 from solo.models import SingletonModel
-from django.db.models import PROTECT, SET_NULL, CASCADE
+from django.db.models import (PROTECT, SET_NULL, CASCADE, Case, Count, F,
+                              Max, Min, OuterRef, Q, Subquery, Sum, Value,
+                              When)
+from django.db.models.functions import Coalesce
+from django.db.models.signals import (m2m_changed, post_delete, post_migrate,
+                                      post_save, pre_delete)
+from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 
-from pdata_app.utils.common import standardise_time_unit, safe_strftime
+from pdata_app.utils.common import (date_filter_q, extreme_time, grouper,
+                                    safe_strftime, standardise_time_unit,
+                                    standardise_time_units)
+from pdata_app.utils.substring_search import create_search_indexes
+from pdata_app.utils.table_views import bump_table_cache_version_on_commit
 from vocabs import (STATUS_VALUES, ESGF_STATUSES, FREQUENCY_VALUES,
                     ONLINE_STATUS, CHECKSUM_TYPES, VARIABLE_TYPES, CALENDARS)
 
@@ -18,9 +32,23 @@ model_names = ['Project', 'Institute', 'ClimateModel', 'Experiment',
                'ActivityId', 'DataSubmission', 'DataFile', 'ESGFDataset',
                'CEDADataset', 'DataRequest', 'DataIssue', 'Checksum',
                'Settings', 'VariableRequest', 'RetrievalRequest', 'EmailQueue',
-               'ReplacedFile', 'ObservationDataset', 'ObservationFile']
+               'ReplacedFile', 'ObservationDataset', 'ObservationFile',
+               'ReceivedDataSummary']
 __all__ = model_names
 
+# The fields stored by DataFileCachedAggregationBase
+CACHED_AGGREGATE_FIELDS = ['cached_num_files', 'cached_size',
+                           'cached_num_online', 'cached_num_offline',
+                           'cached_num_issues', 'cached_start_time',
+                           'cached_start_calendar', 'cached_end_time',
+                           'cached_end_calendar']
+# The sizes stored by RetrievalRequest
+RETRIEVAL_SIZE_FIELDS = ['cached_size', 'cached_online_size',
+                         'cached_offline_size']
+# The number of data requests that ReceivedDataSummary.refresh() calculates
+# in each batch
+SUMMARY_REFRESH_CHUNK_SIZE = 500
+
 
 class Settings(SingletonModel):
     """
@@ -44,9 +72,76 @@ class Settings(SingletonModel):
         default='/gws/nopw/j04/primavera4/stream1'
     )
 
+    # incremented on each save so that other processes can tell that their
+    # cached copy is out of date
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # the version of the rendered tables cached by the web pages and the
+    # time that it last changed, which are changed by
+    # pdata_app.utils.table_views.bump_table_cache_version() in any process
+    # without a save
+    table_cache_version = models.CharField(max_length=32, default='',
+                                           editable=False)
+    table_cache_modified = models.DateTimeField(default=timezone.now,
+                                                editable=False)
+
+    # the (settings, time last checked) cached in this process
+    _cached = None
+
     class Meta:
         verbose_name = "Settings"
 
+    def save(self, *args, **kwargs):
+        self.version = (self.version or 0) + 1
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # the table cache version may have been bumped since this copy
+            # was loaded and so mustn't be overwritten
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in
+                ('table_cache_version', 'table_cache_modified')
+            ]
+        super(Settings, self).save(*args, **kwargs)
+        Settings.clear_cache()
+
+    @classmethod
+    def get_cached(cls):
+        """
+        Return the settings from a copy cached in this process. The database
+        is only checked for a change to the settings' version at most once
+        every SETTINGS_CACHE_TIMEOUT seconds, so changes made in other
+        processes (e.g. the admin site) are picked up within that time. The
+        table cache version is refreshed by the same check.
+
+        :returns: the Settings
+        """
+        timeout = getattr(settings, 'SETTINGS_CACHE_TIMEOUT', 60)
+        now = time.time()
+
+        if cls._cached is not None:
+            instance, last_checked = cls._cached
+            if now - last_checked < timeout:
+                return instance
+            current = (cls.objects.filter(pk=instance.pk).
+                       values('version', 'table_cache_version',
+                              'table_cache_modified').first())
+            if current is None or current['version'] != instance.version:
+                instance = cls.get_solo()
+            else:
+                instance.table_cache_version = current['table_cache_version']
+                instance.table_cache_modified = current['table_cache_modified']
+        else:
+            instance = cls.get_solo()
+
+        cls._cached = (instance, now)
+        return instance
+
+    @classmethod
+    def clear_cache(cls):
+        """
+        Remove the copy of the settings cached in this process.
+        """
+        cls._cached = None
+
     def __str__(self):
         return "App Settings"
 
@@ -180,6 +275,157 @@ class VariableRequest(models.Model):
         verbose_name = "Variable Request"
 
 
+class DrsQuerySet(models.QuerySet):
+    """
+    A query set that can load the related objects that are used to construct
+    DRS ids, paths and filenames in the same query as each record.
+    """
+    # The fields of the related objects that are used in the DRS
+    drs_related_fields = ()
+
+    def for_drs(self):
+        """
+        Load the related objects used in the DRS with each record, but only
+        their fields that are used in the DRS.
+        """
+        relations = {field.rsplit('__', 1)[0]
+                     for field in self.drs_related_fields}
+        own_fields = [field.name for field in self.model._meta.concrete_fields]
+        return (self.select_related(*relations).
+                only(*(own_fields + list(self.drs_related_fields))))
+
+
+# The fields of a DataRequest's related objects that are used in the DRS
+DATA_REQUEST_DRS_FIELDS = ('project__short_name', 'institute__short_name',
+                           'climate_model__short_name',
+                           'experiment__short_name',
+                           'variable_request__table_name',
+                           'variable_request__cmor_name',
+                           'variable_request__out_name')
+
+
+class OnlineStatusQuerySet(models.QuerySet):
+    """
+    A query set of datasets that can calculate each dataset's online status
+    in the same query as the datasets.
+    """
+    # The name of the reverse relation to the dataset's files
+    files_relation = 'datafile'
+
+    def _online_status_expression(self):
+        """
+        An expression that finds the online status from the dataset's files.
+        A correlated subquery is used rather than a join so that any filters
+        on the files don't change the counts.
+        """
+        relation = self.model._meta.get_field(self.files_relation)
+        fk_name = relation.field.name
+        statuses = (
+            relation.related_model.objects.
+            filter(**{fk_name: OuterRef('pk')}).
+            order_by().
+            values(fk_name).
+            annotate(num_online=Count('pk', filter=Q(online=True)),
+                     num_offline=Count('pk', filter=Q(online=False))).
+            annotate(status=Case(
+                When(num_offline=0, then=Value(ONLINE_STATUS.online)),
+                When(num_online=0, then=Value(ONLINE_STATUS.offline)),
+                default=Value(ONLINE_STATUS.partial),
+                output_field=models.CharField()
+            )).
+            values('status')
+        )
+        # a dataset without any files is shown as online
+        return Coalesce(Subquery(statuses, output_field=models.CharField()),
+                        Value(ONLINE_STATUS.online))
+
+    def with_online_status(self):
+        """
+        Annotate each dataset with its online status as
+        `annotated_online_status`, which is one of ONLINE_STATUS.online,
+        ONLINE_STATUS.offline or ONLINE_STATUS.partial.
+        """
+        return self.annotate(
+            annotated_online_status=self._online_status_expression()
+        )
+
+
+class CachedOnlineStatusQuerySet(OnlineStatusQuerySet):
+    """
+    An OnlineStatusQuerySet for datasets that cache the number of their files
+    that are online and offline. The cached counts are used when they have
+    been calculated.
+    """
+    def _online_status_expression(self):
+        return Case(
+            When(cached_num_files__isnull=True,
+                 then=super(CachedOnlineStatusQuerySet,
+                            self)._online_status_expression()),
+            When(cached_num_offline=0, then=Value(ONLINE_STATUS.online)),
+            When(cached_num_online=0, then=Value(ONLINE_STATUS.offline)),
+            default=Value(ONLINE_STATUS.partial),
+            output_field=models.CharField()
+        )
+
+
+class DataRequestQuerySet(DrsQuerySet, CachedOnlineStatusQuerySet):
+    drs_related_fields = DATA_REQUEST_DRS_FIELDS
+
+
+class ObservationDatasetQuerySet(OnlineStatusQuerySet):
+    files_relation = 'observationfile'
+
+
+class ESGFDatasetQuerySet(DrsQuerySet):
+    drs_related_fields = (
+        ('data_request__rip_code',) +
+        tuple('data_request__' + field for field in DATA_REQUEST_DRS_FIELDS)
+    )
+
+
+class DataFileQuerySet(DrsQuerySet):
+    drs_related_fields = (DATA_REQUEST_DRS_FIELDS +
+                          ('activity_id__short_name',))
+
+    def with_num_data_issues(self):
+        """
+        Annotate each file with the number of DataIssues attached to it as
+        `annotated_num_data_issues`. A correlated subquery is used rather
+        than a join so that any filters on the DataIssues don't change the
+        counts.
+        """
+        issue_links = DataIssue.data_file.through.objects
+        issue_counts = (issue_links.filter(datafile=OuterRef('pk')).
+                        order_by().
+                        values('datafile').
+                        annotate(num_issues=Count('pk')).
+                        values('num_issues'))
+        return self.annotate(annotated_num_data_issues=Coalesce(
+            Subquery(issue_counts, output_field=models.IntegerField()),
+            Value(0)
+        ))
+
+
+class DataIssueQuerySet(models.QuerySet):
+    def with_num_data_files(self):
+        """
+        Annotate each issue with the number of DataFiles that it's attached
+        to as `annotated_num_data_files`. A correlated subquery is used
+        rather than a join so that any filters on the DataFiles don't change
+        the counts.
+        """
+        file_links = DataIssue.data_file.through.objects
+        file_counts = (file_links.filter(dataissue=OuterRef('pk')).
+                       order_by().
+                       values('dataissue').
+                       annotate(num_files=Count('pk')).
+                       values('num_files'))
+        return self.annotate(annotated_num_data_files=Coalesce(
+            Subquery(file_counts, output_field=models.IntegerField()),
+            Value(0)
+        ))
+
+
 class DataFileAggregationBase(models.Model):
     """
     An abstract base class for datasets containing many files.
@@ -191,13 +437,61 @@ class DataFileAggregationBase(models.Model):
         abstract = True
 
     def _file_aggregation(self, field_name):
-        records = [getattr(datafile, field_name) for datafile in self.get_data_files()]
-        # Return unique sorted set of records
-        unique_records = list(set(records))
-        if unique_records == [None]:
-            return None
-        else:
-            return unique_records
+        return self.bulk_aggregate([self], [field_name])[self.pk][field_name]
+
+    @classmethod
+    def datafile_fk_name(cls):
+        """
+        The name of the DataFile foreign key that points to this model.
+        """
+        return cls.datafile_set.field.name
+
+    @classmethod
+    def bulk_aggregate(cls, records, field_names):
+        """
+        Find the unique values of DataFile fields for many records, such as
+        a page of a table, using a single query per field rather than loading
+        every DataFile of each record.
+
+        :param records: the records (or a query set of them) to aggregate
+        :param list field_names: the names of the DataFile fields
+        :returns: a dictionary keyed by each record's primary key. Each value
+            is a dictionary of the unique values of each field, or None if
+            all of the files have no value.
+        """
+        fk_name = cls.datafile_fk_name()
+        parent_ids = [record.pk for record in records]
+
+        aggregations = {
+            parent_id: {field_name: [] for field_name in field_names}
+            for parent_id in parent_ids
+        }
+
+        for field_name in field_names:
+            field = DataFile._meta.get_field(field_name)
+            values = list(
+                DataFile.objects.
+                filter(**{'{}__in'.format(fk_name): parent_ids}).
+                values_list(fk_name, field_name).
+                order_by(fk_name, field_name).
+                distinct()
+            )
+            if field.is_relation:
+                related = field.related_model.objects.in_bulk(
+                    {value for _parent_id, value in values
+                     if value is not None}
+                )
+                values = [(parent_id, related.get(value))
+                          for parent_id, value in values]
+            for parent_id, value in values:
+                aggregations[parent_id][field_name].append(value)
+
+        for parent_aggregations in aggregations.values():
+            for field_name, unique_records in parent_aggregations.items():
+                if unique_records == [None]:
+                    parent_aggregations[field_name] = None
+
+        return aggregations
 
     def get_data_files(self):
         return self.datafile_set.all()
@@ -224,13 +518,12 @@ class DataFileAggregationBase(models.Model):
         return self._file_aggregation("version")
 
     def get_data_issues(self):
-        records = []
-        for datafile in self.get_data_files():
-            records.extend(datafile.dataissue_set.all())
-
-        records = list(set(records))
-        records.sort(key=lambda di: di.date_time, reverse=True)
-        return records
+        return list(
+            DataIssue.objects.
+            filter(**{'data_file__' + self.datafile_fk_name(): self.pk}).
+            distinct().
+            order_by('-date_time')
+        )
 
     def assign_data_issue(self, issue_text, reporter, date_time=None):
         """
@@ -241,62 +534,66 @@ class DataFileAggregationBase(models.Model):
             reporter=reporter, date_time=date_time)
         data_issue.save()
 
-        data_files = self.get_data_files()
-        data_issue.data_file.add(*data_files)
+        data_issue.add_data_files(self.get_data_files())
 
-    def start_time(self):
-        std_units = Settings.get_solo().standard_time_units
+    def _earliest_time(self, std_units):
+        """
+        Find the earliest start time of all DataFiles.
 
-        start_times = self.datafile_set.values_list('start_time', 'time_units',
-            'calendar')
+        :param str std_units: the units to standardise the times to
+        :returns: a tuple of the earliest time in `std_units` and its calendar
+            or None if no files have a start time
+        """
+        return extreme_time(self.datafile_set.all(), 'start_time', std_units)
 
-        if not start_times:
-            return None
+    def _latest_time(self, std_units):
+        """
+        Find the latest end time of all DataFiles.
 
-        std_times = [
-            (standardise_time_unit(time, unit, std_units, cal), cal)
-            for time, unit, cal in start_times
-        ]
+        :param str std_units: the units to standardise the times to
+        :returns: a tuple of the latest time in `std_units` and its calendar
+            or None if no files have an end time
+        """
+        return extreme_time(self.datafile_set.all(), 'end_time', std_units,
+                            latest=True)
+
+    def start_time(self):
+        std_units = Settings.get_cached().standard_time_units
 
-        none_values_removed = [(std_time, cal)
-                               for std_time, cal in std_times
-                               if std_time is not None]
+        earliest = self._earliest_time(std_units)
 
-        if not none_values_removed:
+        if earliest is None:
             return None
 
-        earliest_time, calendar = min(none_values_removed, key=lambda x: x[0])
+        earliest_time, calendar = earliest
 
         earliest_obj = cf_units.num2date(earliest_time, std_units, calendar)
 
         return earliest_obj.strftime('%Y-%m-%d')
 
     def end_time(self):
-        std_units = Settings.get_solo().standard_time_units
+        std_units = Settings.get_cached().standard_time_units
 
-        end_times = self.datafile_set.values_list('end_time', 'time_units',
-            'calendar')
+        latest = self._latest_time(std_units)
 
-        if not end_times:
+        if latest is None:
             return None
 
-        std_times = [
-            (standardise_time_unit(time, unit, std_units, cal), cal)
-            for time, unit, cal in end_times
-        ]
+        latest_time, calendar = latest
 
-        none_values_removed = [(std_time, cal)
-                               for std_time, cal in std_times
-                               if std_time is not None]
+        latest_obj = cf_units.num2date(latest_time, std_units, calendar)
 
-        if not none_values_removed:
-            return None
+        return latest_obj.strftime('%Y-%m-%d')
 
-        latest_time, calendar = max(none_values_removed, key=lambda x: x[0])
+    def num_files(self):
+        return self.datafile_set.count()
 
-        latest_obj = cf_units.num2date(latest_time, std_units, calendar)
+    def total_size(self):
+        return self.datafile_set.aggregate(Sum('size'))['size__sum']
 
-        return latest_obj.strftime('%Y-%m-%d')
+    def num_data_issues(self):
+        return self.datafile_set.aggregate(
+            Count('dataissue', distinct=True))['dataissue__count']
 
     def online_status(self):
         """
@@ -318,7 +615,216 @@ class DataFileAggregationBase(models.Model):
             return ONLINE_STATUS.online
 
 
-class DataSubmission(DataFileAggregationBase):
+class DataFileCachedAggregationBase(DataFileAggregationBase):
+    """
+    An abstract base class for datasets containing many files that stores
+    the most commonly displayed aggregations of its files.
+
+    The cached values are updated as each DataFile is saved or deleted and as
+    DataIssues are attached to files. Bulk updates (e.g. QuerySet.update())
+    bypass this and so `cache_aggregates()` should be run afterwards. A null
+    `cached_num_files` shows that the values have not been calculated and the
+    aggregations are then calculated from the files.
+    """
+    class Meta:
+        abstract = True
+
+    cached_num_files = models.IntegerField(verbose_name='# Data Files',
+                                           null=True, blank=True, default=0)
+    cached_size = models.BigIntegerField(verbose_name='Data Size',
+                                         null=True, blank=True, default=0)
+    cached_num_online = models.IntegerField(verbose_name='# Files Online',
+                                            null=True, blank=True, default=0)
+    cached_num_offline = models.IntegerField(verbose_name='# Files Offline',
+                                             null=True, blank=True, default=0)
+    cached_num_issues = models.IntegerField(verbose_name='# Data Issues',
+                                            null=True, blank=True, default=0)
+    # Times are in Settings.standard_time_units
+    cached_start_time = models.FloatField(verbose_name='Start Time',
+                                          null=True, blank=True)
+    cached_start_calendar = models.CharField(verbose_name='Start Calendar',
+                                             max_length=20, null=True,
+                                             blank=True)
+    cached_end_time = models.FloatField(verbose_name='End Time',
+                                        null=True, blank=True)
+    cached_end_calendar = models.CharField(verbose_name='End Calendar',
+                                           max_length=20, null=True,
+                                           blank=True)
+
+    @property
+    def is_cached(self):
+        return self.cached_num_files is not None
+
+    @classmethod
+    def cache_aggregates(cls, queryset=None):
+        """
+        Calculate and save the cached aggregations of all of the records in
+        `queryset` using a small number of grouped queries over the
+        DataFiles.
+
+        :param django.db.models.query.QuerySet queryset: the records to
+            update. All records are updated if not specified.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        records = list(queryset.only('pk'))
+        cls._calculate_aggregates(records, queryset.values('pk'))
+        cls.objects.bulk_update(records, CACHED_AGGREGATE_FIELDS,
+                                batch_size=1000)
+
+    @classmethod
+    def calculate_aggregates(cls, records):
+        """
+        Calculate the cached aggregations of `records`, such as the uncached
+        records on a page of a table, without saving them.
+
+        :param list records: the records to calculate the aggregations of
+        """
+        cls._calculate_aggregates(records, [record.pk for record in records])
+
+    @classmethod
+    def _calculate_aggregates(cls, records, parent_ids):
+        """
+        Set the cached aggregation attributes of `records`.
+
+        :param list records: the records to set the attributes of
+        :param parent_ids: the primary keys of `records` as a list or a
+            query set
+        """
+        fk_name = cls.datafile_fk_name()
+        std_units = Settings.get_cached().standard_time_units
+
+        data_files = DataFile.objects.filter(
+            **{'{}__in'.format(fk_name): parent_ids}
+        ).order_by()
+
+        aggregates = {}
+        for values in (data_files.values(fk_name).annotate(
+                num_files=Count('id'),
+                size=Sum('size'),
+                num_online=Count('id', filter=Q(online=True)),
+                num_offline=Count('id', filter=Q(online=False)))):
+            aggregates[values.pop(fk_name)] = values
+
+        # converting between units doesn't change the order of times and so
+        # only the extremes for each units and calendar need standardising
+        time_groups = list(
+            data_files.values_list(fk_name, 'time_units', 'calendar').
+            annotate(Min('start_time'), Max('end_time'))
+        )
+        std_starts = standardise_time_units(
+            [(start, time_units, calendar)
+             for _id, time_units, calendar, start, _end in time_groups],
+            std_units
+        )
+        std_ends = standardise_time_units(
+            [(end, time_units, calendar)
+             for _id, time_units, calendar, _start, end in time_groups],
+            std_units
+        )
+
+        times = {}
+        for (parent_id, _units, calendar, _start, _end), std_start, std_end in (
+                zip(time_groups, std_starts, std_ends)):
+            earliest, latest = times.get(parent_id, (None, None))
+            if std_start is not None and (earliest is None or
+                                          std_start < earliest[0]):
+                earliest = (std_start, calendar)
+            if std_end is not None and (latest is None or
+                                        std_end > latest[0]):
+                latest = (std_end, calendar)
+            times[parent_id] = (earliest, latest)
+
+        # the number of issues is counted separately because the join through
+        # the DataIssues would otherwise multiply the other counts
+        issue_counts = dict(
+            data_files.values_list(fk_name).
+            annotate(Count('dataissue', distinct=True))
+        )
+
+        for record in records:
+            values = aggregates.get(record.pk, {})
+            record.cached_num_files = values.get('num_files', 0)
+            record.cached_size = values.get('size') or 0
+            record.cached_num_online = values.get('num_online', 0)
+            record.cached_num_offline = values.get('num_offline', 0)
+            record.cached_num_issues = issue_counts.get(record.pk, 0)
+            earliest, latest = times.get(record.pk, (None, None))
+            record.cached_start_time, record.cached_start_calendar = (
+                earliest or (None, None))
+            record.cached_end_time, record.cached_end_calendar = (
+                latest or (None, None))
+
+    def update_cached_aggregates(self):
+        """
+        Recalculate and save this record's cached aggregations.
+        """
+        self.cache_aggregates(type(self).objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=CACHED_AGGREGATE_FIELDS)
+
+    def start_time(self):
+        if not self.is_cached:
+            return super(DataFileCachedAggregationBase, self).start_time()
+
+        if self.cached_start_time is None:
+            return None
+
+        std_units = Settings.get_cached().standard_time_units
+        earliest_obj = cf_units.num2date(self.cached_start_time, std_units,
+                                         self.cached_start_calendar)
+
+        return earliest_obj.strftime('%Y-%m-%d')
+
+    def end_time(self):
+        if not self.is_cached:
+            return super(DataFileCachedAggregationBase, self).end_time()
+
+        if self.cached_end_time is None:
+            return None
+
+        std_units = Settings.get_cached().standard_time_units
+        latest_obj = cf_units.num2date(self.cached_end_time, std_units,
+                                       self.cached_end_calendar)
+
+        return latest_obj.strftime('%Y-%m-%d')
+
+    def num_files(self):
+        if not self.is_cached:
+            return super(DataFileCachedAggregationBase, self).num_files()
+        return self.cached_num_files
+
+    def total_size(self):
+        if not self.is_cached:
+            return super(DataFileCachedAggregationBase, self).total_size()
+        return self.cached_size
+
+    def num_data_issues(self):
+        if not self.is_cached:
+            return super(DataFileCachedAggregationBase,
+                         self).num_data_issues()
+        return self.cached_num_issues
+
+    def online_status(self):
+        """
+        Checks aggregation of online status of all DataFiles.
+        Returns one of:
+            ONLINE_STATUS.online
+            ONLINE_STATUS.offline
+            ONLINE_STATUS.partial
+        """
+        if not self.is_cached:
+            return super(DataFileCachedAggregationBase, self).online_status()
+
+        if self.cached_num_offline:
+            if self.cached_num_online:
+                return ONLINE_STATUS.partial
+            else:
+                return ONLINE_STATUS.offline
+        else:
+            return ONLINE_STATUS.online
+
+
+class DataSubmission(DataFileCachedAggregationBase):
     """
     A directory containing a directory tree of data files copied to the
     platform.
@@ -354,6 +860,8 @@ class DataSubmission(DataFileAggregationBase):
                                           verbose_name='Date Submitted',
                                           null=False, blank=False)
 
+    objects = CachedOnlineStatusQuerySet.as_manager()
+
     def __str__(self):
         return "Data Submission: %s" % self.incoming_directory
 
@@ -438,6 +946,118 @@ class ESGFDataset(DataFileAggregationBase):
                                         on_delete=CASCADE,
                                         verbose_name='Data Request')
 
+    objects = ESGFDatasetQuerySet.as_manager()
+
+    # The DRS ids are stored to avoid generating them from the data request
+    # and its files each time the dataset is displayed
+    cached_drs_id = models.CharField(max_length=500, verbose_name='DRS Id',
+                                     null=True, blank=True)
+    cached_out_name_drs_id = models.CharField(max_length=500,
+                                              verbose_name='Out Name DRS Id',
+                                              null=True, blank=True)
+
+    @staticmethod
+    def _generate_drs_ids(queryset, data_request_field=None):
+        """
+        Generate the DRS ids of all of the data requests in `queryset` with
+        one query. The activity id and grid are taken from the first file in
+        each data request.
+
+        :param django.db.models.query.QuerySet queryset: the records to
+            generate the DRS ids for
+        :param str data_request_field: the name of the field in `queryset`'s
+            model that links to the DataRequest, or None if `queryset`
+            contains DataRequests
+        :returns: a dictionary of tuples of the DRS id and the DRS id using
+            the out_name, keyed by the records' primary keys. The ids are
+            None if they can't be generated, for example when the data
+            request has no files.
+        """
+        prefix = data_request_field + '__' if data_request_field else ''
+        first_file = DataFile.objects.filter(
+            data_request=OuterRef(data_request_field or 'pk')
+        ).order_by('pk')
+
+        rows = (queryset.order_by().
+                values_list('pk',
+                            prefix + 'project__short_name',
+                            prefix + 'institute__short_name',
+                            prefix + 'climate_model__short_name',
+                            prefix + 'experiment__short_name',
+                            prefix + 'rip_code',
+                            prefix + 'variable_request__table_name',
+                            prefix + 'variable_request__cmor_name',
+                            prefix + 'variable_request__out_name').
+                annotate(
+                    first_activity_id=Subquery(
+                        first_file.values('activity_id__short_name')[:1]),
+                    first_grid=Subquery(first_file.values('grid')[:1])
+                ))
+
+        drs_ids = {}
+        for (pk, project, institute, climate_model, experiment, rip_code,
+                table_name, cmor_name, out_name, activity_id, grid) in rows:
+            components = [project, activity_id, institute, climate_model,
+                          experiment, rip_code, table_name, cmor_name, grid]
+            if None in components:
+                drs_ids[pk] = (None, None)
+                continue
+            out_name_components = components[:]
+            out_name_components[7] = out_name if out_name else cmor_name
+            drs_ids[pk] = ('.'.join(components),
+                           '.'.join(out_name_components))
+        return drs_ids
+
+    @classmethod
+    def bulk_drs_ids(cls, queryset=None, use_out_name=False):
+        """
+        Generate the DRS ids of many datasets with one query.
+
+        :param django.db.models.query.QuerySet queryset: the datasets. All
+            datasets are used if not specified.
+        :param bool use_out_name: Use out_name if it exists, otherwise use
+            cmor_name.
+        :returns: a dictionary of DRS ids keyed by the datasets' primary
+            keys. The DRS id is None if the dataset's data request has no
+            DataFiles.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        index = 1 if use_out_name else 0
+        return {
+            pk: drs_ids[index]
+            for pk, drs_ids in
+            cls._generate_drs_ids(queryset, 'data_request').items()
+        }
+
+    @classmethod
+    def cache_drs_ids(cls, queryset=None):
+        """
+        Generate and save the stored DRS ids of all of the datasets in
+        `queryset`.
+
+        :param django.db.models.query.QuerySet queryset: the datasets to
+            update. All datasets are updated if not specified.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        drs_ids = cls._generate_drs_ids(queryset, 'data_request')
+        records = list(queryset.filter(pk__in=drs_ids).only('pk'))
+        for record in records:
+            record.cached_drs_id, record.cached_out_name_drs_id = (
+                drs_ids[record.pk])
+        cls.objects.bulk_update(records,
+                                ['cached_drs_id', 'cached_out_name_drs_id'],
+                                batch_size=1000)
+
+    def save(self, *args, **kwargs):
+        self.cached_drs_id, self.cached_out_name_drs_id = (
+            self._generate_drs_ids(
+                DataRequest.objects.filter(pk=self.data_request_id)
+            ).get(self.data_request_id, (None, None))
+        )
+        super(ESGFDataset, self).save(*args, **kwargs)
+
     @property
     def drs_id(self):
         """
@@ -457,6 +1077,11 @@ class ESGFDataset(DataFileAggregationBase):
         :returns: the DRS id
         :rtype: str
         """
+        cached_drs_id = (self.cached_out_name_drs_id if use_out_name else
+                         self.cached_drs_id)
+        if cached_drs_id:
+            return cached_drs_id
+
         if self.data_request.datafile_set.count() == 0:
             raise ValueError('ESGFDataSet from {} has no DataFiles.'.format(
                 self.data_request
@@ -514,7 +1139,7 @@ class ESGFDataset(DataFileAggregationBase):
         return self.get_full_id()
 
 
-class DataRequest(DataFileAggregationBase):
+class DataRequest(DataFileCachedAggregationBase):
     """
     A Data Request for a given set of inputs
     """
@@ -545,6 +1170,8 @@ class DataRequest(DataFileAggregationBase):
                                 null=False, blank=False,
                                 choices=list(CALENDARS.items()))
 
+    objects = DataRequestQuerySet.as_manager()
+
     def start_date_string(self):
         """Return a string containing the start date"""
         dto = cf_units.num2date(self.request_start_time, self.time_units,
@@ -644,6 +1271,35 @@ class DataFile(models.Model):
     online = models.BooleanField(default=True, verbose_name="Is the file online?", null=False, blank=False)
     tape_url = models.CharField(verbose_name="Tape URL", max_length=200, null=True, blank=True)
 
+    objects = DataFileQuerySet.as_manager()
+
+    # The fields that contribute to the cached aggregations of this file's
+    # DataRequest, DataSubmission and ESGFDatasets
+    AGGREGATE_STATE_FIELDS = ('data_request_id', 'data_submission_id', 'size',
+                              'online', 'start_time', 'end_time',
+                              'time_units', 'calendar', 'activity_id_id',
+                              'grid', 'tape_url', 'version')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(DataFile, cls).from_db(db, field_names, values)
+        # record the values loaded so that changes to the cached aggregations
+        # can be calculated when the file is saved
+        instance._loaded_aggregate_state = instance.aggregate_state()
+        return instance
+
+    def aggregate_state(self):
+        """
+        Return a dictionary of the values that contribute to the parents'
+        cached aggregations, the ESGFDatasets' DRS ids and the
+        ReceivedDataSummaries, or None if any of these are deferred.
+        """
+        if self.get_deferred_fields().intersection(
+                self.AGGREGATE_STATE_FIELDS):
+            return None
+        return {field: getattr(self, field)
+                for field in self.AGGREGATE_STATE_FIELDS}
+
     def start_date_string(self):
         """Return a string containing the start date"""
         dto = cf_units.num2date(self.start_time, self.time_units, self.calendar)
@@ -660,6 +1316,20 @@ class DataFile(models.Model):
     class Meta:
         unique_together = ('name', 'directory')
         verbose_name = "Data File"
+        # Lookups by name use the index created by unique_together
+        indexes = [
+            # Finding a data request's files that are online or offline in a
+            # time range, e.g. date_filter_files()
+            models.Index(fields=['data_request', 'online', 'start_time',
+                                 'end_time'],
+                         name='datafile_dreq_online_time'),
+            # Only files on tape have a tape_url and only online files have
+            # a directory
+            models.Index(fields=['tape_url'], name='datafile_tape_url',
+                         condition=Q(tape_url__isnull=False)),
+            models.Index(fields=['directory'], name='datafile_directory',
+                         condition=Q(directory__isnull=False)),
+        ]
 
 
 class ReplacedFile(models.Model):
@@ -768,6 +1438,36 @@ class DataIssue(models.Model):
     # DataFile that the Data Issue corresponds to
     data_file = models.ManyToManyField(DataFile)
 
+    objects = DataIssueQuerySet.as_manager()
+
+    def add_data_files(self, data_files, batch_size=1000):
+        """
+        Attach many DataFiles to this issue. The links are created in batches
+        within a single transaction without loading the files, and files
+        that are already attached are skipped. This is much faster than
+        `data_file.add()` for large numbers of files.
+
+        The m2m_changed signal isn't sent and so the cached number of issues
+        of the files' parents is recalculated afterwards.
+
+        :param django.db.models.query.QuerySet data_files: the files to attach
+        :param int batch_size: the number of links to create in each query
+        """
+        through_model = DataIssue.data_file.through
+        file_ids = (data_files.order_by().values_list('pk', flat=True).
+                    iterator(chunk_size=batch_size))
+
+        with transaction.atomic():
+            for chunk in grouper(file_ids, batch_size):
+                through_model.objects.bulk_create(
+                    [through_model(dataissue_id=self.pk, datafile_id=file_id)
+                     for file_id in chunk],
+                    ignore_conflicts=True
+                )
+            _recount_issues(_issue_parents(self))
+        # bulk_create() doesn't send the m2m_changed signal
+        bump_table_cache_version_on_commit()
+
     def __str__(self):
         return "Data Issue (%s): %s (%s)" % (
             self.date_time.strftime('%Y-%m-%d %H:%M:%S'),
@@ -836,10 +1536,306 @@ class RetrievalRequest(models.Model):
     start_year = models.IntegerField(verbose_name="Start Year", null=True, blank=False)
     end_year = models.IntegerField(verbose_name="End Year", null=True, blank=False)
 
+    # The sizes in bytes of all of the files in the retrieval and of those
+    # that are online and offline. These are recalculated when the
+    # retrieval's data requests or years change and by the scripts that
+    # change many files. Saving a single file clears them and a null
+    # `cached_size` shows that they need to be calculated again.
+    cached_size = models.BigIntegerField(verbose_name='Request Size',
+                                         null=True, blank=True)
+    cached_online_size = models.BigIntegerField(verbose_name='Online Size',
+                                                null=True, blank=True)
+    cached_offline_size = models.BigIntegerField(verbose_name='Offline Size',
+                                                 null=True, blank=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(RetrievalRequest, cls).from_db(db, field_names,
+                                                        values)
+        # the years loaded so that changes to them can be detected on saving
+        instance._loaded_years = (instance.__dict__.get('start_year'),
+                                  instance.__dict__.get('end_year'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        if (getattr(self, '_loaded_years', None) is not None and
+                self._loaded_years != (self.start_year, self.end_year)):
+            # the sizes depend on the years
+            self.calculate_sizes([self])
+        super(RetrievalRequest, self).save(*args, **kwargs)
+        self._loaded_years = (self.start_year, self.end_year)
+
+    @classmethod
+    def calculate_sizes(cls, records):
+        """
+        Calculate the sizes of the files in many retrieval requests, such as
+        the retrievals on a page of a table, without saving them. A single
+        grouped query is used for all of the retrievals with the same years.
+
+        :param list records: the retrievals to calculate the sizes of
+        """
+        records = list(records)
+        retrieval_files = DataFile.objects.filter(
+            data_request__retrievalrequest__in=[record.pk
+                                                for record in records]
+        ).order_by()
+        time_units_calendars = list(
+            retrieval_files.values_list('time_units', 'calendar').distinct()
+        )
+
+        records_by_years = {}
+        for record in records:
+            records_by_years.setdefault((record.start_year, record.end_year),
+                                        []).append(record)
+
+        for (start_year, end_year), year_records in records_by_years.items():
+            sizes = {}
+            for values in (
+                    DataFile.objects.
+                    filter(date_filter_q(time_units_calendars, start_year,
+                                         end_year),
+                           data_request__retrievalrequest__in=[
+                               record.pk for record in year_records]).
+                    order_by().
+                    values(retrieval_id=F('data_request__retrievalrequest')).
+                    annotate(total_size=Sum('size'),
+                             online_size=Sum('size', filter=Q(online=True)),
+                             offline_size=Sum('size',
+                                              filter=Q(online=False)))):
+                sizes[values['retrieval_id']] = values
+
+            for record in year_records:
+                values = sizes.get(record.pk, {})
+                record.cached_size = values.get('total_size') or 0
+                record.cached_online_size = values.get('online_size') or 0
+                record.cached_offline_size = values.get('offline_size') or 0
+
+    @classmethod
+    def cache_sizes(cls, queryset=None):
+        """
+        Calculate and save the sizes of all of the retrievals in `queryset`.
+        Only the sizes are saved and so this can be used while other
+        instances of the retrievals are loaded.
+
+        :param django.db.models.query.QuerySet queryset: the retrievals to
+            update. All retrievals are updated if not specified.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        records = list(queryset.only('pk', 'start_year', 'end_year'))
+        cls.calculate_sizes(records)
+        cls.objects.bulk_update(records, RETRIEVAL_SIZE_FIELDS,
+                                batch_size=1000)
+
+    def retrieval_size(self, online=False, offline=False):
+        """
+        Find the size in bytes of the files in this retrieval, calculating
+        the sizes if they're not already known. Calculated sizes aren't
+        saved, which `cache_sizes()` does.
+
+        :param bool online: show the size of only files that are currently
+            online
+        :param bool offline: show the size of only files that are currently
+            offline
+        :rtype: int
+        :raises ValueError: if both online and offline are set
+        """
+        if online and offline:
+            msg = 'online and offline arguments cannot both be True'
+            raise ValueError(msg)
+
+        if self.cached_size is None:
+            self.calculate_sizes([self])
+
+        if online:
+            return self.cached_online_size
+        elif offline:
+            return self.cached_offline_size
+        else:
+            return self.cached_size
+
     def __str__(self):
         return '{}'.format(self.id)
 
 
+class ReceivedDataSummary(models.Model):
+    """
+    A summary of the files received for a DataRequest, holding everything
+    shown on the Variables Received page so that the page doesn't need to
+    join through the files. There is one summary for each DataRequest that
+    has files.
+
+    A summary is marked as stale when a file in its data request is saved or
+    deleted, or when the data issues attached to its files change. A stale
+    summary is created for a data request when its first file is saved.
+    `refresh()` recalculates the stale summaries and is run on exit from
+    `deferred_file_updates()`, by the scripts that ingest, retrieve and
+    delete files, and by `cache_aggregates.py --uncached-only`, which should
+    be run periodically to pick up changes made elsewhere, such as in the
+    admin. The page only reads the summaries and shows the values of stale
+    ones as unknown.
+    """
+    class Meta:
+        verbose_name = 'Received Data Summary'
+        verbose_name_plural = 'Received Data Summaries'
+
+    data_request = models.OneToOneField(DataRequest, on_delete=CASCADE,
+                                        primary_key=True,
+                                        related_name='received_summary',
+                                        verbose_name='Data Request')
+    stale = models.BooleanField(default=True, db_index=True,
+                                verbose_name='Needs Refreshing?')
+
+    num_files = models.IntegerField(verbose_name='# Data Files', default=0)
+    size = models.BigIntegerField(verbose_name='Data Size', default=0)
+    num_online = models.IntegerField(verbose_name='# Files Online',
+                                     default=0)
+    num_offline = models.IntegerField(verbose_name='# Files Offline',
+                                      default=0)
+    num_issues = models.IntegerField(verbose_name='# Data Issues', default=0)
+    start_date = models.CharField(verbose_name='Start Time', max_length=10,
+                                  null=True, blank=True)
+    end_date = models.CharField(verbose_name='End Time', max_length=10,
+                                null=True, blank=True)
+    tape_urls = models.TextField(verbose_name='Tape URLs', null=True,
+                                 blank=True)
+    versions = models.TextField(verbose_name='File Versions', null=True,
+                                blank=True)
+
+    @classmethod
+    def mark_stale(cls, data_request_ids):
+        """
+        Mark the summaries of the data requests with `data_request_ids` as
+        stale, creating them if they don't exist.
+
+        :param list data_request_ids: the ids of the data requests
+        """
+        data_request_ids = {req_id for req_id in data_request_ids
+                            if req_id is not None}
+        if not data_request_ids:
+            return
+        num_marked = cls.objects.filter(
+            data_request_id__in=data_request_ids
+        ).update(stale=True)
+        if num_marked < len(data_request_ids):
+            cls.objects.bulk_create(
+                [cls(data_request_id=req_id) for req_id in data_request_ids],
+                ignore_conflicts=True
+            )
+
+    @classmethod
+    def refresh(cls, data_request_ids=None):
+        """
+        Recalculate the summaries of the data requests with
+        `data_request_ids`, creating the summaries of data requests that now
+        have files and deleting those of data requests that no longer do.
+
+        :param list data_request_ids: the ids of the data requests to
+            summarise. The stale summaries are refreshed if not specified.
+        :returns: the number of data requests summarised
+        :rtype: int
+        """
+        if data_request_ids is None:
+            data_request_ids = cls.objects.filter(stale=True).values_list(
+                'data_request_id', flat=True
+            )
+        data_request_ids = sorted({req_id for req_id in data_request_ids
+                                   if req_id is not None})
+        for chunk in grouper(data_request_ids, SUMMARY_REFRESH_CHUNK_SIZE):
+            cls._refresh_chunk(list(chunk))
+        return len(data_request_ids)
+
+    @classmethod
+    def _refresh_chunk(cls, data_request_ids):
+        """
+        Recalculate the summaries of a batch of data requests.
+
+        The existing summaries are locked while they're calculated so that a
+        concurrent change to their files waits to mark them as stale until
+        the new values have been saved, rather than the mark being
+        overwritten. Summaries that don't exist yet can't be locked and so
+        are created only if another refresh hasn't already created them.
+        """
+        with transaction.atomic():
+            existing_ids = set(
+                cls.objects.select_for_update().
+                filter(data_request_id__in=data_request_ids).
+                values_list('data_request_id', flat=True)
+            )
+            summaries = cls._calculate_summaries(data_request_ids)
+            cls.objects.bulk_update(
+                [summary for summary in summaries
+                 if summary.data_request_id in existing_ids],
+                [field.name for field in cls._meta.concrete_fields
+                 if not field.primary_key]
+            )
+            new_summaries = [summary for summary in summaries
+                             if summary.data_request_id not in existing_ids]
+            if new_summaries:
+                cls.objects.bulk_create(new_summaries, ignore_conflicts=True)
+            empty_ids = existing_ids.difference(
+                summary.data_request_id for summary in summaries
+            )
+            if empty_ids:
+                cls.objects.filter(data_request_id__in=empty_ids).delete()
+
+    @classmethod
+    def _calculate_summaries(cls, data_request_ids):
+        """
+        Calculate the summaries of the data requests with `data_request_ids`
+        that have files, without saving them.
+
+        :param list data_request_ids: the ids of the data requests
+        :returns: the summaries
+        :rtype: list
+        """
+        data_requests = list(DataRequest.objects.filter(
+            pk__in=data_request_ids
+        ).only('pk'))
+        DataRequest.calculate_aggregates(data_requests)
+        aggregations = DataRequest.bulk_aggregate(data_requests,
+                                                  ['tape_url', 'version'])
+
+        summaries = []
+        for data_request in data_requests:
+            if not data_request.cached_num_files:
+                continue
+            file_values = aggregations[data_request.pk]
+            summaries.append(cls(
+                data_request_id=data_request.pk,
+                stale=False,
+                num_files=data_request.cached_num_files,
+                size=data_request.cached_size,
+                num_online=data_request.cached_num_online,
+                num_offline=data_request.cached_num_offline,
+                num_issues=data_request.cached_num_issues,
+                start_date=data_request.start_time(),
+                end_date=data_request.end_time(),
+                tape_urls=_join_values(file_values['tape_url']),
+                versions=_join_values(file_values['version'])
+            ))
+        return summaries
+
+    def online_status(self):
+        """
+        Checks aggregation of online status of all DataFiles.
+        Returns one of:
+            ONLINE_STATUS.online
+            ONLINE_STATUS.offline
+            ONLINE_STATUS.partial
+        """
+        if self.num_offline:
+            if self.num_online:
+                return ONLINE_STATUS.partial
+            else:
+                return ONLINE_STATUS.offline
+        else:
+            return ONLINE_STATUS.online
+
+    def __str__(self):
+        return '{}'.format(self.data_request)
+
+
 class EmailQueue(models.Model):
     """
     A collection of emails that have been queued to send
@@ -901,6 +1897,8 @@ class ObservationDataset(models.Model):
                                           verbose_name='Directory',
                                           null=True, blank=True)
 
+    objects = ObservationDatasetQuerySet.as_manager()
+
     def _file_aggregation(self, field_name):
         records = [getattr(obs_file, field_name)
                    for obs_file in self.obs_files]
@@ -950,27 +1948,14 @@ class ObservationDataset(models.Model):
 
     @property
     def start_time(self):
-        std_units = Settings.get_solo().standard_time_units
-
-        start_times = self.obs_files.values_list('start_time', 'time_units',
-                                                 'calendar')
-
-        if not start_times:
-            return None
-
-        std_times = [
-            (standardise_time_unit(time, unit, std_units, cal), cal)
-            for time, unit, cal in start_times
-        ]
+        std_units = Settings.get_cached().standard_time_units
 
-        none_values_removed = [(std_time, cal)
-                               for std_time, cal in std_times
-                               if std_time is not None]
+        earliest = extreme_time(self.obs_files.all(), 'start_time', std_units)
 
-        if not none_values_removed:
+        if earliest is None:
             return None
 
-        earliest_time, calendar = min(none_values_removed, key=lambda x: x[0])
+        earliest_time, calendar = earliest
 
         earliest_obj = cf_units.num2date(earliest_time, std_units, calendar)
 
@@ -978,27 +1963,15 @@ class ObservationDataset(models.Model):
 
     @property
     def end_time(self):
-        std_units = Settings.get_solo().standard_time_units
-
-        end_times = self.obs_files.values_list('end_time', 'time_units',
-                                               'calendar')
-
-        if not end_times:
-            return None
-
-        std_times = [
-            (standardise_time_unit(time, unit, std_units, cal), cal)
-            for time, unit, cal in end_times
-        ]
+        std_units = Settings.get_cached().standard_time_units
 
-        none_values_removed = [(std_time, cal)
-                               for std_time, cal in std_times
-                               if std_time is not None]
+        latest = extreme_time(self.obs_files.all(), 'end_time', std_units,
+                              latest=True)
 
-        if not none_values_removed:
+        if latest is None:
             return None
 
-        latest_time, calendar = max(none_values_removed, key=lambda x: x[0])
+        latest_time, calendar = latest
 
         latest_obj = cf_units.num2date(latest_time, std_units, calendar)
 
@@ -1117,3 +2090,449 @@ class ObservationFile(models.Model):
 
     def __str__(self):
         return '{} (Directory: {})'.format(self.name, self.incoming_directory)
+
+
+def _join_values(values):
+    """
+    Join the unique values of a file field found by `bulk_aggregate()` into
+    a comma separated string, or None if there are no values.
+    """
+    values = [value for value in values or [] if value]
+    return ', '.join(values) if values else None
+
+
+def _file_contribution(state):
+    """
+    The amounts that a DataFile with aggregate state `state` adds to its
+    parents' cached counts.
+    """
+    if state is None:
+        return {}
+    return {
+        'cached_num_files': 1,
+        'cached_size': state['size'],
+        'cached_num_online': 1 if state['online'] else 0,
+        'cached_num_offline': 0 if state['online'] else 1
+    }
+
+
+def _standardised_times(state, std_units):
+    """
+    The start and end times of a DataFile with aggregate state `state` in
+    `std_units`.
+    """
+    if state is None:
+        return None, None
+    return (standardise_time_unit(state['start_time'], state['time_units'],
+                                  std_units, state['calendar']),
+            standardise_time_unit(state['end_time'], state['time_units'],
+                                  std_units, state['calendar']))
+
+
+def _apply_file_change(model, parent_id, old_state, new_state, std_units):
+    """
+    Update the cached aggregations of one parent record when a DataFile's
+    contribution changes from `old_state` to `new_state`. Either state may be
+    None if the file has been added to or removed from the parent.
+    """
+    parent = model.objects.filter(pk=parent_id, cached_num_files__isnull=False)
+
+    old_contribution = _file_contribution(old_state)
+    new_contribution = _file_contribution(new_state)
+    deltas = {}
+    for field in set(old_contribution) | set(new_contribution):
+        delta = (new_contribution.get(field, 0) -
+                 old_contribution.get(field, 0))
+        if delta:
+            deltas[field] = F(field) + delta
+    if deltas:
+        parent.update(**deltas)
+
+    time_fields = ('start_time', 'end_time', 'time_units', 'calendar')
+    if (old_state and new_state and
+            all(old_state[fld] == new_state[fld] for fld in time_fields)):
+        return
+
+    old_start, old_end = _standardised_times(old_state, std_units)
+    if old_start is not None or old_end is not None:
+        # removing the old times may move the bounds inwards and so they
+        # must be recalculated from the files
+        on_boundary = Q()
+        if old_start is not None:
+            on_boundary |= Q(cached_start_time__gte=old_start)
+        if old_end is not None:
+            on_boundary |= Q(cached_end_time__lte=old_end)
+        if parent.filter(on_boundary).exists():
+            model.cache_aggregates(parent)
+            return
+
+    new_start, new_end = _standardised_times(new_state, std_units)
+    if new_start is not None:
+        parent.filter(
+            Q(cached_start_time__isnull=True) |
+            Q(cached_start_time__gt=new_start)
+        ).update(cached_start_time=new_start,
+                 cached_start_calendar=new_state['calendar'])
+    if new_end is not None:
+        parent.filter(
+            Q(cached_end_time__isnull=True) |
+            Q(cached_end_time__lt=new_end)
+        ).update(cached_end_time=new_end,
+                 cached_end_calendar=new_state['calendar'])
+
+
+def _update_parent_aggregates(old_state, new_state):
+    """
+    Update the cached aggregations of a DataFile's DataRequest and
+    DataSubmission when the file changes from `old_state` to `new_state`.
+
+    :returns: a dictionary of the ids of the parent records affected keyed
+        by parent model
+    """
+    std_units = Settings.get_cached().standard_time_units
+    affected = {}
+    for model in (DataRequest, DataSubmission):
+        fk_attname = model.datafile_fk_name() + '_id'
+        old_id = old_state[fk_attname] if old_state else None
+        new_id = new_state[fk_attname] if new_state else None
+        if old_id == new_id:
+            changes = [(new_id, old_state, new_state)]
+        else:
+            changes = [(old_id, old_state, None), (new_id, None, new_state)]
+        for parent_id, old, new in changes:
+            if parent_id is not None:
+                _apply_file_change(model, parent_id, old, new, std_units)
+        affected[model] = [parent_id for parent_id in (old_id, new_id)
+                           if parent_id is not None]
+    return affected
+
+
+def _recount_issues(parent_ids):
+    """
+    Recalculate the cached number of DataIssues of the parent records.
+
+    :param dict parent_ids: the ids of the records to update keyed by
+        parent model
+    """
+    deferred_ids = _deferred_parent_ids()
+    if deferred_ids is not None:
+        for model, ids in parent_ids.items():
+            deferred_ids[model].update(ids)
+        return
+    ReceivedDataSummary.mark_stale(parent_ids.get(DataRequest, []))
+    for model, ids in parent_ids.items():
+        fk_name = model.datafile_fk_name()
+        num_issues = (DataFile.objects.filter(**{fk_name: OuterRef('pk')}).
+                      order_by().values(fk_name).
+                      annotate(num=Count('dataissue', distinct=True)).
+                      values('num'))
+        model.objects.filter(pk__in=ids, cached_num_files__isnull=False).update(
+            cached_num_issues=Coalesce(
+                Subquery(num_issues, output_field=models.IntegerField()),
+                0
+            )
+        )
+
+
+def _issue_parents(data_issue):
+    """
+    Find the parent records of all of the files that `data_issue` is
+    attached to.
+
+    :returns: a dictionary of parent ids keyed by parent model
+    """
+    parents = {}
+    for model in (DataRequest, DataSubmission):
+        fk_name = model.datafile_fk_name()
+        parents[model] = list(
+            DataFile.objects.filter(dataissue=data_issue).order_by().
+            values_list(fk_name, flat=True).distinct()
+        )
+    return parents
+
+
+def _update_drs_ids(old_state, new_state):
+    """
+    Regenerate the stored DRS ids of the ESGFDatasets of a DataFile's data
+    requests if the file may have changed them when it changed from
+    `old_state` to `new_state`.
+    """
+    drs_fields = ('data_request_id', 'activity_id_id', 'grid')
+    if (old_state and new_state and
+            all(old_state[fld] == new_state[fld] for fld in drs_fields)):
+        return
+
+    datasets = ESGFDataset.objects.filter(data_request_id__in=[
+        state['data_request_id'] for state in (old_state, new_state) if state
+    ])
+    if old_state is None:
+        # a new file is only used in the DRS id if it's the data request's
+        # first file
+        datasets = datasets.filter(cached_drs_id__isnull=True)
+    ESGFDataset.cache_drs_ids(datasets)
+
+
+def _clear_retrieval_sizes(retrieval_requests):
+    """
+    Clear the stored sizes of `retrieval_requests` so that they are
+    recalculated when next needed.
+
+    :param django.db.models.query.QuerySet retrieval_requests: the
+        retrievals to clear
+    """
+    retrieval_requests.filter(cached_size__isnull=False).update(
+        **{field: None for field in RETRIEVAL_SIZE_FIELDS}
+    )
+
+
+def _update_retrieval_sizes(old_state, new_state):
+    """
+    Clear the stored sizes of the retrievals of a DataFile's data requests
+    if the file's change from `old_state` to `new_state` may have changed
+    them.
+    """
+    size_fields = ('data_request_id', 'size', 'online', 'start_time',
+                   'end_time', 'time_units', 'calendar')
+    if (old_state and new_state and
+            all(old_state[fld] == new_state[fld] for fld in size_fields)):
+        return
+
+    _clear_retrieval_sizes(RetrievalRequest.objects.filter(
+        data_request__in=[state['data_request_id']
+                          for state in (old_state, new_state) if state]
+    ))
+
+
+# The parents of the DataFiles changed while updates are deferred by
+# deferred_file_updates() in the current thread
+_deferred_updates = threading.local()
+
+
+def _deferred_parent_ids():
+    """
+    The ids of the DataRequests and DataSubmissions to refresh when
+    `deferred_file_updates()` exits, keyed by model, or None if updates
+    aren't being deferred.
+    """
+    return getattr(_deferred_updates, 'parent_ids', None)
+
+
+@contextmanager
+def deferred_file_updates():
+    """
+    Defer the updates that are normally made each time that a DataFile is
+    saved or deleted, or a DataIssue is attached to or removed from files.
+
+    Each save normally updates the cached values of the file's DataRequest,
+    DataSubmission, ESGFDatasets, RetrievalRequests and ReceivedDataSummary,
+    which takes ten or more queries. Inside this context the ids of the
+    affected parents are collected instead and their cached values are
+    recalculated once, in a fixed number of queries, on exit. Loops that
+    save many files should use this::
+
+        with deferred_file_updates():
+            for data_file in data_files:
+                data_file.online = False
+                data_file.save()
+
+    The cached values are out of date until the context exits. Nested
+    contexts are refreshed when the outermost exits. The updates are skipped
+    if the exit is caused by an error that has broken the current
+    transaction, which will be rolled back.
+    """
+    if _deferred_parent_ids() is not None:
+        yield
+        return
+
+    _deferred_updates.parent_ids = {DataRequest: set(), DataSubmission: set()}
+    try:
+        yield
+    finally:
+        parent_ids = _deferred_updates.parent_ids
+        _deferred_updates.parent_ids = None
+        if not connection.needs_rollback:
+            _refresh_file_parents(parent_ids)
+
+
+def _defer_file_parents(*states):
+    """
+    Record the parents of the DataFiles with aggregate `states` to be
+    refreshed when `deferred_file_updates()` exits.
+    """
+    parent_ids = _deferred_parent_ids()
+    for state in states:
+        if state:
+            parent_ids[DataRequest].add(state['data_request_id'])
+            parent_ids[DataSubmission].add(state['data_submission_id'])
+
+
+def _refresh_file_parents(parent_ids):
+    """
+    Recalculate the cached values that depend on the files of the parent
+    records in `parent_ids` and invalidate the cached tables.
+
+    :param dict parent_ids: the ids of the DataRequests and DataSubmissions
+        keyed by model
+    """
+    request_ids = sorted(pk for pk in parent_ids[DataRequest]
+                         if pk is not None)
+    for chunk in grouper(request_ids, SUMMARY_REFRESH_CHUNK_SIZE):
+        chunk = list(chunk)
+        DataRequest.cache_aggregates(DataRequest.objects.filter(pk__in=chunk))
+        ESGFDataset.cache_drs_ids(
+            ESGFDataset.objects.filter(data_request_id__in=chunk))
+        RetrievalRequest.cache_sizes(
+            RetrievalRequest.objects.filter(data_request__in=chunk).distinct())
+    submission_ids = sorted(pk for pk in parent_ids[DataSubmission]
+                            if pk is not None)
+    for chunk in grouper(submission_ids, SUMMARY_REFRESH_CHUNK_SIZE):
+        DataSubmission.cache_aggregates(
+            DataSubmission.objects.filter(pk__in=list(chunk)))
+    ReceivedDataSummary.refresh(request_ids)
+    bump_table_cache_version_on_commit()
+
+
+@receiver(post_save, sender=DataFile)
+def _data_file_saved(sender, instance, created, **kwargs):
+    old_state = (None if created else
+                 getattr(instance, '_loaded_aggregate_state', None))
+    new_state = instance.aggregate_state()
+
+    if _deferred_parent_ids() is not None:
+        _defer_file_parents(old_state, new_state or DataFile.objects.filter(
+            pk=instance.pk).values('data_request_id',
+                                   'data_submission_id').first())
+    elif not created and (old_state is None or new_state is None):
+        # the values previously saved aren't known so recalculate the
+        # current parents from scratch
+        parent_ids = DataFile.objects.filter(pk=instance.pk).values(
+            'data_request_id', 'data_submission_id').first()
+        DataRequest.cache_aggregates(DataRequest.objects.filter(
+            pk=parent_ids['data_request_id']))
+        DataSubmission.cache_aggregates(DataSubmission.objects.filter(
+            pk=parent_ids['data_submission_id']))
+        ESGFDataset.cache_drs_ids(ESGFDataset.objects.filter(
+            data_request_id=parent_ids['data_request_id']))
+        _clear_retrieval_sizes(RetrievalRequest.objects.filter(
+            data_request=parent_ids['data_request_id']))
+        ReceivedDataSummary.mark_stale([parent_ids['data_request_id']])
+    elif created or old_state != new_state:
+        affected = _update_parent_aggregates(old_state, new_state)
+        if (old_state and (
+                old_state['data_request_id'] != new_state['data_request_id'] or
+                old_state['data_submission_id'] !=
+                new_state['data_submission_id'])):
+            _recount_issues(affected)
+        _update_drs_ids(old_state, new_state)
+        _update_retrieval_sizes(old_state, new_state)
+        ReceivedDataSummary.mark_stale([state['data_request_id'] for state in
+                                        (old_state, new_state) if state])
+
+    instance._loaded_aggregate_state = new_state
+
+
+@receiver(post_delete, sender=DataFile)
+def _data_file_deleted(sender, instance, **kwargs):
+    old_state = getattr(instance, '_loaded_aggregate_state', None)
+    if old_state is None:
+        old_state = instance.aggregate_state()
+    if old_state is None:
+        return
+    if _deferred_parent_ids() is not None:
+        _defer_file_parents(old_state)
+        return
+    affected = _update_parent_aggregates(old_state, None)
+    _recount_issues(affected)
+    _update_drs_ids(old_state, None)
+    _update_retrieval_sizes(old_state, None)
+
+
+@receiver(m2m_changed, sender=DataIssue.data_file.through)
+def _data_issue_files_changed(sender, instance, action, reverse, **kwargs):
+    if reverse:
+        # instance is a DataFile
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _recount_issues({
+                DataRequest: [instance.data_request_id],
+                DataSubmission: [instance.data_submission_id]
+            })
+    else:
+        # instance is a DataIssue
+        if action in ('pre_remove', 'pre_clear'):
+            instance._affected_parents = _issue_parents(instance)
+        elif action == 'post_add':
+            _recount_issues(_issue_parents(instance))
+        elif action in ('post_remove', 'post_clear'):
+            _recount_issues(getattr(instance, '_affected_parents', {}))
+
+
+@receiver(pre_delete, sender=DataIssue)
+def _data_issue_deleting(sender, instance, **kwargs):
+    instance._affected_parents = _issue_parents(instance)
+
+
+@receiver(post_delete, sender=DataIssue)
+def _data_issue_deleted(sender, instance, **kwargs):
+    _recount_issues(getattr(instance, '_affected_parents', {}))
+
+
+@receiver(m2m_changed, sender=RetrievalRequest.data_request.through)
+def _retrieval_data_requests_changed(sender, instance, action, reverse,
+                                     pk_set, **kwargs):
+    if reverse:
+        # instance is a DataRequest and pk_set contains retrieval ids
+        if action == 'pre_clear':
+            instance._cleared_retrieval_ids = list(
+                RetrievalRequest.objects.filter(data_request=instance).
+                values_list('pk', flat=True)
+            )
+            return
+        elif action == 'post_clear':
+            retrieval_ids = getattr(instance, '_cleared_retrieval_ids', [])
+        elif action in ('post_add', 'post_remove'):
+            retrieval_ids = pk_set
+        else:
+            return
+        RetrievalRequest.cache_sizes(
+            RetrievalRequest.objects.filter(pk__in=retrieval_ids))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        # the sizes of the instance are updated too so that saving it
+        # afterwards doesn't overwrite them
+        instance.calculate_sizes([instance])
+        RetrievalRequest.objects.filter(pk=instance.pk).update(
+            **{field: getattr(instance, field)
+               for field in RETRIEVAL_SIZE_FIELDS}
+        )
+
+
+def _invalidate_table_cache(sender, **kwargs):
+    # m2m_changed is also sent before each change and only the changes
+    # themselves need to invalidate the cached tables
+    if kwargs.get('action', 'post_').startswith('pre_'):
+        return
+    # deferred_file_updates() invalidates the tables once when it exits
+    if _deferred_parent_ids() is not None:
+        return
+    bump_table_cache_version_on_commit(kwargs.get('using'))
+
+
+# only the models that are shown in the cached tables invalidate them. The
+# summaries are refreshed together with an invalidation, the settings hold the
+# version itself and queued emails aren't shown.
+for _model in [globals()[name] for name in model_names
+               if name not in ('ReceivedDataSummary', 'Settings',
+                               'EmailQueue')]:
+    post_save.connect(_invalidate_table_cache, sender=_model)
+    post_delete.connect(_invalidate_table_cache, sender=_model)
+for _through in (DataIssue.data_file.through,
+                 RetrievalRequest.data_request.through):
+    m2m_changed.connect(_invalidate_table_cache, sender=_through)
+
+
+@receiver(post_migrate)
+def _check_search_indexes(sender, using, **kwargs):
+    # the indexes are missing if the migrations were regenerated rather than
+    # applied and SQLite drops their triggers when a migration recreates a
+    # table
+    if sender.name == 'pdata_app':
+        create_search_indexes(connections[using])
@@ -6,7 +6,6 @@ try:
 except ImportError:
     from urllib import urlencode  # Python 2.7
 
-from django.db.models import Count, Sum
 from django.template.defaultfilters import filesizeformat
 from django.utils.html import format_html
 from django.urls import reverse
@@ -14,17 +13,91 @@ import django_tables2 as tables
 
 from .models import (DataRequest, DataSubmission, DataFile, ESGFDataset,
                      CEDADataset, DataIssue, VariableRequest, RetrievalRequest,
-                     ReplacedFile, ObservationDataset, ObservationFile)
-
-from pdata_app.utils.common import get_request_size
+                     ReplacedFile, ObservationDataset, ObservationFile,
+                     CACHED_AGGREGATE_FIELDS, RETRIEVAL_SIZE_FIELDS)
 
 DEFAULT_VALUE = '—'
 
 
+def online_status(record):
+    """
+    Return the online status of `record`, using the value annotated by
+    `with_online_status()` if the table's query set was annotated.
+    """
+    status = getattr(record, 'annotated_online_status', None)
+    if status is None:
+        status = record.online_status()
+    return status
+
+
+def _page_records(table):
+    """
+    The records on the current page of `table`, or all of its records if it
+    isn't paginated.
+    """
+    if hasattr(table, 'page'):
+        return [row.record for row in table.page.object_list]
+    else:
+        return list(table.data)
+
+
+class PageAggregationMixin(object):
+    """
+    Aggregate the DataFiles of all of the records on the current page of a
+    table in a fixed number of queries, rather than several queries per
+    record. `aggregated_fields` is the list of DataFile fields that are
+    aggregated.
+    """
+    aggregated_fields = ()
+
+    def paginate(self, *args, **kwargs):
+        super(PageAggregationMixin, self).paginate(*args, **kwargs)
+        # django-tables2 resolves each column's value from the record before
+        # calling its render method and so the records must have their
+        # aggregations before the first row is rendered
+        self._aggregate_page()
+
+    def _aggregate_page(self):
+        """
+        Calculate the cached aggregations of all of the uncached records on
+        the current page and the unique values of `aggregated_fields` for
+        all of the records, if this hasn't been done already.
+        """
+        if hasattr(self, '_page_aggregations'):
+            return
+        records = _page_records(self)
+        if not records:
+            self._page_aggregations = {}
+            return
+        model = type(records[0])
+        uncached = [record for record in records if not record.is_cached]
+        if uncached:
+            model.calculate_aggregates(uncached)
+        self._page_aggregations = model.bulk_aggregate(
+            records, self.aggregated_fields
+        )
+
+    def page_aggregates(self, record):
+        """
+        Return `record` after making sure that its cached aggregations are
+        available.
+        """
+        self._aggregate_page()
+        return record
+
+    def file_aggregation(self, record, field_name):
+        """
+        Return the unique values of `field_name` in `record`'s DataFiles.
+        """
+        self._aggregate_page()
+        return self._page_aggregations[record.pk][field_name]
+
+
 class DataFileTable(tables.Table):
     class Meta:
         model = DataFile
         attrs = {'class': 'paleblue'}
+        template_name = 'pdata_app/keyset_table.html'
         exclude = ('id', 'incoming_directory', 'project', 'start_time',
                    'end_time', 'variable_request', 'frequency',
                    'time_units', 'calendar', 'data_submission', 'esgf_dataset',
@@ -55,7 +128,10 @@ class DataFileTable(tables.Table):
                             verbose_name='Project')
 
     def render_checksum(self, record):
-        checksum = record.checksum_set.first()
+        # use all() so that checksums loaded by prefetch_related() are used
+        checksums = sorted(record.checksum_set.all(),
+                           key=lambda checksum: checksum.pk)
+        checksum = checksums[0] if checksums else None
         if checksum:
             return '{}: {}'.format(checksum.checksum_type,
                                    checksum.checksum_value)
@@ -63,7 +139,9 @@ class DataFileTable(tables.Table):
             return DEFAULT_VALUE
 
     def render_num_dataissues(self, record):
-        num_dataissues = record.dataissue_set.count()
+        num_dataissues = getattr(record, 'annotated_num_data_issues', None)
+        if num_dataissues is None:
+            num_dataissues = record.dataissue_set.count()
         url_query = urlencode({'data_file': record.id,
                                'data_file_string': '{} ({})'.format(
                                    record.name,
@@ -78,11 +156,11 @@ class DataFileTable(tables.Table):
         return filesizeformat(value)
 
 
-class DataSubmissionTable(tables.Table):
+class DataSubmissionTable(PageAggregationMixin, tables.Table):
     class Meta:
         model = DataSubmission
         attrs = {'class': 'paleblue'}
-        exclude = ('id',)
+        exclude = ('id',) + tuple(CACHED_AGGREGATE_FIELDS)
         per_page = 10
         sequence = ('incoming_directory', 'directory', 'status',
                     'date_submitted', 'user', 'online_status', 'num_files',
@@ -102,6 +180,8 @@ class DataSubmissionTable(tables.Table):
     file_versions = tables.Column(empty_values=(), orderable=False)
     user = tables.Column(accessor='user__username', verbose_name='User')
 
+    aggregated_fields = ('tape_url', 'version')
+
     def render_date_submitted(self, value):
         return value.strftime('%Y-%m-%d %H:%M')
 
@@ -109,13 +189,13 @@ class DataSubmissionTable(tables.Table):
         if record.status in ['PENDING_PROCESSING', 'ARRIVED']:
             return DEFAULT_VALUE
         else:
-            return record.online_status()
+            return online_status(record)
 
     def render_num_files(self, record):
         if record.status in ['PENDING_PROCESSING', 'ARRIVED']:
             return DEFAULT_VALUE
         else:
-            num_datafiles = record.datafile_set.count()
+            num_datafiles = self.page_aggregates(record).num_files()
             url_query = urlencode({'data_submission': record.id,
                                    'data_submission_string': '{}'.format(
                                        record.incoming_directory)})
@@ -129,8 +209,7 @@ class DataSubmissionTable(tables.Table):
         if record.status in ['PENDING_PROCESSING', 'ARRIVED']:
             return DEFAULT_VALUE
         else:
-            num_dataissues = record.datafile_set.aggregate(
-                Count('dataissue', distinct=True))['dataissue__count']
+            num_dataissues = self.page_aggregates(record).num_data_issues()
             url_query = urlencode({'data_submission': record.id,
                                    'data_submission_string': '{}'.format(
                                        record.incoming_directory)})
@@ -144,7 +223,7 @@ class DataSubmissionTable(tables.Table):
         if record.status in ['PENDING_PROCESSING', 'ARRIVED']:
             return DEFAULT_VALUE
         else:
-            start_time = record.start_time()
+            start_time = self.page_aggregates(record).start_time()
             if start_time:
                 return start_time
             else:
@@ -154,7 +233,7 @@ class DataSubmissionTable(tables.Table):
         if record.status in ['PENDING_PROCESSING', 'ARRIVED']:
             return DEFAULT_VALUE
         else:
-            end_time = record.end_time()
+            end_time = self.page_aggregates(record).end_time()
             if end_time:
                 return end_time
             else:
@@ -164,7 +243,7 @@ class DataSubmissionTable(tables.Table):
         if record.status in ['PENDING_PROCESSING', 'ARRIVED']:
             return DEFAULT_VALUE
         else:
-            tape_urls = record.get_tape_urls()
+            tape_urls = self.file_aggregation(record, 'tape_url')
             return format_html('<div class="truncate-ellipsis"><span>{}'
                                '</span></div>'.
                                format(_to_comma_sep(tape_urls)))
@@ -173,7 +252,7 @@ class DataSubmissionTable(tables.Table):
         if record.status in ['PENDING_PROCESSING', 'ARRIVED']:
             return DEFAULT_VALUE
         else:
-            file_versions = record.get_file_versions()
+            file_versions = self.file_aggregation(record, 'version')
             return _to_comma_sep(file_versions)
 
 
@@ -181,7 +260,8 @@ class DataRequestTable(tables.Table):
     class Meta:
         model = DataRequest
         attrs = {'class': 'paleblue'}
-        exclude = ('id', 'time_units', 'calendar', 'variable_request')
+        exclude = (('id', 'time_units', 'calendar', 'variable_request') +
+                   tuple(CACHED_AGGREGATE_FIELDS))
         sequence = ('project', 'institute', 'climate_model', 'experiment',
                     'mip_table', 'rip_code', 'cmor_name', 'request_start_time',
                     'request_end_time')
@@ -210,8 +290,9 @@ class DataReceivedTable(DataRequestTable):
     class Meta:
         model = DataRequest
         attrs = {'class': 'paleblue'}
-        exclude = ('id', 'time_units', 'calendar', 'variable_request',
-                   'request_start_time', 'request_end_time')
+        exclude = (('id', 'time_units', 'calendar', 'variable_request',
+                    'request_start_time', 'request_end_time') +
+                   tuple(CACHED_AGGREGATE_FIELDS))
         sequence = ('project', 'institute', 'climate_model', 'experiment',
                     'mip_table', 'rip_code', 'cmor_name', 'start_time',
                     'end_time', 'online_status', 'num_files', 'num_issues',
@@ -241,17 +322,30 @@ class DataReceivedTable(DataRequestTable):
     project = tables.Column(accessor='project__short_name',
                             verbose_name='Project')
 
+    @staticmethod
+    def _summary(record):
+        """
+        Return the summary of `record`'s files, or None if it's stale and so
+        its values aren't known until it's refreshed.
+        """
+        summary = record.received_summary
+        return None if summary.stale else summary
+
     def render_start_time(self, record):
-        return record.start_time()
+        summary = self._summary(record)
+        return (summary and summary.start_date) or DEFAULT_VALUE
 
     def render_end_time(self, record):
-        return record.end_time()
+        summary = self._summary(record)
+        return (summary and summary.end_date) or DEFAULT_VALUE
 
     def render_online_status(self, record):
-        return record.online_status()
+        summary = self._summary(record)
+        return summary.online_status() if summary else DEFAULT_VALUE
 
     def render_num_files(self, record):
-        num_datafiles = record.datafile_set.count()
+        summary = self._summary(record)
+        num_datafiles = summary.num_files if summary else DEFAULT_VALUE
         url_query = urlencode({'data_request': record.id,
                                'data_request_string': '{}'.format(record)})
         return format_html('<a href="{}?{}">{}</a>'.format(
@@ -261,8 +355,8 @@ class DataReceivedTable(DataRequestTable):
         ))
 
     def render_num_issues(self, record):
-        num_dataissues = record.datafile_set.aggregate(
-            Count('dataissue', distinct=True))['dataissue__count']
+        summary = self._summary(record)
+        num_dataissues = summary.num_issues if summary else DEFAULT_VALUE
         url_query = urlencode({'data_request': record.id,
                                'data_request_string': '{}'.format(record)})
         return format_html('<a href="{}?{}">{}</a>'.format(
@@ -272,13 +366,14 @@ class DataReceivedTable(DataRequestTable):
         ))
 
     def render_tape_urls(self, record):
-        tape_urls = record.get_tape_urls()
+        summary = self._summary(record)
+        tape_urls = (summary and summary.tape_urls) or DEFAULT_VALUE
         return format_html('<div class="truncate-ellipsis"><span>{}'
-                           '</span></div>'.format(_to_comma_sep(tape_urls)))
+                           '</span></div>'.format(tape_urls))
 
     def render_file_versions(self, record):
-        file_versions = record.get_file_versions()
-        return _to_comma_sep(file_versions)
+        summary = self._summary(record)
+        return (summary and summary.versions) or DEFAULT_VALUE
 
     def render_retrieval_request(self, record):
         return format_html(
@@ -288,15 +383,15 @@ class DataReceivedTable(DataRequestTable):
         )
 
     def render_total_data_size(self, record):
-        return filesizeformat(
-            record.datafile_set.aggregate(Sum('size'))['size__sum'])
+        summary = self._summary(record)
+        return filesizeformat(summary.size) if summary else DEFAULT_VALUE
 
 
 class ESGFDatasetTable(tables.Table):
     class Meta:
         model = ESGFDataset
         attrs = {'class': 'paleblue'}
-        exclude = ('id',)
+        exclude = ('id', 'cached_drs_id', 'cached_out_name_drs_id')
 
     data_request = tables.Column(orderable=False)
 
@@ -337,7 +432,9 @@ class DataIssueTable(tables.Table):
         return value.strftime('%Y-%m-%d %H:%M')
 
     def render_num_files_affected(self, record):
-        num_files_affected = record.data_file.count()
+        num_files_affected = getattr(record, 'annotated_num_data_files', None)
+        if num_files_affected is None:
+            num_files_affected = record.data_file.count()
         url_query = urlencode({'data_issue': record.id,
                                'data_issue_string': '{} ({})\n{}{}'.format(
                                    record.reporter,
@@ -366,6 +463,7 @@ class RetrievalRequestTable(tables.Table):
     class Meta:
         model = RetrievalRequest
         attrs = {'class': 'paleblue'}
+        exclude = tuple(RETRIEVAL_SIZE_FIELDS)
         order_by = '-date_created'
 
     requester = tables.Column(accessor='requester__username',
@@ -406,25 +504,54 @@ class RetrievalRequestTable(tables.Table):
             return DEFAULT_VALUE
 
     def render_data_reqs(self, record):
-        reqs_str = ', \n'.join([str(dr) for dr in record.data_request.all()])
+        # the view prefetches the data requests with the fields for their DRS
+        reqs_str = ', \n'.join([str(dr)
+                                 for dr in record.data_request.all()])
         return reqs_str
 
+    def _page_sizes(self, record):
+        """
+        Return `record` after making sure that its sizes are known. The
+        sizes of all of the retrievals on the current page without stored
+        sizes are calculated together. They aren't saved, as rendering a
+        page doesn't change the database.
+        """
+        if not hasattr(self, '_page_sizes_calculated'):
+            uncached = [page_record for page_record in _page_records(self)
+                        if page_record.cached_size is None]
+            if uncached:
+                RetrievalRequest.calculate_sizes(uncached)
+            self._page_sizes_calculated = True
+        return record
+
     def render_req_size(self, record):
-        return filesizeformat(get_request_size(record.data_request.all(),
-                                               record.start_year,
-                                               record.end_year))
+        return filesizeformat(self._page_sizes(record).retrieval_size())
 
     def render_retrieval_size(self, record):
-        return filesizeformat(get_request_size(record.data_request.all(),
-                                               record.start_year,
-                                               record.end_year,
-                                               offline = True))
+        return filesizeformat(
+            self._page_sizes(record).retrieval_size(offline=True)
+        )
 
-    def render_tape_urls(self, record):
-        tape_urls = list(record.data_request.all().values_list(
-            'datafile__tape_url', flat=True).distinct())
+    def _page_tape_urls(self, record):
+        """
+        Return the tape URLs of the files in `record`. The tape URLs of all
+        of the retrievals on the current page are found together.
+        """
+        if not hasattr(self, '_tape_urls'):
+            self._tape_urls = {}
+            rows = (DataFile.objects.
+                    filter(data_request__retrievalrequest__in=[
+                        page_record.pk for page_record in _page_records(self)
+                    ], tape_url__isnull=False).
+                    order_by().
+                    values_list('data_request__retrievalrequest', 'tape_url').
+                    distinct())
+            for retrieval_id, tape_url in rows:
+                self._tape_urls.setdefault(retrieval_id, []).append(tape_url)
+        return self._tape_urls.get(record.pk, [])
 
-        tape_urls_str = ', '.join([tu for tu in tape_urls if tu is not None])
+    def render_tape_urls(self, record):
+        tape_urls_str = ', '.join(self._page_tape_urls(record))
 
         return format_html('<div class="truncate-ellipsis"><span>{}'
                            '</span></div>'.format(tape_urls_str))
@@ -0,0 +1,28 @@
+"""
+Django tags to render tables that are cached by PagedFilteredTableView.
+"""
+from django import template
+from django.utils.safestring import mark_safe
+from django_tables2.templatetags.django_tables2 import RenderTableNode
+
+from pdata_app.utils.table_views import set_cached_table
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def render_cached_table(context):
+    """
+    Render the context's table in the same way as render_table, or use the
+    copy of it from the cache if the view found one. A newly rendered table
+    is saved in the cache if the view's table is cached.
+    """
+    cached_table = context.get('cached_table')
+    if cached_table is not None:
+        return mark_safe(cached_table)
+
+    html = RenderTableNode(template.Variable('table')).render(context)
+    table_cache_key = context.get('table_cache_key')
+    if table_cache_key:
+        set_cached_table(table_cache_key, html)
+    return mark_safe(html)
@@ -7,6 +7,7 @@ import django
 django.setup()
 
 from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections
 
 from pdata_app import models
 from pdata_app.utils import dbapi
@@ -171,3 +172,40 @@ def make_example_files(parent_obj):
                                      rip_code='r1i1p1', grid='g2',
                                      data_submission=dsub, online=True,
                                      version='v87654321')
+
+
+def assert_within_query_budget(test_case, response):
+    """
+    Check that the request that produced `response` made no more queries
+    than its view's budget. The counts are recorded by
+    `pdata_app.middleware.QueryTimingMiddleware`.
+
+    :param django.test.TestCase test_case: the test
+    :param response: the response from the test client
+    """
+    stats = response.wsgi_request.query_stats
+    test_case.assertIsNotNone(stats['query_budget'],
+                              '{} has no query budget'.format(stats['path']))
+    test_case.assertLessEqual(
+        stats['num_queries'], stats['query_budget'],
+        '{} made {} queries, exceeding its budget of {}. The slowest were '
+        'made from:\n{}'.format(
+            stats['path'], stats['num_queries'], stats['query_budget'],
+            '\n'.join(' < '.join(reversed(query['call_site']))
+                      for query in stats['slowest_queries'])
+        )
+    )
+
+
+def run_on_commit_callbacks(using=DEFAULT_DB_ALIAS):
+    """
+    Run the callbacks that are waiting for the current transaction to be
+    committed, which never happens in a TestCase.
+
+    :param str using: the alias of the database
+    """
+    db_connection = connections[using]
+    callbacks = db_connection.run_on_commit
+    db_connection.run_on_commit = []
+    for _sids, func in callbacks:
+        func()
@@ -0,0 +1,96 @@
+"""
+test_api.py - unit tests for pdata_app.api
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from pdata_app import models
+from pdata_app.api import DataFileApi
+from .common import make_example_files, run_on_commit_callbacks
+
+
+class TestApi(TestCase):
+    """
+    Test the JSON API
+    """
+    def setUp(self):
+        cache.clear()
+        make_example_files(self)
+
+    def _get(self, url_name, params=None, **headers):
+        response = self.client.get(reverse(url_name), params or {},
+                                   **headers)
+        return response
+
+    def test_all_fields(self):
+        response = self._get('api_data_files', {'name': 'test4'})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(sorted(results[0]), sorted(DataFileApi.fields))
+        self.assertEqual(results[0]['directory'], '/some/dir2')
+
+    def test_fields(self):
+        response = self._get('api_data_files', {'fields': 'name,size',
+                                                'directory': 'dir2'})
+        self.assertEqual(response.json(), {
+            'next': None,
+            'results': [{'name': 'test4', 'size': 4},
+                        {'name': 'test8', 'size': 8}]
+        })
+
+    def test_unknown_field(self):
+        response = self._get('api_data_files', {'fields': 'name,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_pagination(self):
+        names = []
+        params = {'fields': 'name', 'limit': 3}
+        url = None
+        while True:
+            if url:
+                response = self.client.get(url)
+            else:
+                response = self._get('api_data_files', params)
+            content = response.json()
+            names.extend(result['name'] for result in content['results'])
+            url = content['next']
+            if not url:
+                break
+        self.assertEqual(names, list(models.DataFile.objects.order_by('pk').
+                                     values_list('name', flat=True)))
+
+    def test_many_to_many(self):
+        ret_req = models.RetrievalRequest.objects.create(
+            requester=self.user, start_year=1950, end_year=1960
+        )
+        ret_req.data_request.add(self.dreq2, self.dreq1)
+        response = self._get('api_retrieval_requests',
+                             {'fields': 'requester__username,data_request'})
+        self.assertEqual(response.json()['results'], [{
+            'requester__username': 'fred',
+            'data_request': sorted([self.dreq1.id, self.dreq2.id])
+        }])
+
+    def test_resources(self):
+        for url_name in ('api_data_requests', 'api_esgf_datasets',
+                         'api_obs_sets'):
+            response = self._get(url_name)
+            self.assertEqual(response.status_code, 200)
+
+    def test_etag(self):
+        response = self._get('api_data_requests')
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self._get('api_data_requests',
+                                 HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.data_file1.delete()
+        run_on_commit_callbacks()
+        response = self._get('api_data_requests', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
@@ -2,6 +2,9 @@
 test_common.py - unit tests for pdata_app.utils.common.py
 """
 from __future__ import unicode_literals, division, absolute_import
+import os
+import shutil
+import tempfile
 import six
 
 try:
@@ -20,19 +23,89 @@ from django.test import TestCase
 from pdata_app import models
 from pdata_app.utils.common import (make_partial_date_time,
                                     standardise_time_unit,
+                                    standardise_time_units, extreme_time,
                                     calc_last_day_in_month, pdt2num,
                                     is_same_gws, get_gws, get_gws_any_dir,
                                     construct_drs_path,
                                     construct_filename,
                                     construct_cylc_task_name,
                                     construct_time_string, get_request_size,
-                                    date_filter_files, grouper,
+                                    date_filter_files, date_filter_q,
+                                    grouper,
                                     directories_spanned, run_ncatted,
-                                    run_ncrename)
+                                    run_ncrename, adler32, md5, sha256,
+                                    checksums, checksum_files,
+                                    read_file_with_checksums)
 from pdata_app.utils import dbapi
 from .common import make_example_files
 
 
+class TestChecksums(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.file_path = os.path.join(self.temp_dir, 'Wikipedia')
+        with open(self.file_path, 'wb') as fh:
+            fh.write(b'Wikipedia')
+
+    def test_adler32(self):
+        self.assertEqual(adler32(self.file_path), '300286872')
+
+    def test_md5(self):
+        self.assertEqual(md5(self.file_path),
+                         '9c677286866aad38f8e9b660f5411814')
+
+    def test_sha256(self):
+        self.assertEqual(sha256(self.file_path),
+                         'd38b38a2dd476e045c299e8ee5d6466834456d97bd592a71746'
+                         'b423a6a05f386')
+
+    def test_several_methods(self):
+        self.assertEqual(
+            checksums(self.file_path, ['adler32', 'md5sum']),
+            {'adler32': '300286872',
+             'md5sum': '9c677286866aad38f8e9b660f5411814'}
+        )
+
+    @mock.patch('pdata_app.utils.common.CHECKSUM_BUFFER_SIZE', 4)
+    def test_several_reads(self):
+        self.assertEqual(adler32(self.file_path), '300286872')
+
+    @mock.patch('pdata_app.utils.common._checksum')
+    def test_fallback(self, mock_checksum):
+        mock_checksum.return_value = None
+        missing_path = os.path.join(self.temp_dir, 'missing')
+        self.assertIsNone(adler32(missing_path))
+        mock_checksum.assert_called_once_with('adler32', missing_path)
+
+    @mock.patch('pdata_app.utils.common._checksum')
+    def test_unknown_method(self, mock_checksum):
+        mock_checksum.return_value = '1234'
+        self.assertEqual(checksums(self.file_path, ['cksum']),
+                         {'cksum': '1234'})
+
+    def test_checksum_files(self):
+        other_path = os.path.join(self.temp_dir, 'other')
+        with open(other_path, 'wb') as fh:
+            fh.write(b'')
+        self.assertEqual(checksum_files([self.file_path, other_path],
+                                        'adler32', 2),
+                         {self.file_path: '300286872', other_path: '1'})
+
+    @mock.patch('pdata_app.utils.common.CHECKSUM_BUFFER_SIZE', 4)
+    def test_read_file_with_checksums(self):
+        contents, values = read_file_with_checksums(self.file_path,
+                                                    ['adler32', 'md5sum'])
+        self.assertEqual(contents, b'Wikipedia')
+        self.assertEqual(values,
+                         {'adler32': '300286872',
+                          'md5sum': '9c677286866aad38f8e9b660f5411814'})
+
+    def test_read_file_with_unknown_method(self):
+        self.assertRaises(ValueError, read_file_with_checksums,
+                          self.file_path, ['cksum'])
+
+
 class TestMakePartialDateTime(TestCase):
     def test_yyyymm(self):
         expected = PartialDateTime(year=2014, month=8)
@@ -160,6 +233,67 @@ class TestStandardiseTimeUnit(TestCase):
                                                 time_unit, '360_day'))
 
 
+class TestStandardiseTimeUnits(TestCase):
+    """
+    Test standardise_time_units()
+    """
+    def test_matches_single_times(self):
+        std_unit = 'days since 1950-01-01'
+        times = [
+            (33.14159, 'days since 2000-01-01', '360_day'),
+            (12.5, 'hours since 1900-01-01', 'gregorian'),
+            (-7.0, 'days since 2000-01-01', '360_day'),
+            (None, 'days since 2000-01-01', '360_day'),
+            (100.25, 'days since 1950-01-01', '365_day'),
+            (17.75, 'days since 1850-01-01', None),
+            (1.5e5, 'hours since 1900-01-01', 'gregorian'),
+        ]
+
+        actual = standardise_time_units(times, std_unit)
+        expected = [standardise_time_unit(time_num, time_unit, std_unit, cal)
+                    for time_num, time_unit, cal in times]
+        self.assertEqual(actual, expected)
+
+    def test_empty(self):
+        self.assertEqual(standardise_time_units([], 'days since 1950-01-01'),
+                         [])
+
+
+class TestExtremeTime(TestCase):
+    """
+    Test extreme_time()
+    """
+    def setUp(self):
+        make_example_files(self)
+        self.std_unit = 'days since 1950-01-01'
+        # the same instant as test1's start time in different units
+        self.data_file4 = models.DataFile.objects.get(name='test4')
+        self.data_file4.start_time = -1.0
+        self.data_file4.time_units = 'days since 1950-01-02'
+        self.data_file4.save()
+
+    def test_earliest(self):
+        actual = extreme_time(self.dreq1.datafile_set.all(), 'start_time',
+                              self.std_unit)
+        self.assertEqual(actual, (0, '360_day'))
+
+    def test_latest(self):
+        actual = extreme_time(self.dreq1.datafile_set.all(), 'end_time',
+                              self.std_unit, latest=True)
+        self.assertEqual(actual, (14400, '360_day'))
+
+    def test_different_units(self):
+        self.data_file4.start_time = -2.0
+        self.data_file4.save()
+        actual = extreme_time(self.dreq1.datafile_set.all(), 'start_time',
+                              self.std_unit)
+        self.assertEqual(actual, (-1.0, '360_day'))
+
+    def test_no_times(self):
+        self.assertIsNone(extreme_time(self.dreq2.datafile_set.all(),
+                                       'start_time', self.std_unit))
+
+
 class TestIsSameGws(TestCase):
     def test_same(self):
         path1 = '/group_workspaces/jasmin2/primavera1/some/dir'
@@ -476,6 +610,28 @@ class TestDateFilterFiles(TestCase):
                                                        1975, 1985)))
 
 
+class TestDateFilterQ(TestCase):
+    """
+    Test that date_filter_q() selects the same files as date_filter_files()
+    """
+    def setUp(self):
+        make_example_files(self)
+
+    def test_matches_date_filter_files(self):
+        data_files = models.DataFile.objects.all()
+        time_units_calendars = set(data_files.values_list('time_units',
+                                                          'calendar'))
+        for start_year, end_year in ((1949, 1961), (1949, 1975),
+                                     (1965, 1995), (1955, 1987),
+                                     (2001, 2014), (None, 1975)):
+            self.assertEqual(
+                _assertable(data_files.filter(date_filter_q(
+                    time_units_calendars, start_year, end_year))),
+                _assertable(date_filter_files(data_files, start_year,
+                                              end_year))
+            )
+
+
 class TestGrouper(TestCase):
     def test_exact_multiple(self):
         actual = [list(chunk) for chunk in grouper(range(8), 4)]
@@ -0,0 +1,66 @@
+"""
+test_fk_resolver.py - unit tests for pdata_app.utils.fk_resolver
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+from django.test import TestCase
+
+from pdata_app import models
+from pdata_app.utils.fk_resolver import ForeignKeyResolver
+from .common import make_example_files
+
+
+class TestForeignKeyResolver(TestCase):
+    """
+    Test ForeignKeyResolver
+    """
+    def setUp(self):
+        make_example_files(self)
+        self.resolver = ForeignKeyResolver()
+        self.drs = (models.Project.objects.get(short_name='t'),
+                    models.Institute.objects.get(short_name='MOHC'),
+                    models.ClimateModel.objects.get(short_name='t'),
+                    models.Experiment.objects.get(short_name='t'))
+
+    def test_short_name(self):
+        institute = self.resolver.short_name('institute', 'MOHC')
+        self.assertEqual(institute.full_name, 'Met Office Hadley Centre')
+        self.assertIsNone(self.resolver.short_name('institute', 'mohc'))
+
+    def test_short_name_loaded_once(self):
+        with self.assertNumQueries(1):
+            self.resolver.short_name('climate_model', 't')
+            self.resolver.short_name('climate_model', 'better-model')
+            self.resolver.short_name('climate_model', 'missing')
+
+    def test_data_requests(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.resolver.data_requests(*self.drs, table_name='Amon',
+                                            rip_code='r1i1p1f1',
+                                            cmor_name='var1'),
+                [self.dreq1]
+            )
+            self.assertEqual(
+                self.resolver.data_requests(*self.drs, table_name='Amon',
+                                            rip_code='r1i2p3f4',
+                                            var_name='var1'),
+                [self.dreq4]
+            )
+            self.assertEqual(
+                self.resolver.data_requests(*self.drs, table_name='Amon',
+                                            rip_code='r1i1p1f1',
+                                            cmor_name='var3'),
+                []
+            )
+            self.assertEqual(
+                self.resolver.data_requests(*self.drs, table_name='Amon',
+                                            rip_code='r1i1p1f1',
+                                            var_name='var2')[0].
+                variable_request.dimensions,
+                'massive'
+            )
+
+    def test_data_requests_name_required(self):
+        self.assertRaises(ValueError, self.resolver.data_requests,
+                          *self.drs, table_name='Amon', rip_code='r1i1p1f1')
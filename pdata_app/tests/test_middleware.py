@@ -0,0 +1,137 @@
+"""
+test_middleware.py - unit tests for pdata_app.middleware and the query
+    budgets of the views
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import get_resolver, reverse
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pdata_app import models
+from pdata_app.middleware import get_query_budget
+from pdata_app.views import DataFileList
+from .common import assert_within_query_budget, make_example_files
+
+
+def _url_patterns(resolver):
+    """
+    All of the URL patterns of `resolver` and the resolvers it includes.
+    """
+    for pattern in resolver.url_patterns:
+        if hasattr(pattern, 'url_patterns'):
+            for sub_pattern in _url_patterns(pattern):
+                yield sub_pattern
+        else:
+            yield pattern
+
+
+class TestQueryTimingMiddleware(TestCase):
+    """
+    Test QueryTimingMiddleware
+    """
+    def setUp(self):
+        cache.clear()
+        make_example_files(self)
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('data_files'))
+        stats = response.wsgi_request.query_stats
+        self.assertGreater(stats['num_queries'], 0)
+        self.assertIsNotNone(stats['render_time'])
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('"{} queries"'.format(stats['num_queries']),
+                      response['Server-Timing'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+
+    def test_slowest_queries(self):
+        response = self.client.get(reverse('data_files'))
+        slowest = response.wsgi_request.query_stats['slowest_queries']
+        self.assertTrue(slowest)
+        durations = [query['duration'] for query in slowest]
+        self.assertEqual(durations, sorted(durations, reverse=True))
+        call_sites = [site for query in slowest
+                      for site in query['call_site']]
+        self.assertTrue(any(site.startswith('pdata_app') for site in
+                            call_sites))
+
+    def test_budget_exceeded(self):
+        with mock.patch.object(DataFileList, 'query_budget', 1):
+            with self.assertLogs('pdata_app.middleware', 'WARNING') as logs:
+                self.client.get(reverse('data_files'))
+        self.assertIn('exceeding its budget of 1', logs.output[0])
+
+
+class TestQueryBudgets(TestCase):
+    """
+    Test that the views with query budgets keep to them when there are
+    several rows on each page.
+    """
+    def setUp(self):
+        cache.clear()
+        make_example_files(self)
+        esgf_dataset = models.ESGFDataset.objects.first()
+        for index in range(3):
+            esgf_dataset.pk = None
+            esgf_dataset.version = 'v{}'.format(index)
+            esgf_dataset.data_request = self.dreq2
+            esgf_dataset.save()
+            retrieval = models.RetrievalRequest.objects.create(
+                requester=self.user, start_year=1950, end_year=1960
+            )
+            retrieval.data_request.add(self.dreq1, self.dreq2)
+            data_issue = models.DataIssue.objects.create(issue='issue',
+                                                         reporter=self.user)
+            data_issue.data_file.add(self.data_file1, self.data_file2)
+        # as the scripts that add the files would
+        models.ReceivedDataSummary.refresh()
+        self.client.force_login(self.user)
+
+    def test_class_views(self):
+        names = [pattern.name for pattern in _url_patterns(get_resolver())
+                 if pattern.name and
+                 hasattr(pattern.callback, 'view_class') and
+                 get_query_budget(pattern.callback) is not None]
+        self.assertIn('data_files', names)
+        for name in names:
+            for expire_settings in (False, True):
+                cache.clear()
+                models.Settings.clear_cache()
+                settings = models.Settings.get_cached()
+                if expire_settings:
+                    # as when the cached settings are next checked for
+                    # changes, which any of the views may have to do
+                    models.Settings._cached = (settings, 0)
+                response = self.client.get(reverse(name))
+                self.assertEqual(response.status_code, 200)
+                assert_within_query_budget(self, response)
+
+    def test_uncached_submissions(self):
+        # as a submission whose files were added without their signals, when
+        # the cached settings are also due to be checked
+        models.DataSubmission.objects.update(cached_num_files=None)
+        models.Settings.clear_cache()
+        models.Settings._cached = (models.Settings.get_cached(), 0)
+        response = self.client.get(reverse('data_submissions'))
+        self.assertEqual(response.status_code, 200)
+        assert_within_query_budget(self, response)
+
+    def test_retrieval_views(self):
+        response = self.client.post(reverse('retrieval_years'), {
+            'request_data_req_{}'.format(self.dreq1.id): 'on',
+            'request_data_req_{}'.format(self.dreq2.id): 'on',
+            'variables_received_url': '/received_data/'
+        })
+        assert_within_query_budget(self, response)
+        response = self.client.post(reverse('confirm_retrieval'), {
+            'data_request_ids': '{},{}'.format(self.dreq1.id, self.dreq2.id),
+            'start_year': 1950,
+            'end_year': 1960,
+            'return_url': '/received_data/'
+        })
+        assert_within_query_budget(self, response)
@@ -13,7 +13,8 @@ import netcdftime
 import pytz
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.db.models import F
+from django.test import TestCase, override_settings
 from django.core.exceptions import ValidationError
 from django.utils.timezone import make_aware
 
@@ -22,11 +23,61 @@ from vocabs import (STATUS_VALUES, ONLINE_STATUS, FREQUENCY_VALUES,
     CHECKSUM_TYPES, VARIABLE_TYPES, CALENDARS)
 from pdata_app.utils.dbapi import get_or_create
 from test.test_datasets import test_data_submission
+from pdata_app.utils.common import (construct_cylc_task_name,
+                                    construct_drs_path)
+from .common import make_example_files
 
 
 TIME_UNITS = 'days since 1900-01-01'
 
 
+class TestSettings(TestCase):
+    """
+    Test Settings.get_cached()
+    """
+    def setUp(self):
+        models.Settings.clear_cache()
+
+    def tearDown(self):
+        models.Settings.clear_cache()
+
+    def _change_in_other_process(self):
+        models.Settings.objects.update(version=F('version') + 1,
+                                       contact_user_id='someone')
+
+    def test_cached(self):
+        settings = models.Settings.get_cached()
+        with self.assertNumQueries(0):
+            self.assertIs(models.Settings.get_cached(), settings)
+
+    def test_save_invalidates(self):
+        settings = models.Settings.get_solo()
+        models.Settings.get_cached()
+        settings.contact_user_id = 'someone'
+        settings.save()
+        self.assertEqual(models.Settings.get_cached().contact_user_id,
+                         'someone')
+
+    def test_other_process_within_timeout(self):
+        models.Settings.get_cached()
+        self._change_in_other_process()
+        self.assertEqual(models.Settings.get_cached().contact_user_id,
+                         'jseddon')
+
+    @override_settings(SETTINGS_CACHE_TIMEOUT=0)
+    def test_other_process_after_timeout(self):
+        models.Settings.get_cached()
+        self._change_in_other_process()
+        self.assertEqual(models.Settings.get_cached().contact_user_id,
+                         'someone')
+
+    @override_settings(SETTINGS_CACHE_TIMEOUT=0)
+    def test_unchanged_after_timeout(self):
+        settings = models.Settings.get_cached()
+        with self.assertNumQueries(1):
+            self.assertIs(models.Settings.get_cached(), settings)
+
+
 class TestProject(TestCase):
     """
     Test Project class
@@ -161,6 +212,9 @@ class TestDataFileAggregationBaseMethods(TestCase):
                 version='v20161225', tape_url='et:1234',
                 data_submission=self.dsub)
 
+        # load the cached aggregations updated as the files were created
+        self.dsub.refresh_from_db()
+
     def test_get_data_files(self):
         files = self.dsub.get_data_files()
         filenames = [df.name for df in files]
@@ -228,6 +282,7 @@ class TestDataFileAggregationBaseMethods(TestCase):
         null_file.start_time = None
         null_file.end_time = None
         null_file.save()
+        self.dsub.refresh_from_db()
 
         start_time = self.dsub.start_time()
 
@@ -260,6 +315,7 @@ class TestDataFileAggregationBaseMethods(TestCase):
         datafile = self.dsub.get_data_files()[0]
         datafile.online = False
         datafile.save()
+        self.dsub.refresh_from_db()
 
         status = self.dsub.online_status()
         self.assertEqual(status, ONLINE_STATUS.partial)
@@ -268,6 +324,7 @@ class TestDataFileAggregationBaseMethods(TestCase):
         for df in self.dsub.get_data_files():
             df.online = False
             df.save()
+        self.dsub.refresh_from_db()
 
         status = self.dsub.online_status()
         self.assertEqual(status, ONLINE_STATUS.offline)
@@ -331,6 +388,270 @@ class TestDataFileAggregationBaseMethods(TestCase):
             self.assertEqual(di.reporter.username, 'Lewis')
 
 
+class TestDataFileCachedAggregations(TestCase):
+    """
+    Test that the cached aggregations in DataFileCachedAggregationBase are
+    kept up to date as files change.
+    """
+    def setUp(self):
+        make_example_files(self)
+        self.dreq1.refresh_from_db()
+
+    def _assert_matches_files(self, dreq):
+        dreq.refresh_from_db()
+        uncached = models.DataRequest.objects.get(pk=dreq.pk)
+        uncached.cached_num_files = None
+        self.assertEqual(dreq.num_files(), uncached.num_files())
+        self.assertEqual(dreq.total_size(), uncached.total_size() or 0)
+        self.assertEqual(dreq.num_data_issues(), uncached.num_data_issues())
+        self.assertEqual(dreq.online_status(), uncached.online_status())
+        self.assertEqual(dreq.start_time(), uncached.start_time())
+        self.assertEqual(dreq.end_time(), uncached.end_time())
+
+    def test_files_created(self):
+        self.assertEqual(self.dreq1.cached_num_files, 3)
+        self.assertEqual(self.dreq1.cached_size, 13)
+        self.assertEqual(self.dreq1.cached_num_online, 1)
+        self.assertEqual(self.dreq1.cached_num_offline, 2)
+        self.assertEqual(self.dreq1.start_time(), '1950-01-01')
+        self.assertEqual(self.dreq1.end_time(), '1990-01-01')
+        self._assert_matches_files(self.dreq1)
+
+    def test_file_goes_online(self):
+        self.data_file8.online = True
+        self.data_file8.save()
+        self.dreq1.refresh_from_db()
+        self.assertEqual(self.dreq1.cached_num_online, 2)
+        self.assertEqual(self.dreq1.cached_num_offline, 1)
+        self.assertEqual(self.dreq1.online_status(), ONLINE_STATUS.partial)
+
+    def test_file_moved(self):
+        self.data_file8.data_request = self.dreq2
+        self.data_file8.save()
+        self.dreq1.refresh_from_db()
+        self.assertEqual(self.dreq1.cached_num_files, 2)
+        self.assertEqual(self.dreq1.end_time(), '1980-01-01')
+        self._assert_matches_files(self.dreq1)
+        self._assert_matches_files(self.dreq2)
+
+    def test_file_deleted(self):
+        self.data_file1.delete()
+        self.dreq1.refresh_from_db()
+        self.assertEqual(self.dreq1.cached_num_files, 2)
+        self.assertEqual(self.dreq1.cached_size, 12)
+        self.assertEqual(self.dreq1.online_status(), ONLINE_STATUS.offline)
+        self.assertEqual(self.dreq1.start_time(), '1970-01-01')
+        self._assert_matches_files(self.dreq1)
+
+    def test_data_issues(self):
+        di = get_or_create(models.DataIssue, issue='unit test',
+                           reporter=self.user)
+        di.data_file.add(self.data_file1, self.data_file8)
+        self.data_file2.dataissue_set.add(di)
+        self.dreq1.refresh_from_db()
+        self.assertEqual(self.dreq1.cached_num_issues, 1)
+        self._assert_matches_files(self.dreq2)
+
+        di.data_file.remove(self.data_file1, self.data_file8)
+        self._assert_matches_files(self.dreq1)
+        self.assertEqual(self.dreq1.cached_num_issues, 0)
+
+        di.delete()
+        self._assert_matches_files(self.dreq2)
+
+    def test_uncached_calculates_from_files(self):
+        models.DataRequest.objects.update(cached_num_files=None)
+        self.data_file1.delete()
+        self.dreq1.refresh_from_db()
+        self.assertIsNone(self.dreq1.cached_num_files)
+        self.assertEqual(self.dreq1.num_files(), 2)
+
+    def test_cache_aggregates(self):
+        models.DataRequest.objects.update(cached_num_files=None)
+        models.DataFile.objects.filter(name='test4').update(online=True)
+        models.DataRequest.cache_aggregates()
+        for dreq in models.DataRequest.objects.all():
+            self._assert_matches_files(dreq)
+        self.dreq3.refresh_from_db()
+        self.assertEqual(self.dreq3.cached_num_files, 0)
+        self.assertIsNone(self.dreq3.start_time())
+
+    def test_deferred_updates(self):
+        di = get_or_create(models.DataIssue, issue='unit test',
+                           reporter=self.user)
+        with models.deferred_file_updates():
+            self.data_file8.online = True
+            self.data_file8.data_request = self.dreq2
+            self.data_file8.save()
+            self.data_file1.delete()
+            di.data_file.add(models.DataFile.objects.get(name='test4'))
+            self.dreq1.refresh_from_db()
+            self.assertEqual(self.dreq1.cached_num_files, 3)
+        self._assert_matches_files(self.dreq1)
+        self._assert_matches_files(self.dreq2)
+        self.assertEqual(self.dreq1.cached_num_files, 1)
+        self.assertEqual(self.dreq1.cached_num_issues, 1)
+
+    def test_deferred_updates_query_count(self):
+        data_files = list(models.DataFile.objects.all())
+        with models.deferred_file_updates():
+            # each save only updates the file
+            with self.assertNumQueries(len(data_files)):
+                for data_file in data_files:
+                    data_file.online = not data_file.online
+                    data_file.save()
+        for dreq in models.DataRequest.objects.all():
+            self._assert_matches_files(dreq)
+
+    def test_nested_deferred_updates(self):
+        with models.deferred_file_updates():
+            with models.deferred_file_updates():
+                self.data_file1.delete()
+            self.dreq1.refresh_from_db()
+            self.assertEqual(self.dreq1.cached_num_files, 3)
+        self._assert_matches_files(self.dreq1)
+
+
+class TestBulkAggregate(TestCase):
+    """
+    Test DataFileAggregationBase.bulk_aggregate()
+    """
+    def setUp(self):
+        make_example_files(self)
+
+    def test_matches_single_records(self):
+        fields = ['project', 'climate_model', 'frequency', 'variable_request',
+                  'tape_url', 'directory', 'version', 'grid']
+        dreqs = models.DataRequest.objects.all()
+        actual = models.DataRequest.bulk_aggregate(dreqs, fields)
+        for dreq in dreqs:
+            for field in fields:
+                records = {getattr(datafile, field)
+                           for datafile in dreq.datafile_set.all()}
+                expected = None if records == {None} else records
+                aggregation = actual[dreq.pk][field]
+                self.assertEqual(
+                    None if aggregation is None else set(aggregation),
+                    expected
+                )
+
+    def test_query_count(self):
+        dreqs = list(models.DataRequest.objects.all())
+        # one query per field and one for the related objects
+        with self.assertNumQueries(3):
+            aggregations = models.DataRequest.bulk_aggregate(
+                dreqs, ['directory', 'variable_request'])
+        self.assertEqual(aggregations[self.dreq1.pk]['directory'],
+                         ['/some/dir1', '/some/dir2'])
+        self.assertEqual(aggregations[self.dreq3.pk]['directory'], [])
+
+    def test_all_none(self):
+        aggregations = models.DataRequest.bulk_aggregate([self.dreq1],
+                                                         ['tape_url'])
+        self.assertIsNone(aggregations[self.dreq1.pk]['tape_url'])
+
+
+class TestDrsQuerySets(TestCase):
+    """
+    Test that the for_drs() query set methods load everything used in the
+    DRS in a constant number of queries.
+    """
+    def setUp(self):
+        make_example_files(self)
+        get_or_create(models.ESGFDataset, status='PUBLISHED',
+                      version='v12345678', data_request=self.dreq2)
+
+    def test_data_files(self):
+        with self.assertNumQueries(1):
+            paths = [construct_drs_path(data_file) for data_file in
+                     models.DataFile.objects.filter(grid__isnull=False,
+                                                    version__isnull=False).
+                     for_drs().order_by('name')]
+        self.assertEqual(paths, [
+            't/HighResMIP/MOHC/t/t/r1i1p1/Amon/var1/gn/v12345678',
+            't/HighResMIP/MOHC/t/t/r1i1p1/Amon/var/g2/v87654321'
+        ])
+
+    def test_data_files_fully_loaded(self):
+        data_file = models.DataFile.objects.for_drs().get(name='test1')
+        self.assertEqual(data_file.get_deferred_fields(), set())
+
+    def test_data_requests(self):
+        with self.assertNumQueries(1):
+            names = [str(data_request) for data_request in
+                     models.DataRequest.objects.for_drs()]
+        self.assertEqual(len(names), 4)
+        self.assertIn('MOHC.t.t.r1i1p1f1.Amon.var1', names)
+
+    def test_esgf_datasets(self):
+        with self.assertNumQueries(1):
+            names = [construct_cylc_task_name(dataset, 'crepp') for dataset in
+                     models.ESGFDataset.objects.for_drs().order_by('pk')]
+        self.assertEqual(names, ['crepp_t_t_r1i1p1f1_Amon_var1',
+                                 'crepp_t_t_r1i1p1f1_Amon_var2'])
+
+
+class TestWithOnlineStatus(TestCase):
+    """
+    Test the with_online_status() query set methods
+    """
+    def setUp(self):
+        make_example_files(self)
+
+    def _assert_matches_method(self, query_set):
+        with self.assertNumQueries(1):
+            records = list(query_set.with_online_status())
+        for record in records:
+            # ObservationDataset.online_status is a property
+            expected = record.online_status
+            if callable(expected):
+                expected = expected()
+            self.assertEqual(record.annotated_online_status, expected)
+        return {record.pk: record.annotated_online_status
+                for record in records}
+
+    def test_data_requests(self):
+        statuses = self._assert_matches_method(models.DataRequest.objects)
+        self.assertEqual(statuses[self.dreq1.pk], 'partial')
+        self.assertEqual(statuses[self.dreq2.pk], 'online')
+        self.assertEqual(statuses[self.dreq3.pk], 'online')
+
+    def test_data_requests_not_cached(self):
+        self.data_file1.online = False
+        self.data_file1.save()
+        models.DataRequest.objects.update(cached_num_files=None)
+        statuses = self._assert_matches_method(models.DataRequest.objects)
+        self.assertEqual(statuses[self.dreq1.pk], 'offline')
+        self.assertEqual(statuses[self.dreq2.pk], 'online')
+
+    def test_data_submissions(self):
+        models.DataSubmission.objects.update(cached_num_files=None)
+        statuses = self._assert_matches_method(models.DataSubmission.objects)
+        self.assertEqual(list(statuses.values()), ['partial'])
+
+    def test_filter_on_files(self):
+        models.DataSubmission.objects.update(cached_num_files=None)
+        submissions = (models.DataSubmission.objects.
+                       filter(datafile__online=True).distinct().
+                       with_online_status())
+        self.assertEqual([submission.annotated_online_status
+                          for submission in submissions], ['partial'])
+
+    def test_observation_datasets(self):
+        obs_set = get_or_create(models.ObservationDataset, name='obs',
+                                version='v1')
+        empty_set = get_or_create(models.ObservationDataset, name='empty',
+                                  version='v1')
+        for index, online in enumerate((True, False)):
+            get_or_create(models.ObservationFile, name='obs{}.nc'.format(index),
+                          incoming_directory='/obs', online=online, size=1,
+                          obs_set=obs_set)
+        statuses = self._assert_matches_method(
+            models.ObservationDataset.objects)
+        self.assertEqual(statuses[obs_set.pk], 'partial')
+        self.assertEqual(statuses[empty_set.pk], 'online')
+
+
 class TestDataSubmission(TestCase):
     """
     Test DataSubmission class
@@ -396,7 +717,7 @@ class TestESGFDatasetMethods(TestCase):
             models.DataSubmission, status=u'VALIDATED',
             incoming_directory='/dir', user=data_prov
         )
-        data_file = get_or_create(
+        self.data_file = get_or_create(
             models.DataFile, name='file.nc', incoming_directory='/dir', size=1,
             project=proj, institute=inst, climate_model=clim_model,
             activity_id=act_id, experiment=expt, variable_request=var_req,
@@ -430,6 +751,50 @@ class TestESGFDatasetMethods(TestCase):
                     'Amon.var.gn.v20160720')
         self.assertEqual(full_id, expected)
 
+    def test_drs_ids_stored(self):
+        self.assertEqual(self.esgf_ds.cached_drs_id,
+                         'CMIP6.HighResMIP.MOHC.Model-1.control-1950.'
+                         'r1i1p1f1.Amon.var1.gn')
+        self.assertEqual(self.esgf_ds.cached_out_name_drs_id,
+                         'CMIP6.HighResMIP.MOHC.Model-1.control-1950.'
+                         'r1i1p1f1.Amon.var.gn')
+        esgf_ds = models.ESGFDataset.objects.get(pk=self.esgf_ds.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(esgf_ds),
+                             'CMIP6.HighResMIP.MOHC.Model-1.control-1950.'
+                             'r1i1p1f1.Amon.var1.gn.v20160720')
+
+    def test_drs_id_no_files(self):
+        self.data_file.delete()
+        esgf_ds = models.ESGFDataset.objects.get(pk=self.esgf_ds.pk)
+        self.assertIsNone(esgf_ds.cached_drs_id)
+        self.assertRaises(ValueError, esgf_ds.get_drs_id)
+
+    def test_drs_id_grid_changed(self):
+        self.data_file.grid = 'gr'
+        self.data_file.save()
+        esgf_ds = models.ESGFDataset.objects.get(pk=self.esgf_ds.pk)
+        self.assertEqual(esgf_ds.cached_drs_id,
+                         'CMIP6.HighResMIP.MOHC.Model-1.control-1950.'
+                         'r1i1p1f1.Amon.var1.gr')
+
+    def test_bulk_drs_ids(self):
+        with self.assertNumQueries(1):
+            drs_ids = models.ESGFDataset.bulk_drs_ids(use_out_name=True)
+        self.assertEqual(drs_ids, {
+            self.esgf_ds.pk: 'CMIP6.HighResMIP.MOHC.Model-1.control-1950.'
+                             'r1i1p1f1.Amon.var.gn'
+        })
+
+    def test_cache_drs_ids(self):
+        models.ESGFDataset.objects.update(cached_drs_id=None,
+                                          cached_out_name_drs_id=None)
+        models.ESGFDataset.cache_drs_ids()
+        esgf_ds = models.ESGFDataset.objects.get(pk=self.esgf_ds.pk)
+        self.assertEqual(esgf_ds.cached_drs_id,
+                         'CMIP6.HighResMIP.MOHC.Model-1.control-1950.'
+                         'r1i1p1f1.Amon.var1.gn')
+
     def test_clean_version(self):
         self.esgf_ds.version = '20160720'
         self.assertRaises(ValidationError, self.esgf_ds.clean)
@@ -518,6 +883,223 @@ class TestDataIssue(TestCase):
                         r'Data Issue \([0-9 :-]{19}\): test \(me\)')
 
 
+class TestDataIssueAddDataFiles(TestCase):
+    """
+    Test DataIssue.add_data_files()
+    """
+    def setUp(self):
+        make_example_files(self)
+        self.data_issue = get_or_create(models.DataIssue, issue='test',
+                                        reporter=self.user)
+
+    def test_files_added(self):
+        self.data_issue.data_file.add(self.data_file1)
+        self.data_issue.add_data_files(models.DataFile.objects.all(),
+                                       batch_size=2)
+        self.assertEqual(
+            set(self.data_issue.data_file.values_list('name', flat=True)),
+            {'test1', 'test2', 'test4', 'test8'}
+        )
+
+    def test_cached_issues_updated(self):
+        self.data_issue.add_data_files(
+            models.DataFile.objects.filter(name='test2'))
+        self.dreq1.refresh_from_db()
+        self.dreq2.refresh_from_db()
+        self.assertEqual(self.dreq1.cached_num_issues, 0)
+        self.assertEqual(self.dreq2.cached_num_issues, 1)
+
+    def test_get_data_issues_query_count(self):
+        self.data_issue.add_data_files(models.DataFile.objects.all())
+        with self.assertNumQueries(1):
+            issues = self.dreq1.get_data_issues()
+        self.assertEqual(issues, [self.data_issue])
+
+
+class TestRetrievalRequestSizes(TestCase):
+    """
+    Test the stored sizes of RetrievalRequests
+    """
+    def setUp(self):
+        make_example_files(self)
+        self.rreq = get_or_create(models.RetrievalRequest,
+                                  requester=self.user, start_year=1950,
+                                  end_year=2000)
+        self.rreq.data_request.add(self.dreq1, self.dreq2)
+        self.partial_rreq = get_or_create(models.RetrievalRequest,
+                                          requester=self.user,
+                                          start_year=1950, end_year=1975)
+        self.partial_rreq.data_request.add(self.dreq1, self.dreq2)
+
+    def _stored_sizes(self, rreq):
+        return (models.RetrievalRequest.objects.filter(pk=rreq.pk).
+                values_list(*models.RETRIEVAL_SIZE_FIELDS).first())
+
+    def test_retrieval_size(self):
+        self.assertEqual(self.rreq.retrieval_size(), 15)
+        self.assertEqual(self.rreq.retrieval_size(online=True), 3)
+        self.assertEqual(self.rreq.retrieval_size(offline=True), 12)
+
+    def test_retrieval_size_not_saved(self):
+        models.RetrievalRequest.objects.update(cached_size=None)
+        rreq = models.RetrievalRequest.objects.get(pk=self.rreq.pk)
+        self.assertEqual(rreq.retrieval_size(), 15)
+        self.assertIsNone(self._stored_sizes(rreq)[0])
+
+    def test_dates(self):
+        self.assertEqual(self.partial_rreq.retrieval_size(), 7)
+        self.assertEqual(self.partial_rreq.retrieval_size(offline=True), 4)
+
+    def test_both_options(self):
+        self.assertRaises(ValueError, self.rreq.retrieval_size, online=True,
+                          offline=True)
+
+    def test_no_files(self):
+        rreq = get_or_create(models.RetrievalRequest, requester=self.user,
+                             start_year=2001, end_year=2014)
+        rreq.data_request.add(self.dreq1, self.dreq3)
+        self.assertEqual(rreq.retrieval_size(), 0)
+
+    def test_cache_sizes_query_count(self):
+        retrievals = list(models.RetrievalRequest.objects.order_by('pk'))
+        # one query for the time units and one for each range of years
+        with self.assertNumQueries(3):
+            models.RetrievalRequest.calculate_sizes(retrievals)
+        self.assertEqual([rreq.cached_size for rreq in retrievals], [15, 7])
+
+    def test_file_change_clears_sizes(self):
+        self.data_file8.online = True
+        self.data_file8.save()
+        self.assertEqual(self._stored_sizes(self.rreq), (None, None, None))
+        rreq = models.RetrievalRequest.objects.get(pk=self.rreq.pk)
+        self.assertEqual(rreq.retrieval_size(offline=True), 4)
+
+    def test_deferred_file_changes_update_sizes(self):
+        with models.deferred_file_updates():
+            self.data_file8.online = True
+            self.data_file8.save()
+        self.assertEqual(self._stored_sizes(self.rreq), (15, 11, 4))
+
+    def test_unrelated_file_change_keeps_sizes(self):
+        self.data_file8.tape_url = 'et:1234'
+        self.data_file8.save()
+        self.assertEqual(self._stored_sizes(self.rreq), (15, 3, 12))
+
+    def test_data_requests_change_updates_sizes(self):
+        self.rreq.data_request.remove(self.dreq2)
+        self.assertEqual(self._stored_sizes(self.rreq), (13, 1, 12))
+        self.assertEqual(self.rreq.retrieval_size(), 13)
+        self.dreq1.retrievalrequest_set.clear()
+        self.assertEqual(self._stored_sizes(self.rreq), (0, 0, 0))
+        self.assertEqual(self._stored_sizes(self.partial_rreq)[0], 2)
+
+    def test_years_change_updates_sizes(self):
+        rreq = models.RetrievalRequest.objects.get(pk=self.rreq.pk)
+        rreq.end_year = 1975
+        rreq.save()
+        self.assertEqual(self._stored_sizes(rreq), (7, 3, 4))
+
+    def test_save_stores_sizes(self):
+        rreq = models.RetrievalRequest.objects.get(pk=self.rreq.pk)
+        rreq.cached_size = 1
+        rreq.save()
+        self.assertEqual(self._stored_sizes(rreq)[0], 1)
+
+    def test_save_deleted(self):
+        rreq = models.RetrievalRequest.objects.get(pk=self.rreq.pk)
+        models.RetrievalRequest.objects.filter(pk=rreq.pk).delete()
+        rreq.save()
+        self.assertEqual(self._stored_sizes(rreq), (15, 3, 12))
+
+
+class TestReceivedDataSummary(TestCase):
+    """
+    Test the summaries of the received DataRequests
+    """
+    def setUp(self):
+        make_example_files(self)
+
+    def _summary(self, data_request):
+        return models.ReceivedDataSummary.objects.get(
+            data_request=data_request
+        )
+
+    def test_files_create_stale_summaries(self):
+        summaries = models.ReceivedDataSummary.objects.order_by(
+            'data_request_id')
+        self.assertEqual(
+            list(summaries.values_list('data_request_id', 'stale')),
+            [(self.dreq1.id, True), (self.dreq2.id, True)]
+        )
+
+    def test_refresh(self):
+        self.assertEqual(models.ReceivedDataSummary.refresh(), 2)
+        summary = self._summary(self.dreq1)
+        self.assertFalse(summary.stale)
+        self.assertEqual(summary.num_files, 3)
+        self.assertEqual(summary.size, 13)
+        self.assertEqual(summary.start_date, '1950-01-01')
+        self.assertEqual(summary.end_date, '1990-01-01')
+        self.assertEqual(summary.versions, 'v12345678')
+        self.assertIsNone(summary.tape_urls)
+        self.assertEqual(summary.online_status(), ONLINE_STATUS.partial)
+        self.assertEqual(models.ReceivedDataSummary.refresh(), 0)
+
+    def test_refresh_query_count(self):
+        # one query for the stale summaries, one for the data requests,
+        # three for the cached aggregations, two for the tape URLs and
+        # versions and two to replace the summaries in a transaction
+        with self.assertNumQueries(11):
+            models.ReceivedDataSummary.refresh()
+
+    def test_file_change_marks_stale(self):
+        models.ReceivedDataSummary.refresh()
+        self.data_file8.tape_url = 'et:1234'
+        self.data_file8.save()
+        self.assertTrue(self._summary(self.dreq1).stale)
+        self.assertFalse(self._summary(self.dreq2).stale)
+        models.ReceivedDataSummary.refresh()
+        self.assertEqual(self._summary(self.dreq1).tape_urls, 'et:1234')
+
+    def test_deferred_file_change_refreshes(self):
+        models.ReceivedDataSummary.refresh()
+        with models.deferred_file_updates():
+            self.data_file8.tape_url = 'et:1234'
+            self.data_file8.save()
+            self.assertIsNone(self._summary(self.dreq1).tape_urls)
+        summary = self._summary(self.dreq1)
+        self.assertFalse(summary.stale)
+        self.assertEqual(summary.tape_urls, 'et:1234')
+
+    def test_issue_marks_stale(self):
+        models.ReceivedDataSummary.refresh()
+        data_issue = models.DataIssue.objects.create(issue='issue',
+                                                     reporter=self.user)
+        data_issue.data_file.add(self.data_file2)
+        self.assertTrue(self._summary(self.dreq2).stale)
+        models.ReceivedDataSummary.refresh()
+        self.assertEqual(self._summary(self.dreq2).num_issues, 1)
+
+    def test_first_file_creates_summary(self):
+        models.ReceivedDataSummary.refresh()
+        self.data_file2.data_request = self.dreq3
+        self.data_file2.save()
+        models.ReceivedDataSummary.refresh()
+        self.assertEqual(
+            list(models.ReceivedDataSummary.objects.
+                 order_by('data_request_id').
+                 values_list('data_request_id', 'num_files')),
+            [(self.dreq1.id, 3), (self.dreq3.id, 1)]
+        )
+
+    def test_last_file_deleted(self):
+        models.ReceivedDataSummary.refresh()
+        self.data_file2.delete()
+        models.ReceivedDataSummary.refresh()
+        self.assertFalse(models.ReceivedDataSummary.objects.filter(
+            data_request=self.dreq2).exists())
+
+
 class TestChecksum(TestCase):
     """
     Test the Checksum class
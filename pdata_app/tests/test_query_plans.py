@@ -0,0 +1,88 @@
+"""
+test_query_plans.py - check that the common DataFile queries use an index
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+from django.db import connection
+from django.test import TestCase
+
+from pdata_app import models
+from .common import make_example_files
+
+# The number of extra files to create so that scanning the table is more
+# expensive than using an index
+NUM_SYNTHETIC_FILES = 2000
+
+
+class TestDataFileQueryPlans(TestCase):
+    """
+    Test that the queries run against large numbers of DataFiles use an
+    index rather than scanning the whole table.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        make_example_files(cls)
+        template = models.DataFile.objects.get(name='test1')
+        synthetic_files = []
+        for index in range(NUM_SYNTHETIC_FILES):
+            template.pk = None
+            template.name = 'synthetic_{}.nc'.format(index)
+            template.directory = '/some/dir{}'.format(index % 100)
+            template.tape_url = 'et:{}'.format(index % 50)
+            template.online = bool(index % 2)
+            synthetic_files.append(models.DataFile(
+                **{field.attname: getattr(template, field.attname)
+                   for field in models.DataFile._meta.concrete_fields}
+            ))
+        models.DataFile.objects.bulk_create(synthetic_files)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def _explain(self, query_set):
+        """
+        Get the query plan for `query_set`.
+        """
+        if connection.vendor == 'postgresql':
+            # the test table is still small enough that PostgreSQL may
+            # choose a sequential scan even when a suitable index exists
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan TO off')
+        return query_set.explain()
+
+    def _assert_uses_index(self, query_set, index_name=None):
+        """
+        Check that `query_set` doesn't scan the DataFile table and, if
+        `index_name` is given, that it uses that index.
+        """
+        plan = self._explain(query_set)
+        self.assertNotIn('SCAN TABLE pdata_app_datafile\n', plan + '\n')
+        self.assertNotIn('Seq Scan on pdata_app_datafile', plan)
+        self.assertIn('INDEX', plan.upper())
+        if index_name:
+            self.assertIn(index_name, plan)
+
+    def test_name(self):
+        self._assert_uses_index(
+            models.DataFile.objects.filter(name='synthetic_10.nc')
+        )
+
+    def test_data_request_online_time(self):
+        self._assert_uses_index(
+            models.DataFile.objects.filter(data_request=self.dreq1,
+                                           online=False,
+                                           start_time__gte=0,
+                                           end_time__lt=7200),
+            'datafile_dreq_online_time'
+        )
+
+    def test_tape_url(self):
+        self._assert_uses_index(
+            models.DataFile.objects.filter(tape_url='et:10'),
+            'datafile_tape_url'
+        )
+
+    def test_directory(self):
+        self._assert_uses_index(
+            models.DataFile.objects.filter(directory='/some/dir10'),
+            'datafile_directory'
+        )
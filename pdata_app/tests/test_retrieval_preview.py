@@ -0,0 +1,56 @@
+"""
+test_retrieval_preview.py - unit tests for pdata_app.utils.retrieval_preview
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+from django.test import TestCase
+
+from pdata_app import models
+from pdata_app.utils.common import get_request_size
+from pdata_app.utils.retrieval_preview import preview_retrieval
+from .common import make_example_files
+
+
+class TestPreviewRetrieval(TestCase):
+    """
+    Test preview_retrieval()
+    """
+    def setUp(self):
+        make_example_files(self)
+        models.DataFile.objects.filter(name='test4').update(tape_url='et:1')
+        models.DataFile.objects.filter(name='test8').update(tape_url='et:2')
+        self.req_ids = [self.dreq2.id, self.dreq1.id]
+
+    def test_all_years(self):
+        with self.assertNumQueries(3):
+            preview = preview_retrieval(self.req_ids)
+        self.assertEqual(preview.data_requests, [self.dreq2, self.dreq1])
+        self.assertEqual(preview.earliest_year, 1950)
+        self.assertEqual(preview.latest_year, 1990)
+        self.assertEqual(preview.total_size, 15)
+        self.assertEqual(preview.offline_size, 12)
+        self.assertEqual(preview.num_tape_batches, 2)
+
+    def test_years(self):
+        preview = preview_retrieval(self.req_ids, 1970, 1980)
+        self.assertEqual(
+            preview.total_size,
+            get_request_size(models.DataRequest.objects.filter(
+                id__in=self.req_ids), 1970, 1980)
+        )
+        self.assertEqual(preview.total_size, 14)
+        self.assertEqual(preview.offline_size, 12)
+        self.assertEqual(preview.num_tape_batches, 2)
+
+    def test_shared_batch(self):
+        models.DataFile.objects.filter(name='test8').update(tape_url='et:1')
+        preview = preview_retrieval(self.req_ids)
+        self.assertEqual(preview.num_tape_batches, 1)
+
+    def test_no_files(self):
+        preview = preview_retrieval([str(self.dreq3.id)])
+        self.assertEqual(preview.data_requests, [self.dreq3])
+        self.assertIsNone(preview.earliest_year)
+        self.assertIsNone(preview.latest_year)
+        self.assertEqual(preview.total_size, 0)
+        self.assertEqual(preview.num_tape_batches, 0)
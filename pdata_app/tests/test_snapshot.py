@@ -0,0 +1,85 @@
+"""
+test_snapshot.py - unit tests for pdata_app.utils.snapshot
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from django.test import TestCase
+
+from pdata_app import models
+from pdata_app.utils.snapshot import DataFileSnapshot, export_snapshot
+from .common import make_example_files
+
+
+class TestExportSnapshot(TestCase):
+    """
+    Test export_snapshot() and DataFileSnapshot
+    """
+    def setUp(self):
+        make_example_files(self)
+        self.directory = tempfile.mkdtemp()
+        export_snapshot(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _assert_matches_database(self):
+        snapshot = DataFileSnapshot(self.directory)
+        data_files = models.DataFile.objects.order_by('id')
+        self.assertEqual(list(snapshot['id']),
+                         list(data_files.values_list('id', flat=True)))
+        self.assertEqual(list(snapshot['size']),
+                         list(data_files.values_list('size', flat=True)))
+        self.assertEqual(list(snapshot['online']),
+                         list(data_files.values_list('online', flat=True)))
+        self.assertEqual(
+            snapshot.decode('tape_url', snapshot['tape_url']),
+            list(data_files.values_list('tape_url', flat=True))
+        )
+        self.assertEqual(
+            snapshot.decode('cmor_name', snapshot['cmor_name']),
+            list(data_files.values_list('variable_request__cmor_name',
+                                        flat=True))
+        )
+        return snapshot
+
+    def test_export(self):
+        snapshot = self._assert_matches_database()
+        self.assertEqual(len(snapshot), 4)
+        self.assertEqual(snapshot.metadata['high_water_mark'],
+                         models.DataFile.objects.order_by('-id').first().id)
+        test1 = snapshot['id'] == self.data_file1.id
+        self.assertEqual(snapshot['start_time'][test1], [0.])
+        self.assertEqual(snapshot['end_time'][test1], [3600.])
+        test2 = snapshot['id'] == self.data_file2.id
+        self.assertTrue(np.isnan(snapshot['start_time'][test2]))
+
+    def test_isin(self):
+        snapshot = DataFileSnapshot(self.directory)
+        mask = snapshot.isin('cmor_name', ['var2', 'not-a-variable'])
+        self.assertEqual(list(snapshot['id'][mask]), [self.data_file2.id])
+
+    def test_refresh(self):
+        self.data_file1.online = False
+        self.data_file1.tape_url = 'et:1234'
+        self.data_file1.save()
+        self.data_file8.delete()
+        new_file = models.DataFile.objects.get(name='test2')
+        new_file.pk = None
+        new_file.name = 'test3'
+        new_file.save()
+
+        export_snapshot(self.directory)
+
+        snapshot = self._assert_matches_database()
+        self.assertEqual(len(snapshot), 4)
+        self.assertEqual(snapshot.metadata['high_water_mark'], new_file.id)
+
+    def test_full(self):
+        models.DataFile.objects.filter(name='test4').update(size=40)
+        export_snapshot(self.directory, full=True)
+        self._assert_matches_database()
@@ -0,0 +1,122 @@
+"""
+test_substring_search.py - unit tests for pdata_app.utils.substring_search
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+from django.apps import apps
+from django.db import connection
+from django.test import TestCase
+
+from pdata_app import models
+from pdata_app.filters import DataFileFilter, DataSubmissionFilter
+from pdata_app.utils.substring_search import (drop_search_indexes,
+                                              search_index_available)
+from .common import make_example_files
+
+
+class TestSubstringSearch(TestCase):
+    """
+    Test the filters that use the substring search indexes
+    """
+    def setUp(self):
+        make_example_files(self)
+
+    def _filter(self, filter_class, params):
+        filter_set = filter_class(params,
+                                  queryset=filter_class.Meta.model.objects.all())
+        return filter_set.qs
+
+    def _names(self, params):
+        qs = self._filter(DataFileFilter, params)
+        return qs, sorted(qs.values_list('name', flat=True))
+
+    def _require_index(self):
+        # the trigram tokenizer needs SQLite 3.34 or later
+        if (connection.vendor != 'sqlite' or
+                not search_index_available(connection,
+                                           'pdata_app_datafile')):
+            self.skipTest('No SQLite substring search index')
+
+    def test_uses_index(self):
+        self._require_index()
+        qs, names = self._names({'name': 'EST'})
+        self.assertIn('pdata_app_datafile_search', str(qs.query))
+        self.assertEqual(names, ['test1', 'test2', 'test4', 'test8'])
+
+    def test_matches_icontains(self):
+        for value in ('dir2', 'SOME/', 't8', '"', 'xyz'):
+            _qs, names = self._names({'directory': value})
+            self.assertEqual(
+                names,
+                sorted(models.DataFile.objects.
+                       filter(directory__icontains=value).
+                       values_list('name', flat=True))
+            )
+
+    def test_short_value(self):
+        qs, names = self._names({'name': 't8'})
+        self.assertNotIn('pdata_app_datafile_search', str(qs.query))
+        self.assertEqual(names, ['test8'])
+
+    def test_index_updated(self):
+        self.data_file1.name = 'renamed1'
+        self.data_file1.save()
+        models.DataFile.objects.filter(name='test2').update(
+            tape_url='et:9876'
+        )
+        self.data_file8.delete()
+        self.assertEqual(self._names({'name': 'test'})[1], ['test2', 'test4'])
+        self.assertEqual(self._names({'name': 'renamed'})[1], ['renamed1'])
+        self.assertEqual(self._names({'tape_url': '9876'})[1], ['test2'])
+
+    def test_related_field(self):
+        self._require_index()
+        models.DataFile.objects.filter(name='test4').update(
+            tape_url='et:9876'
+        )
+        qs = self._filter(DataSubmissionFilter, {'tape_url': '987'})
+        self.assertIn('pdata_app_datafile_search', str(qs.query))
+        self.assertEqual(list(qs.distinct()),
+                         [models.DataSubmission.objects.get()])
+
+    def test_recreated_after_migrate(self):
+        self._require_index()
+        drop_search_indexes(connection)
+        qs, names = self._names({'name': 'EST'})
+        self.assertNotIn('pdata_app_datafile_search', str(qs.query))
+        self.assertEqual(names, ['test1', 'test2', 'test4', 'test8'])
+
+        models.DataFile.objects.filter(name='test4').update(name='best4')
+        models._check_search_indexes(apps.get_app_config('pdata_app'),
+                                     using=connection.alias)
+        qs, names = self._names({'name': 'EST'})
+        self.assertIn('pdata_app_datafile_search', str(qs.query))
+        self.assertEqual(names, ['best4', 'test1', 'test2', 'test8'])
+
+    def _num_changes(self, **values):
+        """
+        The number of rows, including those of the search table, changed by
+        updating data_file1 with `values`.
+        """
+        before = connection.connection.total_changes
+        models.DataFile.objects.filter(pk=self.data_file1.pk).update(**values)
+        return connection.connection.total_changes - before
+
+    def test_unindexed_change_not_reindexed(self):
+        self._require_index()
+        self.assertEqual(self._num_changes(online=False, size=2), 1)
+        self.assertGreater(self._num_changes(name='renamed1'), 1)
+        self.assertEqual(self._names({'name': 'renamed'})[1], ['renamed1'])
+
+    def test_out_of_date_trigger_replaced(self):
+        self._require_index()
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER pdata_app_datafile_search_update')
+            cursor.execute(
+                "CREATE TRIGGER pdata_app_datafile_search_update AFTER UPDATE "
+                "ON pdata_app_datafile BEGIN SELECT 1; END"
+            )
+        models._check_search_indexes(apps.get_app_config('pdata_app'),
+                                     using=connection.alias)
+        self.assertEqual(self._num_changes(online=False), 1)
+        self.assertGreater(self._num_changes(name='renamed1'), 1)
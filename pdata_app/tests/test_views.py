@@ -0,0 +1,400 @@
+"""
+test_views.py - unit tests for pdata_app.views
+"""
+from __future__ import unicode_literals, division, absolute_import
+import gzip
+import json
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pdata_app import models
+from pdata_app.utils.table_views import (bump_table_cache_version,
+                                         encode_cursor, KeysetPaginator)
+from vocabs import CHECKSUM_TYPES, STATUS_VALUES
+from .common import make_example_files, run_on_commit_callbacks
+
+# The number of rows on a full page of each table
+NUM_ROWS = 100
+
+
+class TestTableQueryCounts(TestCase):
+    """
+    Test that the number of queries used to render a page of a table
+    doesn't depend on the number of rows on the page.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        make_example_files(cls)
+        data_issue = models.DataIssue.objects.create(issue='test issue',
+                                                     reporter=cls.user)
+        template = models.DataFile.objects.get(name='test1')
+        data_files = []
+        for index in range(NUM_ROWS):
+            submission = models.DataSubmission.objects.create(
+                status=STATUS_VALUES['VALIDATED'],
+                incoming_directory='/some/dir{}'.format(index),
+                directory='/some/dir{}'.format(index), user=cls.user
+            )
+            template.pk = None
+            template.name = 'file{}.nc'.format(index)
+            template.data_submission = submission
+            data_files.append(models.DataFile(
+                **{field.attname: getattr(template, field.attname)
+                   for field in models.DataFile._meta.concrete_fields}
+            ))
+        data_files = models.DataFile.objects.bulk_create(data_files)
+        if data_files[0].pk is None:
+            # not all databases return the primary keys from bulk_create()
+            data_files = list(models.DataFile.objects.
+                              filter(name__startswith='file'))
+        models.Checksum.objects.bulk_create([
+            models.Checksum(data_file=data_file, checksum_value='1234',
+                            checksum_type=CHECKSUM_TYPES['ADLER32'])
+            for data_file in data_files
+        ])
+        data_issue.data_file.add(*data_files)
+        # the files were created without their signals and so the
+        # submissions' aggregations have not been calculated
+        models.DataSubmission.objects.update(cached_num_files=None)
+
+    def _count_queries(self, url_name, per_page):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(url_name),
+                                       {'per_page': per_page})
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def _assert_constant_queries(self, url_name):
+        self.assertEqual(self._count_queries(url_name, 10),
+                         self._count_queries(url_name, NUM_ROWS))
+
+    def test_data_files(self):
+        self._assert_constant_queries('data_files')
+
+    def test_data_submissions(self):
+        self._assert_constant_queries('data_submissions')
+
+
+class TestTableCache(TestCase):
+    """
+    Test the caching of the rendered tables by PagedFilteredTableView
+    """
+    def setUp(self):
+        cache.clear()
+        make_example_files(self)
+
+    def _get(self, params=None):
+        """
+        Get the data files page and return its content and the number of
+        queries of the DataFile table used.
+        """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('data_files'), params or {})
+        self.assertEqual(response.status_code, 200)
+        num_queries = len([query for query in context.captured_queries
+                           if 'pdata_app_datafile' in query['sql']])
+        return response.content.decode('utf-8'), num_queries
+
+    def test_cached(self):
+        content, num_queries = self._get()
+        cached_content, cached_num_queries = self._get()
+        self.assertEqual(cached_content, content)
+        self.assertEqual(cached_num_queries, 0)
+        self.assertIn('test8', cached_content)
+
+    def test_blank_parameters_ignored(self):
+        self._get({'name': 'test'})
+        _content, num_queries = self._get({'name': 'test', 'directory': ''})
+        self.assertEqual(num_queries, 0)
+
+    def test_filters(self):
+        self._get()
+        content, num_queries = self._get({'name': 'test1'})
+        self.assertGreater(num_queries, 0)
+        self.assertIn('test1', content)
+        self.assertNotIn('test8', content)
+
+    def test_model_change_invalidates(self):
+        self._get()
+        self.data_file8.name = 'renamed8'
+        self.data_file8.save()
+        run_on_commit_callbacks()
+        content, num_queries = self._get()
+        self.assertGreater(num_queries, 0)
+        self.assertIn('renamed8', content)
+
+    def test_invalidated_once_per_transaction(self):
+        with mock.patch('pdata_app.utils.table_views.'
+                        'bump_table_cache_version') as mock_bump:
+            with transaction.atomic():
+                self.data_file1.name = 'renamed1'
+                self.data_file1.save()
+                self.data_file8.name = 'renamed8'
+                self.data_file8.save()
+            mock_bump.assert_not_called()
+            run_on_commit_callbacks()
+        mock_bump.assert_called_once_with()
+
+    def test_unshown_models_dont_invalidate(self):
+        with mock.patch('pdata_app.utils.table_views.'
+                        'bump_table_cache_version') as mock_bump:
+            models.EmailQueue.objects.create(recipient=self.user,
+                                             subject='subject',
+                                             message='message')
+            run_on_commit_callbacks()
+        mock_bump.assert_not_called()
+
+    def test_version_bump_invalidates(self):
+        self._get()
+        models.DataFile.objects.filter(name='test8').update(name='renamed8')
+        bump_table_cache_version()
+        content, _num_queries = self._get()
+        self.assertIn('renamed8', content)
+
+    def test_other_process_bump_invalidates(self):
+        models.Settings.clear_cache()
+        models.Settings.get_cached()
+        self._get()
+        models.DataFile.objects.filter(name='test8').update(name='renamed8')
+        # a bump by another process only changes the database, which is
+        # seen when the cached settings are next checked
+        models.Settings.objects.update(table_cache_version='other')
+        models.Settings._cached = (models.Settings.get_cached(), 0)
+        content, _num_queries = self._get()
+        self.assertIn('renamed8', content)
+
+    def test_users_cached_separately(self):
+        self._get()
+        self.user.set_password('password')
+        self.user.save()
+        self.client.login(username='fred', password='password')
+        _content, num_queries = self._get()
+        self.assertGreater(num_queries, 0)
+
+
+class TestKeysetPagination(TestCase):
+    """
+    Test paging through the data files by keyset
+    """
+    def setUp(self):
+        cache.clear()
+        make_example_files(self)
+        template = models.DataFile.objects.get(name='test1')
+        for index in range(25):
+            template.pk = None
+            # some files have the same name in different directories
+            template.name = 'file{:02d}.nc'.format(index // 2)
+            template.directory = '/some/dir{}'.format(index)
+            template.save()
+        self.names = list(models.DataFile.objects.order_by('name', 'id').
+                          values_list('name', 'id'))
+
+    def _get_page(self, params):
+        params = dict(params, per_page=10)
+        response = self.client.get(reverse('data_files'), params)
+        self.assertEqual(response.status_code, 200)
+        table = response.context['table']
+        records = [row.record for row in table.page.object_list]
+        return table, [(record.name, record.id) for record in records]
+
+    def test_all_pages(self):
+        found = []
+        params = {}
+        while True:
+            table, rows = self._get_page(params)
+            self.assertIsInstance(table.paginator, KeysetPaginator)
+            found.extend(rows)
+            if not table.page.has_next():
+                break
+            params = {'after': table.page.next_cursor}
+        self.assertEqual(found, self.names)
+
+    def test_previous(self):
+        table, first_rows = self._get_page({})
+        self.assertFalse(table.page.has_previous())
+        table, _rows = self._get_page({'after': table.page.next_cursor})
+        table, rows = self._get_page({'before': table.page.previous_cursor})
+        self.assertEqual(rows, first_rows)
+        self.assertTrue(table.page.has_next())
+
+    def test_seek(self):
+        _table, rows = self._get_page(
+            {'after': encode_cursor(list(self.names[14]))}
+        )
+        self.assertEqual(rows, self.names[15:25])
+
+    def test_invalid_cursor(self):
+        _table, rows = self._get_page({'after': 'not a cursor'})
+        self.assertEqual(rows, self.names[:10])
+
+    def test_sorted_uses_offset(self):
+        table, rows = self._get_page({'sort': '-name', 'page': 2})
+        self.assertNotIsInstance(table.paginator, KeysetPaginator)
+        self.assertEqual(table.paginator.count, len(self.names))
+        self.assertEqual([row[0] for row in rows],
+                         sorted([name for name, _id in self.names],
+                                reverse=True)[10:20])
+
+    def test_approximate_count_data_request(self):
+        models.DataRequest.cache_aggregates(
+            models.DataRequest.objects.filter(id=self.dreq1.id)
+        )
+        table, _rows = self._get_page({'data_request': self.dreq1.id})
+        self.assertEqual(table.paginator.approximate_count,
+                         self.dreq1.datafile_set.count())
+
+    def test_approximate_count_uncached(self):
+        models.DataRequest.objects.update(cached_num_files=None)
+        table, _rows = self._get_page({})
+        self.assertIsNone(table.paginator.approximate_count)
+
+    def test_approximate_count_cached(self):
+        models.DataRequest.cache_aggregates(models.DataRequest.objects.all())
+        table, _rows = self._get_page({})
+        self.assertEqual(table.paginator.approximate_count, len(self.names))
+        self.assertIn('about {} in total'.format(len(self.names)),
+                      table.as_html(table.request))
+
+
+class TestExport(TestCase):
+    """
+    Test exporting the filtered rows of the tables
+    """
+    def setUp(self):
+        make_example_files(self)
+
+    def _export(self, url_name, params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        content = self._export('data_files', {'export': 'csv',
+                                              'columns': 'name,size',
+                                              'directory': 'dir2'})
+        self.assertEqual(content.decode('utf-8').splitlines(),
+                         ['name,size', 'test4,4', 'test8,8'])
+
+    def test_ndjson(self):
+        content = self._export('data_files', {
+            'export': 'ndjson', 'name': 'test1',
+            'columns': 'name,tape_url,institute__short_name'
+        })
+        self.assertEqual(
+            [json.loads(line) for line in content.decode('utf-8').splitlines()],
+            [{'name': 'test1', 'tape_url': None,
+              'institute__short_name': 'MOHC'}]
+        )
+
+    def test_gzip(self):
+        content = self._export('data_files', {'export': 'csv', 'gzip': '1',
+                                              'columns': 'name'})
+        self.assertEqual(gzip.decompress(content).decode('utf-8').split(),
+                         ['name', 'test1', 'test4', 'test8', 'test2'])
+
+    def test_distinct(self):
+        models.DataFile.objects.update(tape_url='et:1234')
+        content = self._export('data_submissions', {
+            'export': 'csv', 'tape_url': '1234', 'columns': 'directory'
+        })
+        self.assertEqual(content.decode('utf-8').splitlines(),
+                         ['directory', '/some/dir'])
+
+    def test_default_columns(self):
+        content = self._export('data_issues', {'export': 'csv'})
+        self.assertEqual(content.decode('utf-8').splitlines()[0],
+                         ','.join(field.attname for field in
+                                  models.DataIssue._meta.concrete_fields))
+
+    def test_invalid(self):
+        for params in ({'export': 'xml'},
+                       {'export': 'csv', 'columns': 'name,password'}):
+            response = self.client.get(reverse('data_files'), params)
+            self.assertEqual(response.status_code, 400)
+
+
+class TestRetrievalPreviewViews(TestCase):
+    """
+    Test the pages that preview a retrieval request
+    """
+    def setUp(self):
+        make_example_files(self)
+        self.client.force_login(self.user)
+
+    def test_retrieval_years(self):
+        response = self.client.post(reverse('retrieval_years'), {
+            'request_data_req_{}'.format(self.dreq1.id): 'on',
+            'request_data_req_{}'.format(self.dreq2.id): 'on',
+            'variables_received_url': '/received_data/'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['earliest_year'], 1950)
+        self.assertEqual(response.context['end_year'], 1990)
+        self.assertEqual(response.context['data_reqs'],
+                         [str(self.dreq1), str(self.dreq2)])
+
+    def test_confirm_retrieval(self):
+        response = self.client.post(reverse('confirm_retrieval'), {
+            'data_request_ids': '{},{}'.format(self.dreq1.id, self.dreq2.id),
+            'start_year': 1950,
+            'end_year': 1960,
+            'return_url': '/received_data/'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['request_size'], 3)
+        self.assertEqual(response.context['preview'].offline_size, 0)
+
+
+class TestReceivedDataRequestList(TestCase):
+    """
+    Test the Variables Received page
+    """
+    def setUp(self):
+        cache.clear()
+        make_example_files(self)
+        self.client.force_login(self.user)
+
+    def test_stale_summaries_unknown(self):
+        response = self.client.get(reverse('received_data'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '13\xa0bytes')
+        self.assertTrue(models.ReceivedDataSummary.objects.filter(
+            stale=True).exists())
+
+        models.ReceivedDataSummary.refresh()
+        cache.clear()
+        response = self.client.get(reverse('received_data'))
+        self.assertContains(response, '13\xa0bytes')
+
+
+class TestRetrievalRequestList(TestCase):
+    """
+    Test the retrieval requests page
+    """
+    def setUp(self):
+        cache.clear()
+        make_example_files(self)
+        self.retrieval = models.RetrievalRequest.objects.create(
+            requester=self.user, start_year=1950, end_year=2000
+        )
+        self.retrieval.data_request.add(self.dreq1, self.dreq2)
+
+    def test_uncached_sizes_not_saved(self):
+        models.RetrievalRequest.objects.update(cached_size=None)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('retrieval_requests'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '15\xa0bytes')
+        self.assertFalse([query for query in context.captured_queries
+                          if query['sql'].startswith('UPDATE')])
+        self.assertIsNone(models.RetrievalRequest.objects.get().cached_size)
@@ -11,7 +11,8 @@ import six
 import tempfile
 
 from pdata_app.models import (Checksum, ClimateModel, DataRequest, Institute,
-                              Project, Settings, TapeChecksum)
+                              Project, Settings, TapeChecksum,
+                              deferred_file_updates)
 from pdata_app.utils.common import (adler32, construct_drs_path,
                                     construct_filename, get_gws,
                                     delete_drs_dir, is_same_gws,
@@ -19,8 +20,16 @@ from pdata_app.utils.common import (adler32, construct_drs_path,
 
 logger = logging.getLogger(__name__)
 
-# The top-level directory to write output data to
-BASE_OUTPUT_DIR = Settings.get_solo().base_output_dir
+# The top-level directory to write output data to, overriding the base
+# output directory in the app's Settings if set
+BASE_OUTPUT_DIR = None
+
+
+def _base_output_dir():
+    """
+    Return the top-level directory to write output data to.
+    """
+    return BASE_OUTPUT_DIR or Settings.get_cached().base_output_dir
 
 
 class AttributeUpdateError(Exception):
@@ -77,7 +86,7 @@ class DmtUpdate(object):
         self.new_value = new_value
         self.old_filename = self.datafile.name
         self.old_directory = self.datafile.directory
-        self.old_sym_link_dir = os.path.join(BASE_OUTPUT_DIR,
+        self.old_sym_link_dir = os.path.join(_base_output_dir(),
                                              construct_drs_path(self.datafile))
         self.new_filename = None
         self.new_directory = None
@@ -189,7 +198,7 @@ class DmtUpdate(object):
             delete_drs_dir(self.old_directory)
 
         # Update the symbolic link if required
-        if not is_same_gws(self.old_directory, BASE_OUTPUT_DIR):
+        if not is_same_gws(self.old_directory, _base_output_dir()):
             old_link_path = os.path.join(self.old_sym_link_dir,
                                          self.old_filename)
             if os.path.lexists(old_link_path):
@@ -204,7 +213,7 @@ class DmtUpdate(object):
                     if not os.listdir(self.old_sym_link_dir):
                         delete_drs_dir(self.old_sym_link_dir)
 
-            new_link_dir = os.path.join(BASE_OUTPUT_DIR,
+            new_link_dir = os.path.join(_base_output_dir(),
                                         construct_drs_path(self.datafile))
             if not os.path.exists(new_link_dir):
                 os.makedirs(new_link_dir)
@@ -238,22 +247,24 @@ class DataRequestUpdate(DmtUpdate):
 
     def update(self):
         """
-        Update everything.
+        Update everything. The file is saved several times and so the
+        updates to its parents' cached values are made once at the end.
         """
         if not self.update_file_only:
             # Default mode of operation. Update the data request and
             # everything.
-            self._find_new_dreq()
-            self._check_available()
-            self._update_database_attribute()
-            self._update_file_attribute()
-            self._construct_filename()
-            self._update_filename_in_db()
-            self._construct_directory()
-            self._update_directory_in_db()
-            self._rename_file()
-            self._update_checksum()
-            self._move_dreq()
+            with deferred_file_updates():
+                self._find_new_dreq()
+                self._check_available()
+                self._update_database_attribute()
+                self._update_file_attribute()
+                self._construct_filename()
+                self._update_filename_in_db()
+                self._construct_directory()
+                self._update_directory_in_db()
+                self._rename_file()
+                self._update_checksum()
+                self._move_dreq()
         else:
             # For when this has been run before and we just need to update
             # files that have pulled from disk again.
@@ -3,12 +3,16 @@ common.py - several functions that are used throughout the pdata_app
 """
 from __future__ import unicode_literals, division, absolute_import
 
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import hashlib
 import logging
 import os
 import random
 import re
 from subprocess import check_output, CalledProcessError, STDOUT
+import threading
+import zlib
 from six.moves import zip_longest
 from six import string_types
 from tempfile import gettempdir
@@ -21,14 +25,19 @@ except ImportError:
     from partial_date_time import PartialDateTime
 import netcdftime
 import cf_units
+import numpy as np
 
-from django.db.models import Sum
+from django.db.models import Max, Min, Q, Sum
 
 PAUSE_FILES = {
     'et:': '/gws/nopw/j04/primavera5/.tape_pause/pause_et',
     'moose:': '/gws/nopw/j04/primavera5/.tape_pause/pause_moose',
 }
 
+# The size in bytes of the buffer that files are read into to checksum them
+CHECKSUM_BUFFER_SIZE = 8 * 1024 * 1024
+# The default number of files to checksum at once
+CHECKSUM_THREADS = 4
 
 logger = logging.getLogger(__name__)
 
@@ -66,21 +75,182 @@ def safe_strftime(dt, format):
 
 
 def md5(fpath):
-    return _checksum('md5sum', fpath)
+    return checksums(fpath, ['md5sum'])['md5sum']
 
 
 def sha256(fpath):
-    return _checksum('sha256sum', fpath)
+    return checksums(fpath, ['sha256sum'])['sha256sum']
 
 
 def adler32(fpath):
-    return _checksum('adler32', fpath)
+    return checksums(fpath, ['adler32'])['adler32']
+
+
+class _Adler32(object):
+    """
+    Calculate an Adler-32 checksum in the same way as the hashlib hashes,
+    giving the value in decimal as the adler32 program does.
+    """
+    def __init__(self):
+        self.value = zlib.adler32(b'')
+
+    def update(self, data):
+        self.value = zlib.adler32(data, self.value)
+
+    def result(self):
+        return '{}'.format(self.value & 0xffffffff)
+
+
+class _HashlibChecksum(object):
+    """
+    Calculate a hashlib hash, giving the value in hexadecimal as the md5sum
+    and sha256sum programs do.
+    """
+    def __init__(self, name):
+        self._hash = hashlib.new(name)
+
+    def update(self, data):
+        self._hash.update(data)
+
+    def result(self):
+        return self._hash.hexdigest()
+
+
+# The in-process equivalents of the checksum programs
+NATIVE_CHECKSUMS = {
+    'adler32': _Adler32,
+    'md5sum': lambda: _HashlibChecksum('md5'),
+    'sha256sum': lambda: _HashlibChecksum('sha256'),
+}
+
+# The read buffer of each thread, which is reused for every file
+_checksum_buffers = threading.local()
+
+
+def _checksum_buffer():
+    """
+    The buffer for the current thread to read files into.
+    """
+    buffer = getattr(_checksum_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != CHECKSUM_BUFFER_SIZE:
+        buffer = bytearray(CHECKSUM_BUFFER_SIZE)
+        _checksum_buffers.buffer = buffer
+    return buffer
+
+
+def checksums(file_path, checksum_methods):
+    """
+    Calculate one or more checksums of `file_path`, reading the file once.
+    The checksums are calculated in this process and are identical to those
+    from the programs named in `checksum_methods`. The programs are run
+    instead for any methods that aren't in `NATIVE_CHECKSUMS`, or if the
+    file can't be read.
+
+    :param str file_path: the file to checksum
+    :param list checksum_methods: the names of the checksum programs
+    :returns: the checksums, or None for any that couldn't be calculated,
+        keyed by method
+    :rtype: dict
+    """
+    accumulators = {method: NATIVE_CHECKSUMS[method]()
+                    for method in checksum_methods
+                    if method in NATIVE_CHECKSUMS}
+    results = {}
+    if accumulators:
+        buffer = _checksum_buffer()
+        view = memoryview(buffer)
+        try:
+            with open(file_path, 'rb', buffering=0) as fh:
+                while True:
+                    num_read = fh.readinto(buffer)
+                    if not num_read:
+                        break
+                    for accumulator in accumulators.values():
+                        accumulator.update(view[:num_read])
+        except (IOError, OSError) as exc:
+            logger.debug('Unable to read {} to checksum it: {}'.
+                         format(file_path, exc))
+        else:
+            results = {method: accumulator.result()
+                       for method, accumulator in accumulators.items()}
+
+    for method in checksum_methods:
+        if method not in results:
+            results[method] = _checksum(method, file_path)
+    return results
+
+
+def checksum_files(file_paths, checksum_method, num_threads=CHECKSUM_THREADS):
+    """
+    Calculate a checksum of each of `file_paths` concurrently. Hashing the
+    data releases the GIL and so the files are checksummed by a pool of
+    threads.
+
+    :param list file_paths: the files to checksum
+    :param str checksum_method: the name of the checksum program
+    :param int num_threads: the number of files to checksum at once
+    :returns: the checksum of each file, or None if it couldn't be
+        calculated, keyed by file path
+    :rtype: dict
+    """
+    file_paths = list(file_paths)
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        values = executor.map(
+            lambda file_path: checksums(file_path,
+                                        [checksum_method])[checksum_method],
+            file_paths
+        )
+        return dict(zip(file_paths, values))
+
+
+def read_file_with_checksums(file_path, checksum_methods):
+    """
+    Read the whole of `file_path` into memory, calculating one or more
+    checksums from the data as it's read, so that a file that is needed in
+    memory isn't then read again to checksum it. Only the methods in
+    `NATIVE_CHECKSUMS` can be used.
+
+    :param str file_path: the file to read
+    :param list checksum_methods: the names of the checksum programs
+    :returns: the contents of the file and its checksums keyed by method
+    :rtype: tuple
+    :raises ValueError: if a method isn't in `NATIVE_CHECKSUMS`
+    :raises IOError: if the file can't be read
+    """
+    unknown = [method for method in checksum_methods
+               if method not in NATIVE_CHECKSUMS]
+    if unknown:
+        raise ValueError('Checksums cannot be calculated while reading: '
+                         '{}'.format(', '.join(unknown)))
+    accumulators = {method: NATIVE_CHECKSUMS[method]()
+                    for method in checksum_methods}
+
+    with open(file_path, 'rb', buffering=0) as fh:
+        contents = bytearray(os.fstat(fh.fileno()).st_size)
+        view = memoryview(contents)
+        offset = 0
+        while offset < len(contents):
+            num_read = fh.readinto(
+                view[offset:offset + CHECKSUM_BUFFER_SIZE]
+            )
+            if not num_read:
+                break
+            for accumulator in accumulators.values():
+                accumulator.update(view[offset:offset + num_read])
+            offset += num_read
+    if offset != len(contents):
+        raise IOError('{} changed size while it was being read'.
+                      format(file_path))
+
+    return contents, {method: accumulator.result()
+                      for method, accumulator in accumulators.items()}
 
 
 def _checksum(checksum_method, file_path):
     """
     Runs program `checksum_method` on `file_path` and returns the result or
-    None if running the program was unsuccessful.
+    None if running the program was unsuccessful. `checksums()` uses this if
+    it can't calculate a checksum itself.
 
     :param str command:
     :param str file_path:
@@ -284,6 +454,86 @@ def standardise_time_unit(time_float, time_unit, standard_unit, calendar):
     return corrected_time
 
 
+def standardise_time_units(times, standard_unit):
+    """
+    Standardise many floating point times to the `standard_unit`. The times
+    are grouped by their units and calendar and each group is converted with
+    a single call on an array, giving identical values to calling
+    `standardise_time_unit()` on each time individually.
+
+    :param list times: tuples of (time, time units, calendar)
+    :param str standard_unit: The new unit
+    :returns: A list of the times in `standard_unit` in the same order as
+        `times`. The value is None where any of the time, units or calendar
+        are None.
+    """
+    std_times = [None] * len(times)
+    if standard_unit is None:
+        return std_times
+
+    groups = {}
+    for index, (time_float, time_unit, calendar) in enumerate(times):
+        if time_float is None or time_unit is None or calendar is None:
+            continue
+        indices, values = groups.setdefault((time_unit, calendar), ([], []))
+        indices.append(index)
+        values.append(time_float)
+
+    for (time_unit, calendar), (indices, values) in groups.items():
+        if time_unit == standard_unit:
+            corrected_times = values
+        else:
+            date_times = cf_units.num2date(np.array(values), time_unit,
+                                           calendar)
+            corrected_times = np.atleast_1d(
+                cf_units.date2num(date_times, standard_unit, calendar)
+            ).tolist()
+        for index, corrected_time in zip(indices, corrected_times):
+            std_times[index] = corrected_time
+
+    return std_times
+
+
+def extreme_time(queryset, field_name, standard_unit, latest=False):
+    """
+    Find the earliest (or latest) time in a field of the files in a query set
+    after standardising the times to `standard_unit`. The minimum (or maximum)
+    of each combination of time units and calendar is found in the database
+    as converting between units doesn't change the order of times.
+
+    :param django.db.models.query.QuerySet queryset: the files to search,
+        which must have `time_units` and `calendar` fields
+    :param str field_name: the name of the time field
+    :param str standard_unit: The units to standardise the times to
+    :param bool latest: find the latest rather than the earliest time
+    :returns: a tuple of the time in `standard_unit` and its calendar or
+        None if no files have a time
+    """
+    aggregate = Max if latest else Min
+    groups = list(
+        queryset.order_by().values_list('time_units', 'calendar').
+        annotate(extreme=aggregate(field_name))
+    )
+    std_times = standardise_time_units(
+        [(time_float, time_unit, calendar)
+         for time_unit, calendar, time_float in groups],
+        standard_unit
+    )
+
+    none_values_removed = [(std_time, calendar)
+                           for std_time, (_unit, calendar, _time)
+                           in zip(std_times, groups)
+                           if std_time is not None]
+
+    if not none_values_removed:
+        return None
+
+    if latest:
+        return max(none_values_removed, key=lambda x: x[0])
+    else:
+        return min(none_values_removed, key=lambda x: x[0])
+
+
 def is_same_gws(path1, path2):
     """
     Check that two paths both start with the same group workspace name.
@@ -561,6 +811,45 @@ def date_filter_files(data_files, start_year, end_year):
     return (timeless_files | data_files).distinct()
 
 
+def date_filter_q(time_units_calendars, start_year, end_year):
+    """
+    Create a filter that selects the data files that lie between or include
+    the 1st January in the start year and the last day of the end year in
+    the same way as `date_filter_files()`. Each file's own time units and
+    calendar are used, rather than assuming that all of the files have the
+    same units, so that the files from many data requests can be filtered in
+    a single query.
+
+    :param Iterable time_units_calendars: the (time_units, calendar) pairs
+        used by the files to filter.
+    :param int start_year: the first year of the range to find.
+    :param int end_year: the final year of the range to find.
+    :returns: the filter to apply to a DataFile query set
+    :rtype: django.db.models.Q
+    """
+    if start_year is None or end_year is None:
+        return Q()
+
+    date_filter = Q(start_time__isnull=True)
+    for time_units, calendar in time_units_calendars:
+        units_filter = Q(time_units=time_units, calendar=calendar)
+        if time_units and calendar:
+            start_float = cf_units.date2num(
+                datetime.datetime(start_year, 1, 1), time_units, calendar
+            )
+            end_float = cf_units.date2num(
+                datetime.datetime(end_year + 1, 1, 1), time_units, calendar
+            )
+            # files between the dates or that straddle either end
+            units_filter &= (
+                Q(start_time__gte=start_float, end_time__lt=end_float) |
+                Q(start_time__lt=start_float, end_time__gt=start_float) |
+                Q(start_time__lt=end_float, end_time__gt=end_float)
+            )
+        date_filter |= units_filter
+    return date_filter
+
+
 def delete_drs_dir(directory, mip_eras=('PRIMAVERA', 'CMIP6')):
     """
     Delete the directory specified and any empty parent directories until
@@ -601,7 +890,7 @@ def delete_files(query_set, base_output_dir, skip_badc=False):
     archive_prefix = '/badc'
 
     directories_found = []
-    for df in query_set.filter(online=True):
+    for df in query_set.filter(online=True).for_drs():
         if not (skip_badc and df.directory.startswith(archive_prefix)):
             try:
                 os.remove(os.path.join(df.directory, df.name))
@@ -0,0 +1,100 @@
+"""
+export.py - stream the rows of a queryset as CSV or newline delimited JSON
+    so that large listings can be downloaded without loading them all into
+    memory.
+"""
+from __future__ import unicode_literals, division, absolute_import
+import csv
+import datetime
+import decimal
+import json
+import zlib
+
+# The export formats and their content types
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# The number of rows to read from the database in each chunk
+EXPORT_CHUNK_SIZE = 2000
+
+
+class _LineBuffer(object):
+    """
+    A file-like object that returns what is written to it so that csv.writer
+    can be used to format single lines.
+    """
+    def write(self, value):
+        return value
+
+
+def _json_default(value):
+    """
+    Convert the values that the json module can't serialise.
+    """
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def export_lines(queryset, fields, export_format,
+                 chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Generate the lines of the export of `queryset`. The rows are read from
+    the database in chunks and the lines from each chunk are yielded
+    together.
+
+    :param django.db.models.query.QuerySet queryset: the records to export
+    :param list fields: the names of the fields to export, which can include
+        fields of related models
+    :param str export_format: csv or ndjson
+    :param int chunk_size: the number of rows in each chunk
+    :returns: the lines of the export
+    :rtype: generator of str
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format {}'.format(export_format))
+
+    if export_format == 'csv':
+        writer = csv.writer(_LineBuffer())
+
+        def format_row(row):
+            return writer.writerow(['' if row[field] is None else row[field]
+                                    for field in fields])
+        yield writer.writerow(fields)
+    else:
+        def format_row(row):
+            return json.dumps({field: row[field] for field in fields},
+                              default=_json_default) + '\n'
+
+    # the primary key is included so that the rows can be ordered by it
+    # and so that distinct() doesn't merge identical rows
+    rows = queryset.values('pk', *fields).order_by('pk')
+    lines = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        lines.append(format_row(row))
+        if len(lines) >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def gzip_stream(lines):
+    """
+    Compress a stream of text with gzip, yielding the compressed data as
+    each piece of text is added.
+
+    :param lines: the text to compress
+    :returns: the compressed data
+    :rtype: generator of bytes
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for line in lines:
+        data = compressor.compress(line.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,99 @@
+"""
+fk_resolver.py - find the records that a file's metadata refers to from
+    records loaded once, rather than querying the database for every file
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+from pdata_app.models import (ActivityId, ClimateModel, DataRequest,
+                              Experiment, Institute, Project)
+
+
+class ForeignKeyResolver(object):
+    """
+    Resolve the short names and data requests in the metadata of many files.
+
+    All of the records of each model referred to by short name are loaded
+    the first time that the model is used. The data requests for each
+    combination of project, institute, climate model and experiment are
+    loaded, along with their variable requests, the first time that the
+    combination is used. The lookups for the remaining files are then made
+    in memory. The records aren't reloaded and so a resolver should only be
+    used for the duration of a single task, such as validating a submission.
+    """
+    # The models that files refer to by short name, keyed by the name of the
+    # metadata item
+    SHORT_NAME_MODELS = {
+        'project': Project,
+        'climate_model': ClimateModel,
+        'experiment': Experiment,
+        'institute': Institute,
+        'activity_id': ActivityId,
+    }
+
+    def __init__(self):
+        self._short_names = {}
+        self._data_requests = {}
+
+    def short_name(self, item_name, short_name):
+        """
+        Find the record with `short_name` of the model for metadata item
+        `item_name`.
+
+        :param str item_name: the name of the metadata item, which is a key
+            of `SHORT_NAME_MODELS`
+        :param str short_name: the short name to find
+        :returns: the record or None if there isn't a record with this short
+            name
+        """
+        if item_name not in self._short_names:
+            self._short_names[item_name] = {
+                record.short_name: record
+                for record in self.SHORT_NAME_MODELS[item_name].objects.all()
+            }
+        return self._short_names[item_name].get(short_name)
+
+    def data_requests(self, project, institute, climate_model, experiment,
+                      table_name, rip_code, cmor_name=None, var_name=None):
+        """
+        Find the data requests for a variable. Exactly one of `cmor_name` and
+        `var_name` must be given.
+
+        :param pdata_app.models.Project project: the project
+        :param pdata_app.models.Institute institute: the institute
+        :param pdata_app.models.ClimateModel climate_model: the climate model
+        :param pdata_app.models.Experiment experiment: the experiment
+        :param str table_name: the variable request's MIP table
+        :param str rip_code: the variant label
+        :param str cmor_name: the variable request's CMOR name
+        :param str var_name: the variable request's output variable name
+        :returns: the matching data requests, which have their variable
+            requests loaded
+        :rtype: list
+        :raises ValueError: if both or neither of `cmor_name` and `var_name`
+            are given
+        """
+        if (cmor_name is None) == (var_name is None):
+            raise ValueError('Exactly one of cmor_name and var_name must be '
+                             'specified')
+
+        key = (project.pk, institute.pk, climate_model.pk, experiment.pk)
+        if key not in self._data_requests:
+            by_variable = {}
+            for data_request in DataRequest.objects.filter(
+                    project=project, institute=institute,
+                    climate_model=climate_model, experiment=experiment
+            ).select_related('variable_request').order_by('pk'):
+                vble_req = data_request.variable_request
+                for name_field, name in (('cmor_name', vble_req.cmor_name),
+                                         ('var_name', vble_req.var_name)):
+                    by_variable.setdefault(
+                        (name_field, vble_req.table_name, name,
+                         data_request.rip_code), []
+                    ).append(data_request)
+            self._data_requests[key] = by_variable
+
+        if cmor_name is not None:
+            variable = ('cmor_name', table_name, cmor_name, rip_code)
+        else:
+            variable = ('var_name', table_name, var_name, rip_code)
+        return self._data_requests[key].get(variable, [])
@@ -0,0 +1,100 @@
+"""
+retrieval_preview.py - summarise the files that a retrieval request for a set
+    of data requests would restore, using a fixed number of grouped queries
+    however many data requests are chosen.
+"""
+from __future__ import unicode_literals, division, absolute_import
+import collections
+
+import cf_units
+
+from django.db.models import Count, Max, Min, Q, Sum
+
+from pdata_app.models import DataFile, DataRequest
+from pdata_app.utils.common import date_filter_q
+
+RetrievalPreview = collections.namedtuple('RetrievalPreview', [
+    'data_requests',
+    'earliest_year',
+    'latest_year',
+    'total_size',
+    'offline_size',
+    'num_tape_batches',
+])
+RetrievalPreview.__doc__ = """
+The summary of a possible retrieval request.
+
+:ivar list data_requests: the data requests in the order that their ids were
+    given
+:ivar int earliest_year: the year of the earliest data or None if the data
+    requests have no files with times
+:ivar int latest_year: the year of the latest data or None if the data
+    requests have no files with times
+:ivar int total_size: the size in bytes of the files in the years requested
+:ivar int offline_size: the size in bytes of the files in the years requested
+    that are only on tape
+:ivar int num_tape_batches: the number of different tape URLs that the
+    offline files would be restored from
+"""
+
+
+def preview_retrieval(data_request_ids, start_year=None, end_year=None):
+    """
+    Summarise the files in the data requests with `data_request_ids`.
+
+    :param list data_request_ids: the ids of the data requests
+    :param int start_year: the first year of the retrieval or None to
+        include all years
+    :param int end_year: the final year of the retrieval or None to include
+        all years
+    :returns: the summary
+    :rtype: RetrievalPreview
+    """
+    data_request_ids = [int(req_id) for req_id in data_request_ids]
+    data_requests = DataRequest.objects.filter(
+        id__in=data_request_ids
+    ).select_related('institute', 'climate_model', 'experiment',
+                     'variable_request').in_bulk()
+
+    data_files = DataFile.objects.filter(
+        data_request__in=data_request_ids
+    ).order_by()
+
+    # the earliest and latest times are found for each set of time units
+    # because the times can only be compared once they're converted to dates
+    time_ranges = list(
+        data_files.values('time_units', 'calendar').
+        annotate(min_start=Min('start_time'), max_end=Max('end_time'))
+    )
+    start_years = []
+    end_years = []
+    for time_range in time_ranges:
+        if not (time_range['time_units'] and time_range['calendar']):
+            continue
+        for time_value, years in ((time_range['min_start'], start_years),
+                                  (time_range['max_end'], end_years)):
+            if time_value is not None:
+                years.append(cf_units.num2date(time_value,
+                                               time_range['time_units'],
+                                               time_range['calendar']).year)
+
+    time_units_calendars = [(time_range['time_units'], time_range['calendar'])
+                            for time_range in time_ranges]
+    offline = Q(online=False)
+    sizes = data_files.filter(
+        date_filter_q(time_units_calendars, start_year, end_year)
+    ).aggregate(
+        total_size=Sum('size'),
+        offline_size=Sum('size', filter=offline),
+        num_tape_batches=Count('tape_url', distinct=True, filter=offline)
+    )
+
+    return RetrievalPreview(
+        data_requests=[data_requests[req_id] for req_id in data_request_ids
+                       if req_id in data_requests],
+        earliest_year=min(start_years) if start_years else None,
+        latest_year=max(end_years) if end_years else None,
+        total_size=sizes['total_size'] or 0,
+        offline_size=sizes['offline_size'] or 0,
+        num_tape_batches=sizes['num_tape_batches'] or 0
+    )
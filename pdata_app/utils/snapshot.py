@@ -0,0 +1,300 @@
+"""
+snapshot.py - a columnar snapshot of the DataFile table that is saved to disk
+    as NumPy .npy files so that reports can load it memory-mapped and
+    aggregate it with NumPy rather than running many queries.
+
+Each column is saved as a separate .npy file. Text and foreign key columns are
+dictionary encoded: the column holds integer codes and the values that the
+codes refer to are saved in categories.json. A code of -1 shows a null value.
+Times are standardised to the app's standard time units and missing times are
+NaN.
+
+The snapshot is refreshed incrementally. Files with an id above the highest id
+in the snapshot are appended, the columns that change as files are retrieved
+and deleted are re-read for the existing files, and files that have been
+deleted from the database are removed.
+"""
+from __future__ import unicode_literals, division, absolute_import
+import json
+import logging
+import os
+
+import numpy as np
+
+from pdata_app.models import DataFile, Settings
+from pdata_app.utils.common import grouper, standardise_time_units
+
+logger = logging.getLogger(__name__)
+
+# The name of the file containing the snapshot's metadata
+METADATA_FILE = 'snapshot.json'
+# The name of the file containing the values of the dictionary encoded columns
+CATEGORIES_FILE = 'categories.json'
+
+# The numeric columns and their NumPy types
+NUMERIC_COLUMNS = {
+    'id': np.int64,
+    'data_request_id': np.int64,
+    'size': np.int64,
+    'online': np.bool_,
+}
+# The dictionary encoded columns and the DataFile fields that they contain
+CATEGORY_COLUMNS = {
+    'institute': 'institute__short_name',
+    'climate_model': 'climate_model__short_name',
+    'experiment': 'experiment__short_name',
+    'table_name': 'variable_request__table_name',
+    'cmor_name': 'variable_request__cmor_name',
+    'rip_code': 'rip_code',
+    'tape_url': 'tape_url',
+    'calendar': 'calendar',
+}
+# The columns that change during a file's life and so are re-read for the
+# files already in the snapshot each time that it's refreshed
+MUTABLE_COLUMNS = ('size', 'online', 'tape_url')
+
+# The number of files to read from the database in each chunk
+CHUNK_SIZE = 10000
+
+
+class DataFileSnapshot(object):
+    """
+    A snapshot of the DataFile table loaded from disk. The columns are
+    memory-mapped and so only the parts that are used are read.
+    """
+    def __init__(self, directory):
+        """
+        :param str directory: the directory containing the snapshot
+        """
+        self.directory = directory
+        with open(os.path.join(directory, METADATA_FILE)) as fh:
+            self.metadata = json.load(fh)
+        with open(os.path.join(directory, CATEGORIES_FILE)) as fh:
+            self.categories = json.load(fh)
+        self.columns = {
+            name: np.load(os.path.join(directory, name + '.npy'),
+                          mmap_mode='r')
+            for name in self.metadata['columns']
+        }
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def isin(self, column, values):
+        """
+        Find the files whose dictionary encoded `column` has one of `values`.
+
+        :param str column: the name of the column
+        :param list values: the values to match
+        :returns: a boolean mask of the matching files
+        :rtype: numpy.ndarray
+        """
+        category_values = self.categories[column]
+        codes = [category_values.index(value) for value in values
+                 if value in category_values]
+        return np.isin(self.columns[column], codes)
+
+    def decode(self, column, codes):
+        """
+        Convert the codes from a dictionary encoded column to their values.
+
+        :param str column: the name of the column
+        :param codes: the codes to convert
+        :returns: the values with None for any null values
+        :rtype: list
+        """
+        category_values = self.categories[column]
+        return [category_values[code] if code >= 0 else None
+                for code in codes]
+
+
+def _encode(values, category_values, category_codes):
+    """
+    Dictionary encode `values`, adding any new values to the categories.
+
+    :param list values: the values to encode
+    :param list category_values: the values of the existing codes
+    :param dict category_codes: the existing codes keyed by value
+    :returns: the codes
+    :rtype: numpy.ndarray
+    """
+    codes = np.empty(len(values), dtype=np.int32)
+    for index, value in enumerate(values):
+        if value is None:
+            codes[index] = -1
+            continue
+        code = category_codes.get(value)
+        if code is None:
+            code = len(category_values)
+            category_values.append(value)
+            category_codes[value] = code
+        codes[index] = code
+    return codes
+
+
+def _read_files(data_files, std_units, categories, category_codes):
+    """
+    Read all of the columns of the files in `data_files` from the database.
+
+    :param django.db.models.query.QuerySet data_files: the files to read
+    :param str std_units: the units to standardise the times to
+    :param dict categories: the values of the dictionary encoded columns
+    :param dict category_codes: the codes of the dictionary encoded columns
+    :returns: the columns keyed by name
+    :rtype: dict
+    """
+    category_fields = list(CATEGORY_COLUMNS.values())
+    fields = (list(NUMERIC_COLUMNS) + category_fields +
+              ['start_time', 'end_time', 'time_units'])
+    rows = (data_files.order_by('id').values_list(*fields).
+            iterator(chunk_size=CHUNK_SIZE))
+
+    chunks = []
+    for chunk in grouper(rows, CHUNK_SIZE):
+        values = dict(zip(fields, zip(*chunk)))
+        columns = {
+            name: np.array(values[name], dtype=dtype)
+            for name, dtype in NUMERIC_COLUMNS.items()
+        }
+        for name, field in CATEGORY_COLUMNS.items():
+            columns[name] = _encode(values[field], categories[name],
+                                    category_codes[name])
+        for name in ('start_time', 'end_time'):
+            std_times = standardise_time_units(
+                list(zip(values[name], values['time_units'],
+                         values['calendar'])),
+                std_units
+            )
+            columns[name] = np.array(
+                [np.nan if time is None else time for time in std_times],
+                dtype=np.float64
+            )
+        chunks.append(columns)
+
+    if not chunks:
+        return _empty_columns()
+    return {name: np.concatenate([chunk[name] for chunk in chunks])
+            for name in chunks[0]}
+
+
+def _empty_columns():
+    """
+    The columns of a snapshot containing no files.
+    """
+    columns = {name: np.array([], dtype=dtype)
+               for name, dtype in NUMERIC_COLUMNS.items()}
+    columns.update({name: np.array([], dtype=np.int32)
+                    for name in CATEGORY_COLUMNS})
+    columns.update({name: np.array([], dtype=np.float64)
+                    for name in ('start_time', 'end_time')})
+    return columns
+
+
+def _refresh_existing(columns, high_water_mark, categories, category_codes):
+    """
+    Remove deleted files and re-read the mutable columns of the files
+    already in the snapshot.
+
+    :param dict columns: the snapshot's existing columns
+    :param int high_water_mark: the highest id in the snapshot
+    :param dict categories: the values of the dictionary encoded columns
+    :param dict category_codes: the codes of the dictionary encoded columns
+    :returns: the updated columns
+    :rtype: dict
+    """
+    fields = ['id'] + [CATEGORY_COLUMNS.get(name, name)
+                       for name in MUTABLE_COLUMNS]
+    rows = list(DataFile.objects.filter(id__lte=high_water_mark).
+                order_by('id').values_list(*fields))
+    current_ids = np.array([row[0] for row in rows], dtype=np.int64)
+
+    in_database = np.isin(columns['id'], current_ids)
+    columns = {name: column[in_database] for name, column in columns.items()}
+    in_snapshot = np.isin(current_ids, columns['id'])
+    rows = [row for row, keep in zip(rows, in_snapshot) if keep]
+
+    # the first value in each row is the id
+    values = dict(zip(MUTABLE_COLUMNS, list(zip(*rows))[1:]))
+    for name in MUTABLE_COLUMNS:
+        column_values = values.get(name, ())
+        if name in CATEGORY_COLUMNS:
+            columns[name] = _encode(column_values, categories[name],
+                                    category_codes[name])
+        else:
+            columns[name] = np.array(column_values,
+                                     dtype=NUMERIC_COLUMNS[name])
+    return columns
+
+
+def export_snapshot(directory, full=False):
+    """
+    Create or refresh the snapshot of the DataFile table in `directory`.
+
+    :param str directory: the directory to save the snapshot in
+    :param bool full: if True then recreate the whole snapshot rather than
+        refreshing an existing one
+    :returns: the number of files in the snapshot
+    :rtype: int
+    """
+    std_units = Settings.get_cached().standard_time_units
+    metadata_path = os.path.join(directory, METADATA_FILE)
+
+    existing = None
+    if not full and os.path.exists(metadata_path):
+        existing = DataFileSnapshot(directory)
+        if existing.metadata['standard_time_units'] != std_units:
+            logger.debug('Standard time units have changed so recreating '
+                         'the snapshot')
+            existing = None
+
+    if existing:
+        high_water_mark = existing.metadata['high_water_mark']
+        categories = existing.categories
+        columns = {name: np.array(column)
+                   for name, column in existing.columns.items()}
+    else:
+        high_water_mark = 0
+        categories = {name: [] for name in CATEGORY_COLUMNS}
+        columns = _empty_columns()
+    category_codes = {
+        name: {value: code for code, value in enumerate(values)}
+        for name, values in categories.items()
+    }
+
+    if existing:
+        columns = _refresh_existing(columns, high_water_mark, categories,
+                                    category_codes)
+
+    new_columns = _read_files(DataFile.objects.filter(id__gt=high_water_mark),
+                              std_units, categories, category_codes)
+    logger.debug('{} new files found'.format(len(new_columns['id'])))
+    columns = {name: np.concatenate([columns[name], new_columns[name]])
+               for name in columns}
+    if len(columns['id']):
+        high_water_mark = max(high_water_mark, int(columns['id'].max()))
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    # write to temporary files and then move them into place so that
+    # reports don't see a partially written snapshot
+    for name, column in columns.items():
+        temp_path = os.path.join(directory, name + '.tmp.npy')
+        np.save(temp_path, column)
+        os.replace(temp_path, os.path.join(directory, name + '.npy'))
+    metadata = {
+        'columns': sorted(columns),
+        'high_water_mark': high_water_mark,
+        'standard_time_units': std_units,
+    }
+    for filename, contents in ((CATEGORIES_FILE, categories),
+                               (METADATA_FILE, metadata)):
+        temp_path = os.path.join(directory, filename + '.tmp')
+        with open(temp_path, 'w') as fh:
+            json.dump(contents, fh)
+        os.replace(temp_path, os.path.join(directory, filename))
+
+    return len(columns['id'])
@@ -0,0 +1,275 @@
+"""
+substring_search.py - create the substring search indexes and route
+    case-insensitive substring filters through them.
+
+A filter such as `name__icontains` becomes `LIKE '%x%'`, which can't use a
+B-tree index and so reads the whole table. On PostgreSQL pg_trgm GIN indexes
+are created on the upper case values, which the query planner uses for these
+filters without any change to the query. On SQLite an FTS5 table with the
+trigram tokenizer is created for each table, which is kept up to date by
+triggers, and the filter is restricted to the rows that this finds.
+
+The indexes are created by migration 0052_substring_search_indexes and are
+checked after every migrate, which recreates any that are missing or out of
+date. This includes databases whose migrations were regenerated and the SQLite
+triggers that are dropped when Django recreates a table to alter it. Until then the
+filter falls back to reading the whole table.
+"""
+from __future__ import unicode_literals, division, absolute_import
+import logging
+import time
+
+from django.db import connections, OperationalError
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+# The fields that have a substring search index, keyed by their table
+SEARCH_FIELDS = {
+    'pdata_app_datafile': ('name', 'directory', 'tape_url'),
+    'pdata_app_replacedfile': ('name', 'incoming_directory', 'tape_url'),
+    'pdata_app_datasubmission': ('incoming_directory', 'directory'),
+}
+
+# The trigram tokenizer can only find substrings of at least this length
+MIN_SEARCH_LENGTH = 3
+
+# The time in seconds before a missing search index is checked for again
+RECHECK_INTERVAL = 60
+
+# Whether each SQLite search table and its triggers exist and the time that
+# this was checked, keyed by database alias and table
+_available = {}
+
+
+class SearchMatches(RawSQL):
+    """
+    The rows that a search table matches. RawSQL wraps its SQL in
+    parentheses, which the `in` lookup does too, and SQLite treats a
+    subquery in two sets of parentheses as a single value.
+    """
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def search_table_name(table):
+    """
+    The name of the SQLite FTS5 table that indexes `table`.
+
+    :param str table: the name of the indexed table
+    :returns: the name of the search table
+    :rtype: str
+    """
+    return '{}_search'.format(table)
+
+
+def _sqlite_index_exists(connection, table):
+    """
+    Check the database for the SQLite search table for `table` and the
+    triggers that keep it up to date. An update trigger that reindexes a row
+    when any of its columns change, rather than only the indexed ones, is out
+    of date.
+
+    :param connection: the database connection
+    :param str table: the name of the indexed table
+    :returns: True if the search table and all of its triggers exist
+    :rtype: bool
+    """
+    search_table = search_table_name(table)
+    update_trigger = '{}_update'.format(search_table)
+    names = [search_table, update_trigger] + [
+        '{}_{}'.format(search_table, action)
+        for action in ('insert', 'delete')
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT name, sql FROM sqlite_master WHERE name IN ({})'.
+            format(', '.join(['%s'] * len(names))),
+            names
+        )
+        schema = dict(cursor.fetchall())
+    return (len(schema) == len(names) and
+            'AFTER UPDATE OF ' in schema[update_trigger])
+
+
+def search_index_available(connection, table):
+    """
+    Check whether the SQLite search table for `table` and the triggers that
+    keep it up to date exist. An index that exists is remembered for the life
+    of the process, but a missing one is checked for again after
+    RECHECK_INTERVAL seconds so that it's used once it has been created.
+
+    :param connection: the database connection
+    :param str table: the name of the indexed table
+    :returns: True if the search index can be used
+    :rtype: bool
+    """
+    key = (connection.alias, table)
+    available, last_checked = _available.get(key, (False, None))
+    if not available and (last_checked is None or
+                          time.time() - last_checked >= RECHECK_INTERVAL):
+        available = _sqlite_index_exists(connection, table)
+        if not available:
+            logger.warning('Substring search index for {} is missing or out '
+                           'of date'.format(table))
+        _available[key] = (available, time.time())
+    return available
+
+
+def _postgresql_create(connection, tables):
+    """
+    Create pg_trgm GIN indexes on the expression that Django's icontains
+    lookup uses.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table in tables:
+            fields = SEARCH_FIELDS[table]
+            for field in fields:
+                cursor.execute(
+                    'CREATE INDEX IF NOT EXISTS {table}_{field}_trgm ON '
+                    '{table} USING gin (UPPER({field}::text) gin_trgm_ops)'.
+                    format(table=table, field=field)
+                )
+
+
+def _postgresql_drop(connection):
+    with connection.cursor() as cursor:
+        for table, fields in SEARCH_FIELDS.items():
+            for field in fields:
+                cursor.execute('DROP INDEX IF EXISTS {}_{}_trgm'.
+                               format(table, field))
+
+
+def _sqlite_create(connection, tables):
+    """
+    Create an external content FTS5 table with the trigram tokenizer for
+    each table that doesn't have a complete one and the triggers that keep it
+    up to date, and then fill it from the table.
+    """
+    for table in tables:
+        if _sqlite_index_exists(connection, table):
+            continue
+        fields = SEARCH_FIELDS[table]
+        search = search_table_name(table)
+        columns = ', '.join(fields)
+        new_values = ', '.join('new.{}'.format(field) for field in fields)
+        old_values = ', '.join('old.{}'.format(field) for field in fields)
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS {search} USING "
+                    "fts5({columns}, content='{table}', content_rowid='id', "
+                    "tokenize='trigram')".
+                    format(search=search, columns=columns, table=table)
+                )
+            except OperationalError as exc:
+                # the trigram tokenizer needs SQLite 3.34 or later
+                logger.warning('Unable to create substring search index for '
+                               '{}: {}'.format(table, exc))
+                continue
+            insert = ('INSERT INTO {search}(rowid, {columns}) '
+                      'VALUES (new.id, {new_values});')
+            delete = ("INSERT INTO {search}({search}, rowid, {columns}) "
+                      "VALUES ('delete', old.id, {old_values});")
+            triggers = {
+                'insert': 'AFTER INSERT ON {table} BEGIN ' + insert + ' END',
+                'delete': 'AFTER DELETE ON {table} BEGIN ' + delete + ' END',
+                # only changes to the indexed fields reindex the row
+                'update': ('AFTER UPDATE OF {columns} ON {table} BEGIN ' +
+                           delete + ' ' + insert + ' END'),
+            }
+            # an out of date update trigger is replaced
+            cursor.execute('DROP TRIGGER IF EXISTS {}_update'.format(search))
+            for action, trigger in triggers.items():
+                cursor.execute(
+                    ('CREATE TRIGGER IF NOT EXISTS {search}_{action} ' +
+                     trigger).format(
+                        search=search, action=action, table=table,
+                        columns=columns, new_values=new_values,
+                        old_values=old_values
+                    )
+                )
+            # the table may have changed while any of the triggers were
+            # missing
+            cursor.execute(
+                "INSERT INTO {search}({search}) VALUES ('rebuild')".
+                format(search=search)
+            )
+        _available.pop((connection.alias, table), None)
+
+
+def _sqlite_drop(connection):
+    with connection.cursor() as cursor:
+        for table in SEARCH_FIELDS:
+            search = search_table_name(table)
+            for action in ('insert', 'delete', 'update'):
+                cursor.execute('DROP TRIGGER IF EXISTS {}_{}'.
+                               format(search, action))
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(search))
+            _available.pop((connection.alias, table), None)
+
+
+def create_search_indexes(connection):
+    """
+    Create any of the substring search indexes that are missing from the
+    database. This is safe to call when they already exist and tables that
+    haven't been created yet are skipped.
+
+    :param connection: the database connection
+    """
+    existing = set(connection.introspection.table_names())
+    tables = [table for table in SEARCH_FIELDS if table in existing]
+    if connection.vendor == 'postgresql':
+        _postgresql_create(connection, tables)
+    elif connection.vendor == 'sqlite':
+        _sqlite_create(connection, tables)
+
+
+def drop_search_indexes(connection):
+    """
+    Remove the substring search indexes from the database.
+
+    :param connection: the database connection
+    """
+    if connection.vendor == 'postgresql':
+        _postgresql_drop(connection)
+    elif connection.vendor == 'sqlite':
+        _sqlite_drop(connection)
+
+
+def substring_search_lookups(queryset, field_path, value):
+    """
+    Return the lookups that restrict `queryset` to the rows that the
+    substring search index finds containing `value` in `field_path`. These
+    are used alongside the `icontains` lookup, which they make quicker but
+    don't replace.
+
+    :param django.db.models.query.QuerySet queryset: the queryset to filter
+    :param str field_path: the field, which may be on a related model
+    :param str value: the substring to find
+    :returns: the lookups, which are empty if there's no index to use
+    :rtype: dict
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'sqlite' or len(value) < MIN_SEARCH_LENGTH:
+        return {}
+
+    relations = field_path.split('__')
+    field_name = relations.pop()
+    model = queryset.model
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    table = model._meta.db_table
+    if (field_name not in SEARCH_FIELDS.get(table, ()) or
+            not search_index_available(connection, table)):
+        return {}
+
+    # search for the value as a phrase, which the trigram tokenizer matches
+    # as a substring
+    phrase = '"{}"'.format(value.replace('"', '""'))
+    sql = 'SELECT rowid FROM {} WHERE {} MATCH %s'.format(
+        connection.ops.quote_name(search_table_name(table)),
+        connection.ops.quote_name(field_name)
+    )
+    return {'__'.join(relations + ['pk', 'in']): SearchMatches(sql, [phrase])}
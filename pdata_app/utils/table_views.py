@@ -3,24 +3,500 @@ A custom class for drawing tables from QuerySets
 
 Taken from: http://stackoverflow.com/questions/25256239/\
 how-do-i-filter-tables-with-django-generic-views
+
+The rendered tables can be cached. Every cache key contains a version and
+changing the version with `bump_table_cache_version()` invalidates all of the
+cached tables. This is done by signals whenever a model shown in the tables is
+saved or deleted, once when the transaction commits, and should be done by any
+code that updates the database in bulk in a way that bypasses the signals. The version is stored in the database with the Settings
+so that a change made by a script is seen by the web server's processes
+within SETTINGS_CACHE_TIMEOUT seconds, even if each process has its own cache.
+
+Views of large tables can set `keyset_fields` so that the table is paged
+through by seeking past the last row shown rather than by an offset, which
+makes later pages as quick to load as the first one. The pages are then
+linked to with a cursor containing the values of these fields from the first
+or last row of the current page.
+
+The filtered rows of any view can be downloaded by adding `export=csv` or
+`export=ndjson` to its parameters. The columns can be chosen with a comma
+separated list in `columns`, and `gzip=1` compresses the download.
 """
 from __future__ import unicode_literals, division, absolute_import
+import base64
+import binascii
+import hashlib
+import json
+import uuid
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db import connection, transaction
+from django.db.models import Q
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django_tables2 import SingleTableView
+from django_tables2.paginators import LazyPaginator
+from django_tables2.views import SingleTableMixin
+
+from pdata_app.utils.export import EXPORT_FORMATS, export_lines, gzip_stream
+
+def _get_settings():
+    """
+    Return this process's cached copy of the Settings, which hold the version
+    of the cached tables.
+
+    :returns: the Settings
+    """
+    # imported here because the models import this module
+    from pdata_app.models import Settings
+    return Settings.get_cached()
+
+
+def get_table_cache_version():
+    """
+    Return the current version of the cached tables.
+
+    :returns: the version
+    :rtype: str
+    """
+    return _get_settings().table_cache_version
+
+
+def get_table_cache_modified():
+    """
+    Return the time that the cached tables were last invalidated, which is
+    the last time that the database was changed.
+
+    :returns: the time
+    :rtype: datetime.datetime
+    """
+    return _get_settings().table_cache_modified.replace(microsecond=0)
+
+
+def bump_table_cache_version():
+    """
+    Invalidate all of the cached tables in every process.
+    """
+    settings_instance = _get_settings()
+    # a random version is used so that a version is never reused and so
+    # tables cached with an earlier version are never returned
+    settings_instance.table_cache_version = uuid.uuid4().hex
+    # HTTP dates are only precise to a second
+    settings_instance.table_cache_modified = (
+        timezone.now().replace(microsecond=0)
+    )
+    type(settings_instance).objects.filter(pk=settings_instance.pk).update(
+        table_cache_version=settings_instance.table_cache_version,
+        table_cache_modified=settings_instance.table_cache_modified
+    )
+
+
+def bump_table_cache_version_on_commit(using=None):
+    """
+    Invalidate all of the cached tables once the current transaction is
+    committed, or immediately if there isn't one. However many times this is
+    called in a transaction the tables are only invalidated once, and the
+    Settings row that holds the version isn't locked until the commit.
+
+    :param str using: the alias of the database
+    """
+    db_connection = transaction.get_connection(using)
+    # the callbacks of any savepoints that were rolled back have already
+    # been discarded
+    if not any(func is bump_table_cache_version
+               for _sids, func in db_connection.run_on_commit):
+        transaction.on_commit(bump_table_cache_version, using)
+
+
+def get_cached_table(key):
+    """
+    Return a rendered table from the cache.
+
+    :param str key: the table's cache key
+    :returns: the rendered table or None if it isn't in the cache
+    :rtype: str
+    """
+    return cache.get(key)
+
+
+def set_cached_table(key, html):
+    """
+    Save a rendered table in the cache.
+
+    :param str key: the table's cache key
+    :param str html: the rendered table
+    """
+    cache.set(key, html, getattr(settings, 'TABLE_CACHE_TIMEOUT', 600))
+
+
+def estimate_row_count(model):
+    """
+    Return the query planner's estimate of the number of rows in a model's
+    table. This is updated when the table is analysed and so is quick to
+    find, but only approximate.
+
+    :param model: the model class
+    :returns: the estimated number of rows or None if no estimate is
+        available
+    :rtype: int
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class '
+                       'WHERE oid = to_regclass(%s)', [model._meta.db_table])
+        row = cursor.fetchone()
+    # reltuples is -1 if the table has never been analysed
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def encode_cursor(values):
+    """
+    Encode the values of the keyset fields of a row as a cursor that can be
+    used in a URL.
+
+    :param list values: the values of the keyset fields
+    :returns: the cursor
+    :rtype: str
+    """
+    return base64.urlsafe_b64encode(
+        json.dumps(values).encode('utf-8')
+    ).decode('ascii')
+
+
+def decode_cursor(cursor, num_fields):
+    """
+    Decode a cursor created by `encode_cursor()`.
+
+    :param str cursor: the cursor
+    :param int num_fields: the number of keyset fields
+    :returns: the values of the keyset fields or None if the cursor is
+        missing or isn't valid
+    :rtype: list
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        )
+    except (ValueError, UnicodeError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != num_fields:
+        return None
+    return values
+
+
+def keyset_filter(fields, values, reverse=False):
+    """
+    Build the filter that selects the rows that come after the row with
+    keyset `values` when ordered by `fields`.
+
+    :param list fields: the names of the keyset fields
+    :param list values: the values of the keyset fields
+    :param bool reverse: if True then select the rows that come before the
+        row rather than after it
+    :returns: the filter
+    :rtype: django.db.models.Q
+    """
+    lookup = 'lt' if reverse else 'gt'
+    after = Q()
+    for index, field in enumerate(fields):
+        previous_equal = {name: value for name, value in
+                          zip(fields[:index], values[:index])}
+        previous_equal['{}__{}'.format(field, lookup)] = values[index]
+        after |= Q(**previous_equal)
+    # the redundant condition on the first field allows the database to use
+    # an index to seek to the start of the page
+    first_field = '{}__{}e'.format(fields[0], lookup)
+    return Q(**{first_field: values[0]}) & after
+
+
+class KeysetPage(Page):
+    """
+    A page of a table paged through with a `KeysetPaginator`. There are
+    cursors for the pages either side rather than page numbers.
+    """
+    def __init__(self, object_list, paginator, previous_cursor=None,
+                 next_cursor=None):
+        super(KeysetPage, self).__init__(object_list, 1, paginator)
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator(LazyPaginator):
+    """
+    A paginator for rows that have already been filtered to those after, or
+    before, the cursor in the request. The page number is ignored and the
+    first `per_page` rows are shown, with one extra row loaded to find if
+    there is a following page. No count query is run.
+    """
+    keyset = True
+
+    def __init__(self, object_list, per_page, keyset_fields=('pk',),
+                 reverse=False, has_cursor=False, approximate_count=None,
+                 **kwargs):
+        """
+        :param list keyset_fields: the fields that the rows are ordered by
+        :param bool reverse: True if the rows are before the cursor and so
+            are in reverse order
+        :param bool has_cursor: True if the request contained a cursor
+        :param int approximate_count: the approximate number of rows in the
+            whole table, if known
+        """
+        self.keyset_fields = keyset_fields
+        self.reverse = reverse
+        self.has_cursor = has_cursor
+        self.approximate_count = approximate_count
+        super(KeysetPaginator, self).__init__(object_list, per_page,
+                                              **kwargs)
+
+    def _cursor(self, row):
+        return encode_cursor([getattr(row.record, field)
+                              for field in self.keyset_fields])
+
+    def page(self, number):
+        objects = list(self.object_list[:self.per_page + 1])
+        more_rows = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if self.reverse:
+            objects.reverse()
+            more_before, more_after = more_rows, self.has_cursor
+        else:
+            more_before, more_after = self.has_cursor, more_rows
+        self._num_pages = 1
+        return KeysetPage(
+            objects,
+            self,
+            self._cursor(objects[0]) if more_before and objects else None,
+            self._cursor(objects[-1]) if more_after and objects else None
+        )
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    A paginator that uses an approximate count of the rows, when one is
+    available, rather than counting them.
+    """
+    def __init__(self, object_list, per_page, approximate_count=None,
+                 **kwargs):
+        self.approximate_count = approximate_count
+        super(ApproximateCountPaginator, self).__init__(object_list, per_page,
+                                                        **kwargs)
+
+    @cached_property
+    def count(self):
+        if self.approximate_count is not None:
+            return self.approximate_count
+        return super(ApproximateCountPaginator, self).count
 
 
 class PagedFilteredTableView(SingleTableView):
     filter_class = None
     context_filter_name = 'filter'
     page_title = None
+    # Cache the rendered table. The template must use the render_cached_table
+    # tag from table_cache rather than render_table.
+    cache_table = False
+    # Apply distinct() to the filtered rows. This is only needed if a filter
+    # can join to more than one related row.
+    distinct = True
+    # Page through the table by seeking past the rows ordered by these
+    # fields, which must uniquely identify a row. This is only done when the
+    # table hasn't been sorted by a column.
+    keyset_fields = None
+    # Use get_approximate_count() rather than counting the rows.
+    approximate_count = False
+    # The fields that can be exported, which defaults to all of the model's
+    # fields, with foreign keys as ids
+    export_fields = None
+    # The maximum number of queries for a page, which is checked by the
+    # tests and by QueryTimingMiddleware
+    query_budget = None
 
-    def get_queryset(self, **kwargs):
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('export'):
+            return self.export()
+        return super(PagedFilteredTableView, self).get(request, *args,
+                                                       **kwargs)
+
+    def get_filtered_queryset(self):
+        """
+        The rows that match the filters in the request.
+        """
         qs = super(PagedFilteredTableView, self).get_queryset()
         self.filter = self.filter_class(self.request.GET, queryset=qs)
-        return self.filter.qs.distinct()
+        qs = self.filter.qs
+        if self.distinct:
+            qs = qs.distinct()
+        return qs
+
+    def get_queryset(self, **kwargs):
+        return self.seek(self.get_filtered_queryset())
+
+    def get_export_fields(self):
+        """
+        The fields that can be exported.
+        """
+        if self.export_fields is not None:
+            return list(self.export_fields)
+        return [field.attname for field in self.model._meta.concrete_fields]
+
+    def export(self):
+        """
+        Stream the filtered rows in the format in the request.
+        """
+        export_format = self.request.GET['export']
+        if export_format not in EXPORT_FORMATS:
+            return HttpResponseBadRequest(
+                'Unknown export format {}'.format(export_format)
+            )
+        fields = self.get_export_fields()
+        columns = self.request.GET.get('columns')
+        if columns:
+            columns = [column.strip() for column in columns.split(',')
+                       if column.strip()]
+            unknown = [column for column in columns if column not in fields]
+            if unknown:
+                return HttpResponseBadRequest(
+                    'Unknown columns: {}'.format(', '.join(unknown))
+                )
+            fields = columns
+
+        content = export_lines(self.get_filtered_queryset(), fields,
+                               export_format)
+        filename = '{}.{}'.format(self.model._meta.model_name, export_format)
+        content_type = EXPORT_FORMATS[export_format]
+        if self.request.GET.get('gzip') in ('1', 'true', 'yes'):
+            content = gzip_stream(content)
+            filename += '.gz'
+            content_type = 'application/gzip'
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+            filename
+        )
+        return response
+
+    def uses_keyset(self):
+        """
+        True if the table is paged through by keyset.
+        """
+        order_by_field = self.get_table_class()._meta.order_by_field
+        return (self.keyset_fields is not None and
+                not self.request.GET.get(order_by_field))
+
+    def seek(self, qs):
+        """
+        Order the rows by the keyset and filter them to those after, or
+        before, the cursor in the request.
+        """
+        self.keyset_reverse = False
+        self.keyset_has_cursor = False
+        if not self.uses_keyset():
+            return qs
+        fields = list(self.keyset_fields)
+        after = decode_cursor(self.request.GET.get('after'), len(fields))
+        before = decode_cursor(self.request.GET.get('before'), len(fields))
+        if before is not None:
+            self.keyset_reverse = True
+            self.keyset_has_cursor = True
+            return (qs.filter(keyset_filter(fields, before, reverse=True)).
+                    order_by(*['-' + field for field in fields]))
+        if after is not None:
+            self.keyset_has_cursor = True
+            qs = qs.filter(keyset_filter(fields, after))
+        return qs.order_by(*fields)
+
+    def get_active_filters(self):
+        """
+        The names of the filters that have a value in the request.
+        """
+        return {name for name in self.filter.filters
+                if self.request.GET.get(name)}
+
+    def get_approximate_count(self):
+        """
+        An approximate count of the rows, which for an unfiltered table is
+        the query planner's estimate of the table's size.
+
+        :returns: the approximate count or None if it isn't known
+        :rtype: int
+        """
+        if self.get_active_filters():
+            return None
+        return estimate_row_count(self.model)
+
+    def get_table_pagination(self, table):
+        paginate = super(PagedFilteredTableView,
+                         self).get_table_pagination(table)
+        if not paginate or not (self.keyset_fields or
+                                self.approximate_count):
+            return paginate
+        paginate = dict(paginate) if hasattr(paginate, 'items') else {}
+        approximate_count = (self.get_approximate_count()
+                             if self.approximate_count else None)
+        if self.uses_keyset():
+            paginate.update({
+                'paginator_class': KeysetPaginator,
+                'keyset_fields': self.keyset_fields,
+                'reverse': self.keyset_reverse,
+                'has_cursor': self.keyset_has_cursor,
+                'approximate_count': approximate_count
+            })
+        elif approximate_count is not None:
+            paginate.update({
+                'paginator_class': ApproximateCountPaginator,
+                'approximate_count': approximate_count
+            })
+        return paginate
+
+    def get_table_cache_key(self):
+        """
+        The cache key of the table, which depends on the view, the
+        parameters that aren't blank and the user, as some tables show
+        different things to different users.
+        """
+        params = sorted((name, sorted(value for value in values if value))
+                        for name, values in self.request.GET.lists()
+                        if any(values))
+        user = self.request.user
+        components = [
+            type(self).__module__,
+            type(self).__name__,
+            params,
+            user.get_username() if user.is_authenticated else '',
+            get_table_cache_version()
+        ]
+        digest = hashlib.sha1(
+            json.dumps(components).encode('utf-8')
+        ).hexdigest()
+        return 'table_views:table:{}'.format(digest)
 
     def get_context_data(self, **kwargs):
-        context = super(PagedFilteredTableView, self).get_context_data()
+        cached_table = None
+        if self.cache_table:
+            table_cache_key = self.get_table_cache_key()
+            cached_table = get_cached_table(table_cache_key)
+
+        if cached_table is None:
+            context = super(PagedFilteredTableView, self).get_context_data()
+            if self.cache_table:
+                context['table_cache_key'] = table_cache_key
+        else:
+            # skip creating the table, which counts and loads the rows
+            context = super(SingleTableMixin, self).get_context_data()
+            context['cached_table'] = cached_table
         context[self.context_filter_name] = self.filter
         context['page_title'] = self.page_title
         return context
@@ -30,15 +506,25 @@ class DataRequestsFilteredView(PagedFilteredTableView):
     message = None
     get_outstanding_data = False
     get_received_data = False
+    cache_table = True
 
-    def get_queryset(self, **kwargs):
+    def get_filtered_queryset(self):
         qs = super(PagedFilteredTableView, self).get_queryset()
         if self.get_outstanding_data:
             qs = qs.filter(datafile__isnull=True)
         if self.get_received_data:
-            qs = qs.filter(datafile__isnull=False)
+            # only data requests with files have a summary
+            qs = qs.filter(received_summary__isnull=False)
         self.filter = self.filter_class(self.request.GET, queryset=qs)
-        return self.filter.qs.distinct()
+        qs = self.filter.qs
+        if self.distinct:
+            qs = qs.distinct()
+        return qs
+
+    def get_queryset(self, **kwargs):
+        qs = super(DataRequestsFilteredView, self).get_queryset()
+        return qs.select_related('project', 'institute', 'climate_model',
+                                 'experiment', 'variable_request')
 
     def get_context_data(self, **kwargs):
         context = super(DataRequestsFilteredView, self).get_context_data()
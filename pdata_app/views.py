@@ -7,18 +7,17 @@ try:
 except ImportError:
     from urllib import urlencode  # Python 2.7
 
-import cf_units
-
 from django.contrib.auth import (authenticate, login, logout,
                                  update_session_auth_hash)
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import PasswordResetForm
 from django.contrib.auth.models import User
 from django.urls import reverse
-from django.db.models import Max, Min, Sum, Case, When
+from django.db.models import Count, Prefetch, Q, Sum, Case, When
 from django.http import HttpResponseRedirect
 from django.shortcuts import render, redirect
 
+from .middleware import query_budget
 from .models import (DataFile, DataSubmission, ESGFDataset, CEDADataset,
                      DataRequest, DataIssue, VariableRequest, RetrievalRequest,
                      EmailQueue, Settings, ReplacedFile, ObservationDataset,
@@ -35,8 +34,9 @@ from .filters import (DataRequestFilter, DataFileFilter, DataSubmissionFilter,
                       VariableRequestQueryFilter, RetrievalRequestFilter,
                       ReplacedFileFilter, ObservationDatasetFilter,
                       ObservationFileFilter)
-from .utils.common import get_request_size
-from .utils.table_views import PagedFilteredTableView, DataRequestsFilteredView
+from .utils.retrieval_preview import preview_retrieval
+from .utils.table_views import (PagedFilteredTableView,
+                                DataRequestsFilteredView, estimate_row_count)
 from vocabs.vocabs import STATUS_VALUES
 
 
@@ -45,6 +45,7 @@ class DataRequestList(DataRequestsFilteredView):
     table_class = DataRequestTable
     filter_class = DataRequestFilter
     page_title = 'Data Requests'
+    query_budget = 5
     message = ('These are the data requests that institutes said that '
                'they would provide on the original data request spreadsheet. '
                'Additional variables are sometimes received and are added '
@@ -59,6 +60,7 @@ class OutstandingDataRequestList(DataRequestsFilteredView):
     table_class = DataRequestTable
     filter_class = DataRequestFilter
     page_title = 'Outstanding Data Requests'
+    query_budget = 5
     get_outstanding_data = True
     message = ('No files have been received for the data requests below. '
                'Please note that this is only a list of the data requests '
@@ -72,8 +74,15 @@ class ReceivedDataRequestList(DataRequestsFilteredView):
     table_class = DataReceivedTable
     filter_class = DataRequestFilter
     page_title = 'Variables Received'
+    query_budget = 5
     get_received_data = True
     message = 'The following data has been received:'
+    # each data request has at most one summary
+    distinct = False
+
+    def get_queryset(self, **kwargs):
+        qs = super(ReceivedDataRequestList, self).get_queryset()
+        return qs.select_related('received_summary')
 
 
 class VariableRequestList(PagedFilteredTableView):
@@ -81,6 +90,7 @@ class VariableRequestList(PagedFilteredTableView):
     table_class = VariableRequestQueryTable
     filter_class = VariableRequestQueryFilter
     page_title = 'Variable Request'
+    query_budget = 4
 
 
 class DataFileList(PagedFilteredTableView):
@@ -88,6 +98,56 @@ class DataFileList(PagedFilteredTableView):
     table_class = DataFileTable
     filter_class = DataFileFilter
     page_title = 'Data Files'
+    query_budget = 6
+    cache_table = True
+    # each filter matches at most one row of any related table and so each
+    # file is only ever found once
+    distinct = False
+    keyset_fields = ('name', 'id')
+    approximate_count = True
+    export_fields = ('name', 'directory', 'version', 'online', 'tape_url',
+                     'project__short_name', 'institute__short_name',
+                     'climate_model__short_name', 'experiment__short_name',
+                     'variable_request__table_name',
+                     'variable_request__cmor_name', 'frequency', 'rip_code',
+                     'grid', 'start_time', 'end_time', 'time_units',
+                     'calendar', 'size', 'data_request', 'data_submission')
+
+    def get_queryset(self, **kwargs):
+        qs = super(DataFileList, self).get_queryset()
+        return (qs.select_related('institute', 'climate_model', 'experiment',
+                                  'variable_request').
+                prefetch_related('checksum_set').
+                with_num_data_issues())
+
+    def get_approximate_count(self):
+        """
+        The number of files from the cached aggregates when the files are
+        only filtered by data request or data submission, or from the query
+        planner's estimate, or the cached aggregates of all of the data
+        requests, when they're not filtered.
+        """
+        active_filters = self.get_active_filters()
+        for name, model in (('data_request', DataRequest),
+                            ('data_submission', DataSubmission)):
+            if active_filters == {name}:
+                if not self.filter.form.is_valid():
+                    return None
+                return (model.objects.
+                        filter(id=self.filter.form.cleaned_data[name]).
+                        values_list('cached_num_files', flat=True).first())
+        if active_filters:
+            return None
+        estimate = estimate_row_count(DataFile)
+        if estimate is not None:
+            return estimate
+        counts = DataRequest.objects.aggregate(
+            num_files=Sum('cached_num_files'),
+            num_uncached=Count('pk', filter=Q(cached_num_files__isnull=True))
+        )
+        if counts['num_uncached']:
+            return None
+        return counts['num_files'] or 0
 
 
 class ReplacedFileList(PagedFilteredTableView):
@@ -95,6 +155,7 @@ class ReplacedFileList(PagedFilteredTableView):
     table_class = ReplacedFileTable
     filter_class = ReplacedFileFilter
     page_title = 'Replaced Files'
+    query_budget = 3
 
 
 class DataSubmissionList(PagedFilteredTableView):
@@ -102,6 +163,13 @@ class DataSubmissionList(PagedFilteredTableView):
     table_class = DataSubmissionTable
     filter_class = DataSubmissionFilter
     page_title = 'Data Submissions'
+    # including the three queries that calculate the aggregations of any
+    # submissions on the page that haven't been cached yet
+    query_budget = 10
+
+    def get_queryset(self, **kwargs):
+        qs = super(DataSubmissionList, self).get_queryset()
+        return qs.select_related('user').with_online_status()
 
 
 class ESGFDatasetList(PagedFilteredTableView):
@@ -109,6 +177,14 @@ class ESGFDatasetList(PagedFilteredTableView):
     table_class = ESGFDatasetTable
     filter_class = ESGFDatasetFilter
     page_title = 'ESGF Datasets'
+    query_budget = 4
+
+    def get_queryset(self, **kwargs):
+        qs = super(ESGFDatasetList, self).get_queryset()
+        return qs.select_related('ceda_dataset', 'data_request__institute',
+                                 'data_request__climate_model',
+                                 'data_request__experiment',
+                                 'data_request__variable_request')
 
 
 class CEDADatasetList(PagedFilteredTableView):
@@ -116,6 +192,7 @@ class CEDADatasetList(PagedFilteredTableView):
     table_class = CEDADatasetTable
     filter_class = CEDADatasetFilter
     page_title = 'CEDA Datasets'
+    query_budget = 3
 
 
 class DataIssueList(PagedFilteredTableView):
@@ -123,6 +200,11 @@ class DataIssueList(PagedFilteredTableView):
     table_class = DataIssueTable
     filter_class = DataIssueFilter
     page_title = 'Data Issues'
+    query_budget = 4
+
+    def get_queryset(self, **kwargs):
+        qs = super(DataIssueList, self).get_queryset()
+        return qs.select_related('reporter').with_num_data_files()
 
 
 class RetrievalRequestList(PagedFilteredTableView):
@@ -130,6 +212,14 @@ class RetrievalRequestList(PagedFilteredTableView):
     table_class = RetrievalRequestTable
     filter_class = RetrievalRequestFilter
     page_title = 'Retrieval Requests'
+    query_budget = 9
+    cache_table = True
+
+    def get_queryset(self, **kwargs):
+        qs = super(RetrievalRequestList, self).get_queryset()
+        return qs.select_related('requester').prefetch_related(
+            Prefetch('data_request', queryset=DataRequest.objects.for_drs())
+        )
 
 
 class ObservationDatasetList(PagedFilteredTableView):
@@ -137,6 +227,7 @@ class ObservationDatasetList(PagedFilteredTableView):
     table_class = ObservationDatasetTable
     filter_class = ObservationDatasetFilter
     page_title = 'Observation and Reanalysis Sets'
+    query_budget = 3
 
 
 class ObservationFileList(PagedFilteredTableView):
@@ -144,8 +235,9 @@ class ObservationFileList(PagedFilteredTableView):
     table_class = ObservationFileTable
     filter_class = ObservationFileFilter
     page_title = 'Observation Files'
+    query_budget = 3
 
-    def get_queryset(self, **kwargs):
+    def get_filtered_queryset(self):
         qs = super(PagedFilteredTableView, self).get_queryset()
         qs = qs.annotate(
             variable_name=Case(
@@ -289,7 +381,7 @@ def create_submission(request):
             submission.save()
 
             # advise the admin of the new submission
-            contact_user_id = Settings.get_solo().contact_user_id
+            contact_user_id = Settings.get_cached().contact_user_id
             contact_user = User.objects.get(username=contact_user_id)
             subject = 'PRIMAVERA Submission created'
             message = 'PRIMAVERA Submission {} created'.format(
@@ -306,6 +398,7 @@ def create_submission(request):
 
 
 @login_required(login_url='/login/')
+@query_budget(5)
 def retrieval_years(request):
     if request.method == 'POST':
         data_req_ids = []
@@ -315,53 +408,9 @@ def retrieval_years(request):
             components = re.match(r'^request_data_req_(\d+)$', key)
             if components:
                 data_req_ids.append(int(components.group(1)))
+        preview = preview_retrieval(data_req_ids)
         # get a string representation of each id
-        data_req_strs = [str(DataRequest.objects.filter(id=req).first())
-                         for req in data_req_ids]
-
-        start_year_objects = [
-            (DataRequest.objects.get(id=req).datafile_set.aggregate(
-                Min('start_time'))['start_time__min'],
-              DataRequest.objects.get(id=req).datafile_set.first().time_units,
-              DataRequest.objects.get(id=req).datafile_set.first().calendar)
-             for req in data_req_ids
-        ]
-        start_year_objects_no_nones = [
-            (start_time, time_units, calendar)
-            for start_time, time_units, calendar in start_year_objects
-            if start_time is not None
-        ]
-
-        if start_year_objects_no_nones:
-            earliest_year_float, time_units, calendar = min(
-                start_year_objects_no_nones, key=lambda x: x[0]
-            )
-            earliest_year = cf_units.num2date(earliest_year_float, time_units,
-                                              calendar).strftime('%Y')
-        else:
-            earliest_year = None
-
-        end_year_objects = [
-            (DataRequest.objects.get(id=req).datafile_set.aggregate(
-                Max('end_time'))['end_time__max'],
-              DataRequest.objects.get(id=req).datafile_set.first().time_units,
-              DataRequest.objects.get(id=req).datafile_set.first().calendar)
-             for req in data_req_ids
-        ]
-        end_year_objects_no_nones = [
-            (end_time, time_units, calendar)
-            for end_time, time_units, calendar in end_year_objects
-            if end_time is not None
-        ]
-
-        if end_year_objects_no_nones:
-            latest_year_float, time_units, calendar = max(
-                end_year_objects_no_nones, key=lambda x: x[0]
-            )
-            end_year = cf_units.num2date(latest_year_float, time_units,
-                                              calendar).strftime('%Y')
-        else:
-            end_year = None
+        data_req_strs = [str(data_req) for data_req in preview.data_requests]
 
         # generate the confirmation page
         return render(request, 'pdata_app/retrieval_request_choose_years.html',
@@ -369,8 +418,9 @@ def retrieval_years(request):
                        'page_title': 'Choose Retrieval Years',
                        'return_url': request.POST['variables_received_url'],
                        'data_request_ids': ','.join(map(str, data_req_ids)),
-                       'earliest_year': earliest_year,
-                       'end_year': end_year})
+                       'earliest_year': preview.earliest_year,
+                       'end_year': preview.latest_year,
+                       'preview': preview})
     else:
         return render(request, 'pdata_app/retrieval_request_error.html',
                       {'request': request,
@@ -378,19 +428,18 @@ def retrieval_years(request):
 
 
 @login_required(login_url='/login/')
+@query_budget(5)
 def confirm_retrieval(request):
     if request.method == 'POST':
         data_req_str = request.POST['data_request_ids']
         data_req_ids = data_req_str.split(',')
-        data_req_strs = [str(DataRequest.objects.filter(id=req).first())
-                         for req in data_req_ids]
 
         start_year = int(request.POST['start_year'])
         end_year = int(request.POST['end_year'])
 
         # get the total retrieval size
-        data_reqs = DataRequest.objects.filter(id__in=data_req_ids)
-        request_size = get_request_size(data_reqs, start_year, end_year)
+        preview = preview_retrieval(data_req_ids, start_year, end_year)
+        data_req_strs = [str(data_req) for data_req in preview.data_requests]
 
         # generate the confirmation page
         return render(request, 'pdata_app/retrieval_request_confirm.html',
@@ -399,7 +448,8 @@ def confirm_retrieval(request):
                        'return_url': request.POST['return_url'],
                        'start_year': start_year, 'end_year': end_year,
                        'data_request_ids': data_req_str,
-                       'request_size': request_size})
+                       'request_size': preview.total_size,
+                       'preview': preview})
     else:
         return render(request, 'pdata_app/retrieval_request_error.html',
                       {'request': request,
@@ -435,7 +485,7 @@ def create_retrieval(request):
         retrieval.refresh_from_db()
 
         # advise the admin of the new request
-        contact_user_id = Settings.get_solo().contact_user_id
+        contact_user_id = Settings.get_cached().contact_user_id
         contact_user = User.objects.get(username=contact_user_id)
         message = 'PRIMAVERA Retrieval Request {} created'.format(retrieval.id)
         _em = EmailQueue.objects.create(recipient=contact_user,
@@ -467,10 +517,8 @@ def confirm_mark_finished(request):
             summary['id'] = req
             ret_req = RetrievalRequest.objects.get(id=req)
             summary['data_reqs'] = [str(data_req) for data_req in
-                                    ret_req.data_request.all()]
-            summary['size'] = get_request_size(ret_req.data_request.all(),
-                                               ret_req.start_year,
-                                               ret_req.end_year, online=True)
+                                    ret_req.data_request.for_drs()]
+            summary['size'] = ret_req.retrieval_size(online=True)
             ret_req_summaries.append(summary)
 
         # generate the confirmation page
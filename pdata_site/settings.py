@@ -34,6 +34,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE = (
+    'pdata_app.middleware.QueryTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -89,3 +90,10 @@ STATICFILES_FINDERS = (
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "pdata_site", "static_src"),
 ]
+
+# The maximum time in seconds that a process uses its cached copy of the app's
+# Settings before checking the database for changes
+SETTINGS_CACHE_TIMEOUT = 60
+
+# The maximum time in seconds that a rendered table is cached for
+TABLE_CACHE_TIMEOUT = 600
@@ -2,6 +2,7 @@ from django.conf.urls import url
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 
 from pdata_app.forms import SetPasswordBootstrapForm
+import pdata_app.api
 import pdata_app.views
 from django.contrib.auth.views import (PasswordResetConfirmView,
                                        PasswordResetCompleteView)
@@ -108,6 +109,22 @@ urlpatterns = [
     url(r'^observation_files/$',
         pdata_app.views.ObservationFileList.as_view(), name='obs_files'),
 
+    url(r'^api/data_requests/$', pdata_app.api.DataRequestApi.as_view(),
+        name='api_data_requests'),
+
+    url(r'^api/data_files/$', pdata_app.api.DataFileApi.as_view(),
+        name='api_data_files'),
+
+    url(r'^api/esgf_datasets/$', pdata_app.api.ESGFDatasetApi.as_view(),
+        name='api_esgf_datasets'),
+
+    url(r'^api/retrieval_requests/$',
+        pdata_app.api.RetrievalRequestApi.as_view(),
+        name='api_retrieval_requests'),
+
+    url(r'^api/observation_sets/$',
+        pdata_app.api.ObservationDatasetApi.as_view(), name='api_obs_sets'),
+
     url(r'.*', pdata_app.views.view_home, name='home'),
 ]
 
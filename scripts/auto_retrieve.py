@@ -21,7 +21,7 @@ django.setup()
 
 from django.template.defaultfilters import filesizeformat
 from pdata_app.models import RetrievalRequest, Settings
-from pdata_app.utils.common import get_request_size, PAUSE_FILES
+from pdata_app.utils.common import PAUSE_FILES
 
 __version__ = '0.1.0b1'
 
@@ -36,9 +36,6 @@ TWO_TEBIBYTES = 2 * 2 ** 40
 # The institution_ids that should be retrieved from MASS
 MASS_INSTITUTIONS = ['MOHC', 'NERC']
 
-# The top-level directory to write output data to
-STREAM1_DIR = Settings.get_solo().current_stream1_dir
-
 
 def run_retrieve_request(retrieval_id):
     """
@@ -49,20 +46,21 @@ def run_retrieve_request(retrieval_id):
     """
     retrieval_request = RetrievalRequest.objects.get(id=retrieval_id)
 
-    if get_request_size(retrieval_request.data_request.all(),
-                        retrieval_request.start_year,
-                        retrieval_request.end_year) > TWO_TEBIBYTES:
+    if retrieval_request.retrieval_size() > TWO_TEBIBYTES:
         logger.warning('Skipping retrieval {} as it is bigger than {}.'.format(
             retrieval_id, filesizeformat(TWO_TEBIBYTES).encode('utf-8')
         ))
         return
 
+    # the top-level directory to write output data to
+    stream1_dir = Settings.get_cached().current_stream1_dir
+
     cmd = ('{} {} -l debug -a {} {}'.format(sys.executable,
                                             os.path.abspath(
                                                 os.path.join(
                                                     os.path.dirname(__file__),
                                                     'retrieve_request.py')),
-                                            STREAM1_DIR,
+                                            stream1_dir,
                                             retrieval_id))
     try:
         subprocess.check_output(cmd, shell=True).decode('utf-8')
@@ -107,6 +105,8 @@ def main(args):
         ret_reqs = (RetrievalRequest.objects.filter(date_complete__isnull=True,
                                                     date_deleted__isnull=True).
                     order_by('date_created'))
+        # calculate the sizes of any new retrievals together
+        RetrievalRequest.cache_sizes(ret_reqs.filter(cached_size__isnull=True))
 
         for ret_req in ret_reqs:
             # check for retrievals that are purely elastic tape or pure MASS
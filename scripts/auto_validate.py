@@ -39,7 +39,6 @@ logger = logging.getLogger(__name__)
 
 
 STATUS_TO_PROCESS = STATUS_VALUES['PENDING_PROCESSING']
-ADMIN_USER = Settings.get_solo().contact_user_id
 PARALLEL_SCRIPT = ('/home/users/jseddon/primavera/LIVE-prima-dm/scripts/'
                    'run_primavera')
 VALIDATE_SCRIPT = 'validate_data_submission.py'
@@ -104,7 +103,7 @@ def are_files_chowned(submission):
             uid = os.stat(file_name)[stat.ST_UID]
             user_name = pwd.getpwuid(uid)[0]
 
-            if user_name != ADMIN_USER:
+            if user_name != Settings.get_cached().contact_user_id:
                 return False
 
     return True
@@ -199,7 +198,7 @@ def main():
             if not are_files_chowned(submission):
                 logger.debug('Skipping {} as all files not owned by {}.'.
                              format(submission.incoming_directory,
-                                    ADMIN_USER))
+                                    Settings.get_cached().contact_user_id))
             else:
                 logger.debug('Processing {}'.format(submission))
                 submission.status = STATUS_VALUES['ARRIVED']
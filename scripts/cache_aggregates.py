@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+cache_aggregates.py
+
+Rebuild the cached aggregations of the DataFiles in each DataRequest and
+DataSubmission, the summaries of the received DataRequests, the stored DRS ids
+of each ESGFDataset and the sizes of each RetrievalRequest. These are normally kept up to date as files are saved, but
+this should be run after the initial migration, after bulk updates that bypass
+the models' save() methods, if the standard time units are changed or if the
+names used in DRS ids are changed. The tables cached by the web pages are also
+invalidated.
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+import argparse
+import logging.config
+import sys
+
+import django
+django.setup()
+
+from pdata_app.models import (DataRequest, DataSubmission, ESGFDataset,
+                              ReceivedDataSummary, RetrievalRequest)
+from pdata_app.utils.table_views import bump_table_cache_version
+
+__version__ = '0.1.0b1'
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+DEFAULT_LOG_FORMAT = '%(levelname)s: %(message)s'
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """
+    Parse command-line arguments
+    """
+    parser = argparse.ArgumentParser(description='Rebuild the cached '
+                                                 'aggregations of data '
+                                                 'requests and submissions '
+                                                 'the DRS ids of ESGF '
+                                                 'datasets and the sizes of '
+                                                 'retrieval requests')
+    parser.add_argument('-u', '--uncached-only', help='only calculate the '
+                                                      'records that have not '
+                                                      'been cached before',
+                        action='store_true')
+    parser.add_argument('-c', '--chunk-size', help='the number of records to '
+                                                   'calculate in each batch '
+                                                   '(default: %(default)s)',
+                        type=int, default=1000)
+    parser.add_argument('-l', '--log-level',
+                        help='set logging level to one of debug, info, warn '
+                             '(the default), or error')
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s {}'.format(__version__))
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main(args):
+    """
+    Main entry point
+    """
+    for model in (DataRequest, DataSubmission):
+        records = model.objects.order_by('pk')
+        if args.uncached_only:
+            records = records.filter(cached_num_files__isnull=True)
+        record_ids = list(records.values_list('pk', flat=True))
+        logger.debug('Caching {} {} records'.format(len(record_ids),
+                                                    model.__name__))
+        for index in range(0, len(record_ids), args.chunk_size):
+            chunk = record_ids[index:index + args.chunk_size]
+            model.cache_aggregates(model.objects.filter(pk__in=chunk))
+            logger.debug('Cached {} of {}'.format(index + len(chunk),
+                                                  len(record_ids)))
+
+    if args.uncached_only:
+        summary_ids = list(
+            ReceivedDataSummary.objects.filter(stale=True).
+            values_list('data_request_id', flat=True)
+        )
+    else:
+        summary_ids = list(DataRequest.objects.values_list('pk', flat=True))
+    logger.debug('Summarising {} received DataRequests'.format(
+        len(summary_ids)))
+    ReceivedDataSummary.refresh(summary_ids)
+
+    datasets = ESGFDataset.objects.order_by('pk')
+    if args.uncached_only:
+        datasets = datasets.filter(cached_drs_id__isnull=True)
+    dataset_ids = list(datasets.values_list('pk', flat=True))
+    logger.debug('Caching {} ESGFDataset DRS ids'.format(len(dataset_ids)))
+    for index in range(0, len(dataset_ids), args.chunk_size):
+        chunk = dataset_ids[index:index + args.chunk_size]
+        ESGFDataset.cache_drs_ids(ESGFDataset.objects.filter(pk__in=chunk))
+
+    retrievals = RetrievalRequest.objects.order_by('pk')
+    if args.uncached_only:
+        retrievals = retrievals.filter(cached_size__isnull=True)
+    retrieval_ids = list(retrievals.values_list('pk', flat=True))
+    logger.debug('Caching {} RetrievalRequest sizes'.format(
+        len(retrieval_ids)))
+    for index in range(0, len(retrieval_ids), args.chunk_size):
+        chunk = retrieval_ids[index:index + args.chunk_size]
+        RetrievalRequest.cache_sizes(
+            RetrievalRequest.objects.filter(pk__in=chunk))
+
+    # the cached tables of the web pages may contain the old values
+    bump_table_cache_version()
+
+
+if __name__ == "__main__":
+    cmd_args = parse_args()
+
+    # determine the log level
+    if cmd_args.log_level:
+        try:
+            log_level = getattr(logging, cmd_args.log_level.upper())
+        except AttributeError:
+            logger.setLevel(logging.WARNING)
+            logger.error('log-level must be one of: debug, info, warn '
+                         'or error')
+            sys.exit(1)
+    else:
+        log_level = DEFAULT_LOG_LEVEL
+
+    # configure the logger
+    logging.config.dictConfig({
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'standard': {
+                'format': DEFAULT_LOG_FORMAT,
+            },
+        },
+        'handlers': {
+            'default': {
+                'level': log_level,
+                'class': 'logging.StreamHandler',
+                'formatter': 'standard'
+            },
+        },
+        'loggers': {
+            '': {
+                'handlers': ['default'],
+                'level': log_level,
+                'propagate': True
+            }
+        }
+    })
+
+    # run the code
+    main(cmd_args)
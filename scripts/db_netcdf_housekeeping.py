@@ -19,7 +19,8 @@ import sys
 import django
 django.setup()
 
-from pdata_app.models import DataFile, Settings  # nopep8
+from pdata_app.models import (DataFile, Settings,
+                              deferred_file_updates)  # nopep8
 from pdata_app.utils.common import (ilist_files, construct_drs_path,
                                     is_same_gws)  # nopep8
 
@@ -41,7 +42,8 @@ def scan_database():
     """
     logger.debug('Starting database scan.')
 
-    for data_file in DataFile.objects.filter(online=True).iterator():
+    for data_file in (DataFile.objects.filter(online=True).for_drs().
+                      iterator()):
         full_path = os.path.join(data_file.directory, data_file.name)
         if not os.path.exists(full_path):
             logger.warning('File cannot be found on disk, status changed to '
@@ -222,4 +224,6 @@ if __name__ == '__main__':
     })
 
     # run the code
-    main(cmd_args)
+    # update the files' parents' cached values once at the end of the scan
+    with deferred_file_updates():
+        main(cmd_args)
@@ -17,7 +17,8 @@ import django
 django.setup()
 from django.utils import timezone
 
-from pdata_app.models import RetrievalRequest, Settings
+from pdata_app.models import (ReceivedDataSummary, RetrievalRequest, Settings,
+                              deferred_file_updates)
 from pdata_app.utils.common import (delete_drs_dir, construct_drs_path,
                                     date_filter_files)
 from pdata_app.utils.dbapi import match_one
@@ -132,41 +133,43 @@ def main(args):
         else:
             logger.debug('{} {} files will be deleted.'.format(data_req,
                 files_to_delete.distinct().count()))
-            for data_file in files_to_delete:
-                old_file_dir = data_file.directory
-                try:
-                    os.remove(os.path.join(data_file.directory,
-                                           data_file.name))
-                except OSError as exc:
-                    logger.error(str(exc))
-                    problems_encountered = True
-                else:
-                    if data_file.directory not in directories_found:
-                        directories_found.append(data_file.directory)
-                    data_file.online = False
-                    data_file.directory = None
-                    data_file.save()
-
-                # if a symbolic link exists from the base output directory
-                # then delete this too
-                if not old_file_dir.startswith(base_output_dir):
-                    sym_link_dir = os.path.join(base_output_dir,
-                                                construct_drs_path(data_file))
-                    sym_link = os.path.join(sym_link_dir, data_file.name)
-                    if not os.path.islink(sym_link):
-                        logger.error("Expected {} to be a link but it isn't. "
-                                     "Leaving this file in place.".
-                                     format(sym_link))
+            with deferred_file_updates():
+                for data_file in files_to_delete:
+                    old_file_dir = data_file.directory
+                    try:
+                        os.remove(os.path.join(data_file.directory,
+                                               data_file.name))
+                    except OSError as exc:
+                        logger.error(str(exc))
                         problems_encountered = True
                     else:
-                        try:
-                            os.remove(sym_link)
-                        except OSError as exc:
-                            logger.error(str(exc))
+                        if data_file.directory not in directories_found:
+                            directories_found.append(data_file.directory)
+                        data_file.online = False
+                        data_file.directory = None
+                        data_file.save()
+
+                    # if a symbolic link exists from the base output directory
+                    # then delete this too
+                    if not old_file_dir.startswith(base_output_dir):
+                        sym_link_dir = os.path.join(
+                            base_output_dir, construct_drs_path(data_file)
+                        )
+                        sym_link = os.path.join(sym_link_dir, data_file.name)
+                        if not os.path.islink(sym_link):
+                            logger.error("Expected {} to be a link but it "
+                                         "isn't. Leaving this file in place.".
+                                         format(sym_link))
                             problems_encountered = True
                         else:
-                            if sym_link_dir not in directories_found:
-                                directories_found.append(sym_link_dir)
+                            try:
+                                os.remove(sym_link)
+                            except OSError as exc:
+                                logger.error(str(exc))
+                                problems_encountered = True
+                            else:
+                                if sym_link_dir not in directories_found:
+                                    directories_found.append(sym_link_dir)
 
     if not args.dryrun:
         # delete any empty directories
@@ -174,10 +177,15 @@ def main(args):
             if not os.listdir(directory):
                 delete_drs_dir(directory)
 
+        # summarise the data requests whose files have been deleted
+        ReceivedDataSummary.refresh()
+
         # set date_deleted in the db
         if not problems_encountered:
             deletion_retrieval.date_deleted = timezone.now()
-            deletion_retrieval.save()
+            # the sizes loaded with the retrieval are out of date now that
+            # its files have been deleted
+            deletion_retrieval.save(update_fields=['date_deleted'])
         else:
             logger.error('Errors were encountered and so retrieval {} has not '
                          'been marked as deleted. All possible files have been '
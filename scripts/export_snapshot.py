@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+export_snapshot.py
+
+Create or refresh the columnar snapshot of the DataFile table that is used by
+the reporting scripts. The snapshot is refreshed incrementally and so this
+can be run regularly, e.g. from cron.
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+import argparse
+import logging.config
+import sys
+
+import django
+django.setup()
+
+from pdata_app.utils.snapshot import export_snapshot
+
+__version__ = '0.1.0b1'
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+DEFAULT_LOG_FORMAT = '%(levelname)s: %(message)s'
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    """
+    Parse command-line arguments
+    """
+    parser = argparse.ArgumentParser(description='Create or refresh the '
+                                                 'snapshot of the DataFile '
+                                                 'table')
+    parser.add_argument('directory', help='the directory to save the '
+                                          'snapshot in')
+    parser.add_argument('-f', '--full', help='recreate the whole snapshot '
+                                             'rather than refreshing it',
+                        action='store_true')
+    parser.add_argument('-l', '--log-level',
+                        help='set logging level to one of debug, info, warn '
+                             '(the default), or error')
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s {}'.format(__version__))
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main(args):
+    """
+    Main entry point
+    """
+    num_files = export_snapshot(args.directory, full=args.full)
+    logger.debug('Snapshot of {} files saved in {}'.format(num_files,
+                                                           args.directory))
+
+
+if __name__ == "__main__":
+    cmd_args = parse_args()
+
+    # determine the log level
+    if cmd_args.log_level:
+        try:
+            log_level = getattr(logging, cmd_args.log_level.upper())
+        except AttributeError:
+            logger.setLevel(logging.WARNING)
+            logger.error('log-level must be one of: debug, info, warn '
+                         'or error')
+            sys.exit(1)
+    else:
+        log_level = DEFAULT_LOG_LEVEL
+
+    # configure the logger
+    logging.config.dictConfig({
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'standard': {
+                'format': DEFAULT_LOG_FORMAT,
+            },
+        },
+        'handlers': {
+            'default': {
+                'level': log_level,
+                'class': 'logging.StreamHandler',
+                'formatter': 'standard'
+            },
+        },
+        'loggers': {
+            '': {
+                'handlers': ['default'],
+                'level': log_level,
+                'propagate': True
+            }
+        }
+    })
+
+    # run the code
+    main(cmd_args)
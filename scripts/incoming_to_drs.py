@@ -16,7 +16,8 @@ import sys
 import django
 django.setup()
 
-from pdata_app.models import Settings, DataSubmission
+from pdata_app.models import (Settings, DataSubmission,
+                              deferred_file_updates)
 from pdata_app.utils.common import is_same_gws, construct_drs_path
 
 
@@ -90,7 +91,7 @@ def main(args):
 
     errors_encountered = False
 
-    for data_file in data_sub.datafile_set.order_by('name'):
+    for data_file in data_sub.datafile_set.for_drs().order_by('name'):
         # make full path of existing file
         existing_path = os.path.join(data_file.directory, data_file.name)
 
@@ -187,4 +188,6 @@ if __name__ == "__main__":
     })
 
     # run the code
-    main(cmd_args)
+    # update the submission's cached values once after moving all its files
+    with deferred_file_updates():
+        main(cmd_args)
@@ -33,9 +33,12 @@ django.setup()
 from django.contrib.auth.models import User
 from django.utils import timezone
 
-from pdata_app.models import Settings, RetrievalRequest, EmailQueue, DataFile
-from pdata_app.utils.common import (md5, sha256, adler32, construct_drs_path,
-                                    get_temp_filename, is_same_gws, run_command,
+from pdata_app.models import (Settings, RetrievalRequest, EmailQueue,
+                              DataFile, ReceivedDataSummary,
+                              deferred_file_updates)
+from pdata_app.utils.common import (md5, sha256, adler32, checksum_files,
+                                    construct_drs_path, get_temp_filename,
+                                    is_same_gws, run_command,
                                     date_filter_files, PAUSE_FILES, grouper)
 from pdata_app.utils.dbapi import match_one
 
@@ -47,8 +50,9 @@ DEFAULT_LOG_FORMAT = '%(levelname)s: %(message)s'
 
 logger = logging.getLogger(__name__)
 
-# The top-level directory to write output data to
-BASE_OUTPUT_DIR = Settings.get_solo().base_output_dir
+# The top-level directory to write output data to, overriding the base
+# output directory in the app's Settings if set
+BASE_OUTPUT_DIR = None
 # The number of processes that et_get.py should use.
 # Between 5 and 10 are recommended
 MAX_ET_GET_PROC = 5
@@ -71,6 +75,13 @@ class ChecksumError(Exception):
         self.message = message
 
 
+def _base_output_dir():
+    """
+    Return the top-level directory to write output data to.
+    """
+    return BASE_OUTPUT_DIR or Settings.get_cached().base_output_dir
+
+
 def parallel_get_urls(tapes, args):
     """
     Get several tape URLs in parallel so that MOOSE can group retrievals
@@ -139,7 +150,10 @@ def parallel_worker(params, error_event):
                     return
 
         try:
-            get_tape_url(tape_url, data_files, args)
+            # update the cached values of the files' parents once for each
+            # tape rather than as each file is saved
+            with deferred_file_updates():
+                get_tape_url(tape_url, data_files, args)
         except:
             exc_type, exc_value, exc_tb = sys.exc_info()
             tb_list = traceback.format_exception(exc_type, exc_value, exc_tb)
@@ -188,7 +202,7 @@ def get_moose_url(tape_url, data_files, args):
     # tape_url will be placed in the same output directory
     drs_path = construct_drs_path(data_files[0])
     if not args.alternative:
-        drs_dir = os.path.join(BASE_OUTPUT_DIR, drs_path)
+        drs_dir = os.path.join(_base_output_dir(), drs_path)
     else:
         drs_dir = os.path.join(args.alternative, drs_path)
 
@@ -223,6 +237,15 @@ def get_moose_url(tape_url, data_files, args):
 
     _remove_data_license_files(drs_dir)
 
+    if not args.skip_checksums:
+        # the files have all been restored and so can be checksummed at once
+        file_checksums = checksum_files(
+            [os.path.join(drs_dir, data_file.name if not args.incoming
+                          else data_file.incoming_name)
+             for data_file in data_files],
+            'adler32'
+        )
+
     for data_file in data_files:
         filename = (data_file.name if not args.incoming
                     else data_file.incoming_name)
@@ -230,7 +253,8 @@ def get_moose_url(tape_url, data_files, args):
             try:
                 _check_file_checksum(
                     data_file,
-                    os.path.join(drs_dir, filename)
+                    os.path.join(drs_dir, filename),
+                    file_checksums
                 )
             except ChecksumError:
                 # warning message has already been displayed and so move on
@@ -240,7 +264,7 @@ def get_moose_url(tape_url, data_files, args):
         # create symbolic link from main directory if storing data in an
         # alternative directory
         if args.alternative:
-            primary_path = os.path.join(BASE_OUTPUT_DIR, drs_path)
+            primary_path = os.path.join(_base_output_dir(), drs_path)
             if not os.path.exists(primary_path):
                 os.makedirs(primary_path)
 
@@ -284,7 +308,7 @@ def get_et_url(tape_url, data_files, args):
     if args.alternative:
         base_dir = args.alternative
     else:
-        base_dir = BASE_OUTPUT_DIR
+        base_dir = _base_output_dir()
 
     batch_id = int(tape_url.split(':')[1])
     retrieval_dir = os.path.normpath(
@@ -354,7 +378,7 @@ def copy_et_files_into_drs(data_files, retrieval_dir, args):
 
         drs_path = construct_drs_path(data_file)
         if not args.alternative:
-            drs_dir = os.path.join(BASE_OUTPUT_DIR, drs_path)
+            drs_dir = os.path.join(_base_output_dir(), drs_path)
         else:
             drs_dir = os.path.join(args.alternative, drs_path)
         dest_file_path = os.path.join(drs_dir, filename)
@@ -380,8 +404,8 @@ def copy_et_files_into_drs(data_files, retrieval_dir, args):
         # create symbolic link from main directory if storing data in an
         # alternative directory
         if args.alternative and not is_same_gws(dest_file_path,
-                                                BASE_OUTPUT_DIR):
-            primary_path = os.path.join(BASE_OUTPUT_DIR, drs_path)
+                                                _base_output_dir()):
+            primary_path = os.path.join(_base_output_dir(), drs_path)
             if not os.path.exists(primary_path):
                 os.makedirs(primary_path)
             os.symlink(dest_file_path,
@@ -395,12 +419,14 @@ def copy_et_files_into_drs(data_files, retrieval_dir, args):
     logger.debug('Finished copying elastic tape files')
 
 
-def _check_file_checksum(data_file, file_path):
+def _check_file_checksum(data_file, file_path, adler32_checksums=None):
     """
     Check that a restored file's checksum matches the value in the database.
 
     :param pdata_app.models.DataFile data_file: the database file object
     :param str file_path: the path to the restored file
+    :param dict adler32_checksums: the ADLER32 checksums of restored files
+        that have already been calculated, keyed by path
     :raises ChecksumError: if the checksums don't match.
     """
     checksum_methods = {'ADLER32': adler32,
@@ -419,7 +445,11 @@ def _check_file_checksum(data_file, file_path):
         logger.warning(msg)
         return
 
-    file_checksum = checksum_methods[checksum_obj.checksum_type](file_path)
+    if (checksum_obj.checksum_type == 'ADLER32' and adler32_checksums and
+            file_path in adler32_checksums):
+        file_checksum = adler32_checksums[file_path]
+    else:
+        file_checksum = checksum_methods[checksum_obj.checksum_type](file_path)
 
     if file_checksum != checksum_obj.checksum_value:
         msg = ('Checksum for restored file does not match its value in the '
@@ -437,7 +467,7 @@ def _email_user_success(retrieval):
 
     :param pdata_app.models.RetrievalRequest retrieval: the retrieval object
     """
-    contact_user_id = Settings.get_solo().contact_user_id
+    contact_user_id = Settings.get_cached().contact_user_id
     contact_user = User.objects.get(username=contact_user_id)
 
     msg = (
@@ -455,7 +485,7 @@ def _email_user_success(retrieval):
         'Thanks,\n'
         '\n'
         '{}'.format(retrieval.requester.first_name, retrieval.id,
-                    BASE_OUTPUT_DIR, contact_user.first_name)
+                    _base_output_dir(), contact_user.first_name)
     )
 
     _email = EmailQueue.objects.create(
@@ -472,7 +502,7 @@ def _email_admin_failure(retrieval):
 
     :param pdata_app.models.RetrievalRequest retrieval: the retrieval object
     """
-    contact_user_id = Settings.get_solo().contact_user_id
+    contact_user_id = Settings.get_cached().contact_user_id
     contact_user = User.objects.get(username=contact_user_id)
 
     msg = (
@@ -567,7 +597,7 @@ def main(args):
         tape_urls.sort()
 
         for tape_url in tape_urls:
-            url_files = filtered_files.filter(tape_url=tape_url)
+            url_files = filtered_files.filter(tape_url=tape_url).for_drs()
             if tape_url in tapes:
                 tapes[tape_url] = list(chain(tapes[tape_url], url_files))
             else:
@@ -577,6 +607,8 @@ def main(args):
     parallel_get_urls(tapes, args)
     # get a fresh DB connection after exiting from parallel operation
     django.db.connections.close_all()
+    # summarise the data requests whose files have been restored
+    ReceivedDataSummary.refresh()
 
     # check that all files were restored
     failed_files = False
@@ -596,7 +628,9 @@ def main(args):
     else:
         # set date_complete in the db
         retrieval.date_complete = timezone.now()
-        retrieval.save()
+        # the sizes loaded with the retrieval are out of date now that its
+        # files have been restored
+        retrieval.save(update_fields=['date_complete'])
 
         # send an email to advise the user that their data's been restored
         _email_user_success(retrieval)
@@ -63,7 +63,8 @@ def move_dirs(data_req, new_gws):
     for exist_dir in existing_dirs:
         if exist_dir.startswith(single_dir):
             continue
-        files_to_move = data_req.datafile_set.filter(directory=exist_dir)
+        files_to_move = (data_req.datafile_set.filter(directory=exist_dir).
+                         for_drs())
         logger.debug('Moving {} files from {}'.format(
             files_to_move.count(), exist_dir))
         for file_to_move in files_to_move:
@@ -10,11 +10,14 @@ import argparse
 import logging.config
 import sys
 
+import numpy as np
+
 import django
 from django.db.models import Sum
 from django.template.defaultfilters import filesizeformat
 django.setup()
 from pdata_app.models import DataFile, ESGFDataset
+from pdata_app.utils.snapshot import DataFileSnapshot
 
 
 __version__ = '0.1.0b1'
@@ -31,6 +34,11 @@ def parse_args():
     """
     parser = argparse.ArgumentParser(description='Calculate the volume of data '
                                                  'submitted to the ESGF.')
+    parser.add_argument('-s', '--snapshot', help='the directory containing '
+                                                 'a snapshot of the DataFile '
+                                                 'table to calculate the '
+                                                 'volumes from, rather than '
+                                                 'querying the database')
     parser.add_argument('-l', '--log-level', help='set logging level to one of '
                                                   'debug, info, warn (the '
                                                   'default), or error')
@@ -41,8 +49,13 @@ def parse_args():
     return args
 
 
-def main(args):
-    """Run the script"""
+def calculate_volumes():
+    """
+    Calculate the volume published to the ESGF and the total volume by
+    querying the database.
+
+    :returns: the published and total volumes in bytes
+    """
     esgf_volume = 0
     for esgf in ESGFDataset.objects.all():
         dataset_volume = (esgf.data_request.datafile_set.distinct().
@@ -53,6 +66,44 @@ def main(args):
     total_volume = (DataFile.objects.all().distinct().aggregate(Sum('size'))
                     ['size__sum'])
 
+    return esgf_volume, total_volume
+
+
+def calculate_snapshot_volumes(snapshot_dir):
+    """
+    Calculate the volume published to the ESGF and the total volume from a
+    snapshot of the DataFile table.
+
+    :param str snapshot_dir: the directory containing the snapshot
+    :returns: the published and total volumes in bytes
+    """
+    snapshot = DataFileSnapshot(snapshot_dir)
+    data_request_ids = snapshot['data_request_id']
+    sizes = snapshot['size']
+
+    request_volumes = np.zeros(data_request_ids.max() + 1 if len(sizes) else 0,
+                               dtype=np.int64)
+    np.add.at(request_volumes, data_request_ids, sizes)
+
+    # each dataset counts the volume of its data request
+    esgf_request_ids = np.array(
+        ESGFDataset.objects.values_list('data_request_id', flat=True),
+        dtype=np.int64
+    )
+    esgf_request_ids = esgf_request_ids[esgf_request_ids <
+                                        len(request_volumes)]
+    esgf_volume = int(request_volumes[esgf_request_ids].sum())
+
+    return esgf_volume, int(sizes.sum())
+
+
+def main(args):
+    """Run the script"""
+    if args.snapshot:
+        esgf_volume, total_volume = calculate_snapshot_volumes(args.snapshot)
+    else:
+        esgf_volume, total_volume = calculate_volumes()
+
     pretty_esgf = filesizeformat(esgf_volume).replace('\xa0', ' ')
     pretty_total = filesizeformat(total_volume).replace('\xa0', ' ')
     print(f'Volume published to ESGF {pretty_esgf}')
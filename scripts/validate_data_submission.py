@@ -11,7 +11,7 @@ import datetime
 import itertools
 import json
 import logging.config
-from multiprocessing import Process, Manager
+from multiprocessing import Pool, Process, Manager
 from multiprocessing.pool import ThreadPool
 from netCDF4 import Dataset
 import os
@@ -38,12 +38,17 @@ import django
 django.setup()
 
 from django.contrib.auth.models import User
+from django.db import transaction
 
 from pdata_app.models import (Project, ClimateModel, Experiment, DataSubmission,
     DataFile, VariableRequest, DataRequest, Checksum, Settings, Institute,
-    ActivityId, EmailQueue)
-from pdata_app.utils.dbapi import get_or_create, match_one
-from pdata_app.utils.common import adler32, list_files, pdt2num
+    ActivityId, EmailQueue, ESGFDataset, ReceivedDataSummary,
+    RetrievalRequest)
+from pdata_app.utils.dbapi import match_one
+from pdata_app.utils.fk_resolver import ForeignKeyResolver
+from pdata_app.utils.common import (adler32, grouper, list_files, pdt2num,
+                                    read_file_with_checksums)
+from pdata_app.utils.table_views import bump_table_cache_version
 from vocabs.vocabs import STATUS_VALUES, CHECKSUM_TYPES
 
 # Ignore warnings displayed when loading data
@@ -63,6 +68,15 @@ CONTACT_PERSON_USER_ID = 'jseddon'
 # 1073741824 = 1 GiB
 MAX_DATA_INTEGRITY_SIZE = 1073741824
 
+# The maximum number of files sent to a validation worker at a time
+MAX_VALIDATION_CHUNK_SIZE = 10
+
+# The number of files to insert into the database in each query
+INGEST_BATCH_SIZE = 1000
+
+# The records that files refer to, which are loaded once by each process
+_fk_resolver = None
+
 # Don't run PrePARE on the following var/table combinations as they've
 # been removed from the CMIP6 data request, but are still needed for
 # PRIMAVERA
@@ -84,11 +98,13 @@ class SubmissionError(Exception):
     pass
 
 
-def identify_and_validate(filenames, project, num_processes, file_format):
+def identify_and_validate(filenames, project, num_processes, file_format,
+                          data_limit=MAX_DATA_INTEGRITY_SIZE):
     """
     Loop through a list of file names, identify each file's metadata and then
-    validate it. The looping is done in parallel using the multiprocessing
-    library module.
+    validate it. The looping is done in parallel by a pool of worker
+    processes. The file names are sent to the workers in chunks and the
+    results are collected as each file is finished.
 
     clt_Amon_HadGEM2-ES_historical_r1i1p1_185912-188411.nc
 
@@ -97,99 +113,98 @@ def identify_and_validate(filenames, project, num_processes, file_format):
     :param int num_processes: The number of parallel processes to use
     :param str file_format: The CMOR version of the netCDF files, one out of-
         CMIP5 or CMIP6
-    :returns: A list containing the metadata dictionary generated for each file
-    :rtype: multiprocessing.Manager.list
+    :param int data_limit: Files larger than this (in bytes) aren't read for
+        an HDF integrity check
+    :returns: A list containing the metadata dictionary generated for each
+        file that passed validation
+    :rtype: list
+    :raises SubmissionError: If a serious error in any file means that the
+        submission cannot continue. The outstanding files are not processed.
     """
-    jobs = []
-    manager = Manager()
-    params = manager.Queue()
-    result_list = manager.list()
-    error_event = manager.Event()
-    if num_processes != 1:
-        for i in range(num_processes):
-            p = Process(target=identify_and_validate_file, args=(params,
-                result_list, error_event))
-            jobs.append(p)
-            p.start()
-
-    func_input_pair = list(zip(filenames,
-                          (project,) * len(filenames),
-                          (file_format,) * len(filenames)))
-    blank_pair = (None, None, None)
-
-    iters = itertools.chain(func_input_pair, (blank_pair,) * num_processes)
-    for item in iters:
-        params.put(item)
+    params = [(filename, project, file_format, data_limit)
+              for filename in filenames]
 
     if num_processes == 1:
-        identify_and_validate_file(params, result_list, error_event)
-    else:
-        for j in jobs:
-            j.join()
-
-    if error_event.is_set():
-        raise SubmissionError()
+        results = map(identify_and_validate_file, params)
+        return [metadata for metadata in results if metadata is not None]
 
-    return result_list
+    # the workers must each make their own database connection rather than
+    # sharing the one inherited from this process
+    django.db.connections.close_all()
+    # several files are sent to a worker at a time, but the chunks are kept
+    # small enough for the work to be shared evenly between the workers
+    chunk_size = max(1, min(MAX_VALIDATION_CHUNK_SIZE,
+                            len(params) // (num_processes * 4)))
+    validated_metadata = []
+    # leaving the with block terminates any workers that are still running
+    # and so a SubmissionError raised by a worker cancels the remaining files
+    with Pool(num_processes, initializer=_init_validation_worker) as pool:
+        for metadata in pool.imap_unordered(identify_and_validate_file,
+                                            params, chunk_size):
+            if metadata is not None:
+                validated_metadata.append(metadata)
+    return validated_metadata
+
+
+def _init_validation_worker():
+    """
+    Prepare a validation worker process by connecting it to the database,
+    which is then used for all of the files that the worker validates, and
+    giving it an empty resolver to load the records that files refer to.
+    """
+    global _fk_resolver
+    django.db.connections.close_all()
+    django.db.connection.ensure_connection()
+    _fk_resolver = ForeignKeyResolver()
 
 
-def identify_and_validate_file(params, output, error_event):
+def identify_and_validate_file(params):
     """
-    Identify `filename`'s metadata and then validate the file. The function
-    continues getting items to process from the parameter queue until a None
-    is received.
-
-    :param multiprocessing.Manager.Queue params: A queue, with each item being a
-        tuple of the filename to load, the name of the project and the netCDF
-        file CMOR version
-    :param multiprocessing.Manager.list output: A list containing the output
-        metadata dictionaries for each file
-    :param multiprocessing.Manager.Event error_event: If set then a catastrophic
-        error has occurred in another process and processing should end
+    Identify a file's metadata and then validate the file. A database
+    operational error, which may be caused by temporary high load, is retried
+    once after waiting for a minute.
+
+    :param tuple params: The filename to load, the name of the project, the
+        netCDF file CMOR version and the maximum size of file to check the
+        data of
+    :returns: The metadata of the file or None if it failed validation
+    :rtype: dict
+    :raises SubmissionError: If there's a serious error that means that the
+        submission cannot continue
     """
-    while True:
-        # close existing connections so that a fresh connection is made
+    filename, project, file_format, data_limit = params
+    try:
+        return _identify_and_validate_file(filename, project, file_format,
+                                           data_limit)
+    except django.db.utils.OperationalError:
+        logger.warning('django.db.utils.OperationalError waiting for one '
+                       'minute and then retrying.')
+        time.sleep(60)
+        # make a fresh connection for the retry
         django.db.connections.close_all()
-
-        if error_event.is_set():
-            return
-
-        filename, project, file_format = params.get()
-
-        if filename is None:
-            return
-
         try:
-            _identify_and_validate_file(filename, project, file_format,output,
-                                        error_event)
+            return _identify_and_validate_file(filename, project,
+                                               file_format, data_limit)
         except django.db.utils.OperationalError:
-            # Wait and then re-run once in case of temporary database
-            # high load
-            logger.warning('django.db.utils.OperationalError waiting for one '
-                           'minute and then retrying.')
-            time.sleep(60)
-            try:
-                _identify_and_validate_file(filename, project, file_format,
-                                            output, error_event)
-            except django.db.utils.OperationalError:
-                logger.error('django.db.utils.OperationalError for a second '
-                             'time. Exiting.')
-                error_event.set()
-                raise
+            msg = ('django.db.utils.OperationalError for a second time. '
+                   'Exiting.')
+            logger.error(msg)
+            raise SubmissionError(msg)
 
 
-def _identify_and_validate_file(filename, project, file_format, output,
-                                error_event):
+def _identify_and_validate_file(filename, project, file_format, data_limit):
     """
     Do the validation of a file.
 
     :param str filename: The name of the file
     :param str project: The name of the project
     :param str file_format: The format of the file (CMIP5 or CMIP6)
-    :param multiprocessing.Manager.list output: A list containing the output
-        metadata dictionaries for each file
-    :param multiprocessing.Manager.Event error_event: If set then a catastrophic
-        error has occurred in another process and processing should end
+    :param int data_limit: Files larger than this (in bytes) aren't read for
+        an HDF integrity check
+    :returns: The metadata of the file or None if it failed validation
+    :rtype: dict
+    :raises SubmissionError: If there's a serious error that means that the
+        submission cannot continue
     """
     try:
         basename = os.path.basename(filename)
@@ -212,21 +227,30 @@ def _identify_and_validate_file(filename, project, file_format, output,
             cube = load_cube(filename)
             metadata.update(identify_contents_metadata(cube, filename))
             validate_file_contents(cube, metadata)
-            _contents_hdf_check(cube, metadata, cmd_args.data_limit)
 
         verify_fk_relationships(metadata)
 
-        calculate_checksum(metadata)
+        if _is_hdf_checked(metadata, data_limit):
+            # the data is checked and the checksum calculated from a
+            # single read of the file
+            _contents_hdf_check(metadata)
+        else:
+            if 'fx' not in metadata['table']:
+                logger.warning('File {} is larger than {} bytes. File '
+                               'contents reading check not run.'.
+                               format(metadata['basename'], data_limit))
+            calculate_checksum(metadata)
     except SubmissionError:
         msg = ('A serious file error means the submission cannot continue: '
                '{}'.format(filename))
         logger.error(msg)
-        error_event.set()
+        raise SubmissionError(msg)
     except FileValidationError as fve:
         msg = 'File failed validation. {}'.format(fve.__str__())
         logger.warning(msg)
+        return None
     else:
-        output.append(metadata)
+        return metadata
 
 
 def calculate_checksum(metadata):
@@ -243,24 +267,26 @@ def calculate_checksum(metadata):
         metadata['checksum_value'] = None
 
 
-def verify_fk_relationships(metadata):
+def verify_fk_relationships(metadata, resolver=None):
     """
     Identify the variable_request and data_request objects corresponding to this file.
 
     :param dict metadata: Metadata identified for this file.
+    :param pdata_app.utils.fk_resolver.ForeignKeyResolver resolver: The
+        resolver to find the objects with. This process's resolver is used if
+        not specified.
     :raises SubmissionError: If there are no existing entries in the
         database for `Project`, `ClimateModel` or `Experiment`.
     """
-    foreign_key_types = [
-        (Project, 'project'),
-        (ClimateModel, 'climate_model'),
-        (Experiment, 'experiment'),
-        (Institute, 'institute'),
-        (ActivityId, 'activity_id')]
+    if resolver is None:
+        resolver = _get_fk_resolver()
+
+    foreign_key_types = ['project', 'climate_model', 'experiment',
+                         'institute', 'activity_id']
 
     # get values for each of the foreign key types
-    for object_type, object_str in foreign_key_types:
-        result = match_one(object_type, short_name=metadata[object_str])
+    for object_str in foreign_key_types:
+        result = resolver.short_name(object_str, metadata[object_str])
         if result:
             metadata[object_str] = result
         else:
@@ -271,37 +297,25 @@ def verify_fk_relationships(metadata):
             raise SubmissionError(msg)
 
     # find the data request
-    dreq_match = match_one(
-        DataRequest,
-        project=metadata['project'],
-        institute=metadata['institute'],
-        climate_model=metadata['climate_model'],
-        experiment=metadata['experiment'],
-        variable_request__table_name=metadata['table'],
-        variable_request__cmor_name=metadata['var_name'],
-        rip_code=metadata['rip_code']
-    )
-    if dreq_match:
-        metadata['data_request'] = dreq_match
-        metadata['variable'] = dreq_match.variable_request
+    dreq_args = (metadata['project'], metadata['institute'],
+                 metadata['climate_model'], metadata['experiment'],
+                 metadata['table'], metadata['rip_code'])
+    dreq_matches = resolver.data_requests(*dreq_args,
+                                          cmor_name=metadata['var_name'])
+    if len(dreq_matches) == 1:
+        metadata['data_request'] = dreq_matches[0]
+        metadata['variable'] = dreq_matches[0].variable_request
     else:
         # if cmor_name doesn't match then it may be a variable where out_name
         # is different to cmor_name so check these
-        dreq_matches = DataRequest.objects.filter(
-            project=metadata['project'],
-            institute=metadata['institute'],
-            climate_model=metadata['climate_model'],
-            experiment=metadata['experiment'],
-            variable_request__table_name=metadata['table'],
-            variable_request__var_name=metadata['var_name'],
-            rip_code=metadata['rip_code']
-        )
-        if dreq_matches.count() == 0:
+        dreq_matches = resolver.data_requests(*dreq_args,
+                                              var_name=metadata['var_name'])
+        if len(dreq_matches) == 0:
             msg = ('No data request found for file: {}.'.
                    format(metadata['basename']))
             logger.error(msg)
             raise FileValidationError(msg)
-        elif dreq_matches.count() == 1:
+        elif len(dreq_matches) == 1:
             metadata['data_request'] = dreq_matches[0]
             metadata['variable'] = dreq_matches[0].variable_request
         else:
@@ -313,13 +327,15 @@ def verify_fk_relationships(metadata):
                 logger.error(msg)
                 raise FileValidationError(msg)
             if plev_name:
-                plev_matches = dreq_matches.filter(
-                    variable_request__dimensions__icontains=plev_name
-                )
-                if plev_matches.count() == 1:
+                plev_matches = [
+                    dreq for dreq in dreq_matches
+                    if plev_name.lower() in
+                    (dreq.variable_request.dimensions or '').lower()
+                ]
+                if len(plev_matches) == 1:
                     metadata['data_request'] = plev_matches[0]
                     metadata['variable'] = plev_matches[0].variable_request
-                elif plev_matches.count() == 0:
+                elif len(plev_matches) == 0:
                     msg = ('No data requests found with plev {} for file: {}.'.
                            format(plev_name, metadata['basename']))
                     logger.error(msg)
@@ -336,24 +352,151 @@ def verify_fk_relationships(metadata):
                 raise FileValidationError(msg)
 
 
+def _get_fk_resolver():
+    """
+    The resolver shared by all of the files validated by this process.
+
+    :rtype: pdata_app.utils.fk_resolver.ForeignKeyResolver
+    """
+    global _fk_resolver
+    if _fk_resolver is None:
+        _fk_resolver = ForeignKeyResolver()
+    return _fk_resolver
+
+
 def update_database_submission(validated_metadata, data_sub, files_online=True,
                                file_version=None):
     """
-    Create entries in the database for the files in this submission.
+    Create entries in the database for the files in this submission. The
+    files and their checksums are inserted in batches in a single
+    transaction and so either all of the files are added or none are.
 
     :param list validated_metadata: A list containing the metadata dictionary
         generated for each file
     :param pdata_app.models.DataSubmission data_sub: The data submission object
         to update.
     :param bool files_online: True if the files are online.
-    :returns:
+    :param str file_version: The version string to apply to each file. The
+        string from the incoming directory name or the current date is used
+        if a string isn't supplied.
+    :raises SubmissionError: If a file can't be added to the database.
     """
-    for data_file in validated_metadata:
-        create_database_file_object(data_file, data_sub, files_online,
-                                    file_version)
+    # get a fresh DB connection after exiting from parallel operation
+    django.db.connections.close_all()
 
-    data_sub.status = STATUS_VALUES['VALIDATED']
-    data_sub.save()
+    time_units = Settings.get_cached().standard_time_units
+    version_strings = {}
+    data_files = []
+    for metadata in validated_metadata:
+        if metadata['directory'] not in version_strings:
+            version_strings[metadata['directory']] = _version_string(
+                metadata['directory'], file_version)
+        data_files.append(create_database_file_object(
+            metadata, data_sub, files_online,
+            version_strings[metadata['directory']], time_units
+        ))
+
+    with transaction.atomic():
+        existing_ids = set(data_sub.datafile_set.values_list('pk', flat=True))
+        for batch in grouper(data_files, INGEST_BATCH_SIZE):
+            _bulk_create_data_files(list(batch))
+
+        if data_files and data_files[0].pk is None:
+            # only some databases return the primary keys of the new rows
+            new_ids = {
+                (name, directory): pk for pk, name, directory in
+                data_sub.datafile_set.exclude(pk__in=existing_ids).
+                values_list('pk', 'incoming_name', 'incoming_directory')
+            }
+            for data_file in data_files:
+                data_file.pk = new_ids[(data_file.incoming_name,
+                                        data_file.incoming_directory)]
+
+        Checksum.objects.bulk_create(
+            [Checksum(data_file=data_file,
+                      checksum_value=metadata['checksum_value'],
+                      checksum_type=metadata['checksum_type'])
+             for data_file, metadata in zip(data_files, validated_metadata)
+             if metadata['checksum_value']],
+            batch_size=INGEST_BATCH_SIZE
+        )
+
+        data_sub.status = STATUS_VALUES['VALIDATED']
+        data_sub.save()
+
+        # after saving the submission so that its cached values aren't
+        # overwritten with those loaded before the files were added
+        _update_cached_values(data_sub, {data_file.data_request_id
+                                         for data_file in data_files})
+
+
+def _bulk_create_data_files(data_files):
+    """
+    Insert a batch of new files into the database.
+
+    :param list data_files: The unsaved files
+    :raises SubmissionError: If a file conflicts with a file that's already
+        in the database.
+    """
+    try:
+        with transaction.atomic():
+            DataFile.objects.bulk_create(data_files)
+    except django.db.utils.IntegrityError:
+        # insert the files one at a time to find the file that caused the
+        # error. The outer transaction will be rolled back.
+        for data_file in data_files:
+            try:
+                with transaction.atomic():
+                    DataFile.objects.bulk_create([data_file])
+            except django.db.utils.IntegrityError as exc:
+                msg = ('Unable to submit file {}: {}'.format(data_file.name,
+                                                             exc.__str__()))
+                logger.error(msg)
+                raise SubmissionError(msg)
+        raise
+
+
+def _update_cached_values(data_sub, data_request_ids):
+    """
+    Update the values that are normally updated as each file is saved, but
+    which bulk_create() bypasses.
+
+    :param pdata_app.models.DataSubmission data_sub: The submission that the
+        files were added to
+    :param set data_request_ids: The ids of the files' data requests
+    """
+    data_requests = DataRequest.objects.filter(pk__in=data_request_ids)
+    DataRequest.cache_aggregates(data_requests)
+    DataSubmission.cache_aggregates(
+        DataSubmission.objects.filter(pk=data_sub.pk))
+    ESGFDataset.cache_drs_ids(
+        ESGFDataset.objects.filter(data_request__in=data_request_ids))
+    RetrievalRequest.cache_sizes(
+        RetrievalRequest.objects.filter(data_request__in=data_request_ids).
+        distinct())
+    ReceivedDataSummary.refresh(data_request_ids)
+    bump_table_cache_version()
+
+
+def _version_string(directory, file_version=None):
+    """
+    Find the version string to apply to the files in a directory.
+
+    :param str directory: The directory that the files were submitted in
+    :param str file_version: The version string to use if supplied.
+    :returns: The version string
+    :rtype: str
+    """
+    if file_version:
+        return file_version
+
+    # find the version number from the date in the submission directory path
+    date_string = re.search(r'(?<=/incoming/)(\d{8})', directory)
+    if date_string:
+        return 'v' + date_string.group(0)
+    else:
+        today = datetime.datetime.utcnow()
+        return today.strftime('v%Y%m%d')
 
 
 def read_json_file(filename):
@@ -388,81 +531,48 @@ def write_json_file(validated_metadata, filename):
     logger.debug('Metadata written to JSON file {}'.format(filename))
 
 
-def create_database_file_object(metadata, data_submission, file_online=True,
-                                file_version=None):
+def create_database_file_object(metadata, data_submission, file_online,
+                                version_string, time_units):
     """
-    Create a database entry for a data file
+    Make an unsaved database entry for a data file
 
     :param dict metadata: This file's metadata.
     :param pdata_app.models.DataSubmission data_submission: The parent data
         submission.
     :param bool file_online: True if the file is online.
-    :param str file_version: The version string to apply to each file. The 
-        string from the incoming directory name or the current date is used
-        if a string isn't supplied.
-    :returns:
+    :param str version_string: The version string to apply to the file.
+    :param str time_units: The units to store the file's times in.
+    :returns: The new file
+    :rtype: pdata_app.models.DataFile
     """
-    # get a fresh DB connection after exiting from parallel operation
-    django.db.connections.close_all()
-
-    time_units = Settings.get_solo().standard_time_units
-
-    if file_version:
-        version_string = file_version
-    else:
-        # find the version number from the date in the submission directory path
-        date_string = re.search(r'(?<=/incoming/)(\d{8})',
-                                metadata['directory'])
-        if date_string:
-            date_string = date_string.group(0)
-            version_string = 'v' + date_string
-        else:
-            today = datetime.datetime.utcnow()
-            version_string = today.strftime('v%Y%m%d')
-
     # if the file isn't online (e.g. loaded from JSON) then directory is blank
     directory = metadata['directory'] if file_online else None
 
-    # create a data file. If the file already exists in the database with
-    # identical metadata then nothing happens. If the file exists but with
-    # slightly different metadata then django.db.utils.IntegrityError is
-    # raised
-    try:
-        data_file = DataFile.objects.create(
-            name=metadata['basename'],
-            incoming_name=metadata['basename'],
-            incoming_directory=metadata['directory'],
-            directory=directory, size=metadata['filesize'],
-            project=metadata['project'],
-            institute=metadata['institute'],
-            climate_model=metadata['climate_model'],
-            activity_id=metadata['activity_id'],
-            experiment=metadata['experiment'],
-            variable_request=metadata['variable'],
-            data_request=metadata['data_request'],
-            frequency=metadata['frequency'], rip_code=metadata['rip_code'],
-            start_time=pdt2num(metadata['start_date'], time_units,
-                               metadata['calendar']) if metadata['start_date']
-                                            else None,
-            end_time=pdt2num(metadata['end_date'], time_units,
-                             metadata['calendar'], start_of_period=False) if
-                             metadata['start_date'] else None,
-            time_units=time_units, calendar=metadata['calendar'],
-            version=version_string,
-            data_submission=data_submission, online=file_online,
-            grid=metadata.get('grid'),
-            tape_url = metadata.get('tape_url')
-        )
-    except django.db.utils.IntegrityError as exc:
-        msg = ('Unable to submit file {}: {}'.format(metadata['basename'],
-                                                     exc.__str__()))
-        logger.error(msg)
-        raise SubmissionError(msg)
-
-    if metadata['checksum_value']:
-        checksum = get_or_create(Checksum, data_file=data_file,
-                                 checksum_value=metadata['checksum_value'],
-                                 checksum_type=metadata['checksum_type'])
+    return DataFile(
+        name=metadata['basename'],
+        incoming_name=metadata['basename'],
+        incoming_directory=metadata['directory'],
+        directory=directory, size=metadata['filesize'],
+        project=metadata['project'],
+        institute=metadata['institute'],
+        climate_model=metadata['climate_model'],
+        activity_id=metadata['activity_id'],
+        experiment=metadata['experiment'],
+        variable_request=metadata['variable'],
+        data_request=metadata['data_request'],
+        frequency=metadata['frequency'], rip_code=metadata['rip_code'],
+        start_time=pdt2num(metadata['start_date'], time_units,
+                           metadata['calendar']) if metadata['start_date']
+                                        else None,
+        end_time=pdt2num(metadata['end_date'], time_units,
+                         metadata['calendar'], start_of_period=False) if
+                         metadata['start_date'] else None,
+        time_units=time_units, calendar=metadata['calendar'],
+        version=version_string,
+        data_submission=data_submission, online=file_online,
+        grid=metadata.get('grid'),
+        tape_url = metadata.get('tape_url')
+    )
 
 
 def move_rejected_files(submission_dir):
@@ -505,7 +615,7 @@ def send_user_rejection_email(data_sub):
     val_tool_url = ('http://proj.badc.rl.ac.uk/primavera-private/wiki/JASMIN/'
                     'HowTo#SoftwarepackagesinstalledonthePRIMAVERAworkspace')
 
-    contact_user_id = Settings.get_solo().contact_user_id
+    contact_user_id = Settings.get_cached().contact_user_id
     contact_user = User.objects.get(username=contact_user_id)
     contact_string = '{} {} ({})'.format(contact_user.first_name,
                                          contact_user.last_name,
@@ -547,7 +657,7 @@ def send_admin_rejection_email(data_sub):
 
     :param pdata_app.models.DataSubmission data_sub:
     """
-    admin_user_id = Settings.get_solo().contact_user_id
+    admin_user_id = Settings.get_cached().contact_user_id
     admin_user = User.objects.get(username=admin_user_id)
 
     msg = (
@@ -638,35 +748,76 @@ def run_prepare(file_paths, num_processes):
     logger.debug('All files successfully checked by PrePARE')
 
 
-def _contents_hdf_check(cube, metadata, max_size=MAX_DATA_INTEGRITY_SIZE):
+def _is_hdf_checked(metadata, max_size=MAX_DATA_INTEGRITY_SIZE):
     """
-    Check that the entire data of the file can be read into memory without
-    any errors. Corrupt files typically generate an HDF error. Files larger
-    than `max_size` are not read and a warning is displayed. Most files are
-    under this limit, but those over are excessively slow to validate.
+    Determine whether a file's data is read for an HDF integrity check.
+    Files larger than `max_size` are not read. Most files are under this
+    limit, but those over are excessively slow to validate. Cell measures
+    (fx) files are checked when they're identified.
 
-    :param iris.cube.Cube cube: The cube to check
     :param dict metadata: Metadata obtained from the file
     :param int max_size: Files larger than this (in bytes) are not checked
+    :returns: True if the file's data is checked
+    """
+    return ('fx' not in metadata['table'] and
+            metadata['filesize'] <= max_size)
+
+
+def _contents_hdf_check(metadata):
+    """
+    Check that the entire data of the file can be read into memory without
+    any errors. Corrupt files typically generate an HDF error. The file is
+    read from disk once and its checksum is calculated from the bytes as
+    they're read. The netCDF/HDF data of every variable is then decoded from
+    the copy in memory rather than by reading the file again.
+
+    :param dict metadata: Metadata obtained from the file, to which the
+        checksum is added
     :returns: True if file read ok.
     :raises FileValidationError: If there was any problem reading the data.
     """
-    if os.path.getsize(os.path.join(metadata['directory'],
-                                    metadata['basename'])) > max_size:
-        logger.warning('File {} is larger than {} bytes. File contents '
-                       'reading check not run.'.format(metadata['basename'],
-                                                       max_size))
-        return True
+    filename = os.path.join(metadata['directory'], metadata['basename'])
+    msg = 'Unable to read data from file {}.'.format(metadata['basename'])
+
+    try:
+        contents, checksum_values = read_file_with_checksums(filename,
+                                                             ['adler32'])
+    except (IOError, OSError):
+        raise FileValidationError(msg)
+    metadata['checksum_type'] = CHECKSUM_TYPES['ADLER32']
+    metadata['checksum_value'] = checksum_values['adler32']
 
     try:
-        _data = cube.data
+        # the buffer is passed without copying it, as netCDF4 only needs an
+        # object that supports the buffer protocol
+        with Dataset(filename, memory=contents) as dataset:
+            dataset.set_auto_maskandscale(False)
+            for variable in dataset.variables.values():
+                _data = variable[...]
     except Exception:
-        msg = 'Unable to read data from file {}.'.format(metadata['basename'])
         raise FileValidationError(msg)
     else:
         return True
 
 
+def _log_single_read_saving(validated_metadata, data_limit):
+    """
+    Report how much data validating the submission didn't have to read
+    because the files whose data was checked were checksummed from the same
+    read, rather than being read again to checksum them.
+
+    :param list validated_metadata: The metadata of the validated files
+    :param int data_limit: Files larger than this (in bytes) weren't read for
+        an HDF integrity check
+    """
+    total_size = sum(metadata['filesize'] for metadata in validated_metadata)
+    saved_size = sum(metadata['filesize'] for metadata in validated_metadata
+                     if _is_hdf_checked(metadata, data_limit))
+    logger.info('Validation read %s files (%s bytes) once each, avoiding '
+                'reading %s bytes a second time to checksum them',
+                len(validated_metadata), total_size, saved_size)
+
+
 def _run_prepare(params, file_failed):
     """
     Check a single file with PrePARE. This function is called in parallel by
@@ -871,8 +1022,14 @@ def parse_args():
     parser.add_argument('-d', '--data-limit', help='the maximum size of file '
                                                    '(in bytes) to load into '
                                                    'memory for an HDF '
-                                                   'integrity check (default: '
-                                                   '%(default)s)',
+                                                   'integrity check. At its '
+                                                   'peak each process holds '
+                                                   'a whole file of up to '
+                                                   'this size and its largest '
+                                                   'decoded variable, which '
+                                                   'can be larger than the '
+                                                   'file if it is compressed '
+                                                   '(default: %(default)s)',
                         type=int, default=MAX_DATA_INTEGRITY_SIZE)
     parser.add_argument('--version', action='version',
         version='%(prog)s {}'.format(__version__))
@@ -917,8 +1074,9 @@ def main(args):
             try:
                 if not args.no_prepare:
                     run_prepare(data_files, args.processes)
-                validated_metadata = list(identify_and_validate(data_files,
-                    args.mip_era, args.processes, args.file_format))
+                validated_metadata = identify_and_validate(data_files,
+                    args.mip_era, args.processes, args.file_format,
+                    args.data_limit)
             except SubmissionError:
                 if not args.validate_only and not args.output:
                     send_admin_rejection_email(data_sub)
@@ -926,6 +1084,7 @@ def main(args):
 
             logger.debug('%s files validated successfully',
                          len(validated_metadata))
+            _log_single_read_saving(validated_metadata, args.data_limit)
 
             if args.validate_only:
                 logger.debug('Data submission not run (-v option specified)')
@@ -1,7 +1,10 @@
 """
 test_validate_data_submission.py - unit tests for validate_data_submission.py
 """
-from django.contrib.auth.models import User
+import os
+import shutil
+import tempfile
+
 from django.test import tag, TestCase
 import mock
 
@@ -11,28 +14,144 @@ except ImportError:
     pass
 else:
     # Only import the validations if Iris is available
-    from scripts.validate_data_submission import update_database_submission
-from pdata_app.models import DataSubmission
+    from primavera_val import FileValidationError
+    from scripts.validate_data_submission import (update_database_submission,
+                                                  identify_and_validate,
+                                                  _contents_hdf_check,
+                                                  SubmissionError)
+from pdata_app.models import (ActivityId, Checksum, DataSubmission,
+                              ReceivedDataSummary)
+from pdata_app.tests.common import make_example_files
 from pdata_app.utils.dbapi import get_or_create
 from vocabs.vocabs import STATUS_VALUES
 
 
 @tag('validation')
 class TestUpdateDatabaseSubmission(TestCase):
-    @mock.patch('scripts.validate_data_submission.create_database_file_object')
-    def setUp(self, mock_create_file):
-        self.mock_create_file = mock_create_file
-        user = get_or_create(User, username='fred')
+    def setUp(self):
+        make_example_files(self)
         self.ds = get_or_create(DataSubmission, incoming_directory='/dir',
-                                directory='/dir', user=user,
+                                directory='/dir', user=self.user,
                                 status=STATUS_VALUES['PENDING_PROCESSING'])
-        self.metadata = [{'file': 'file1'}, ]
-        update_database_submission(self.metadata, self.ds)
+        self.metadata = [self._file_metadata('file{}'.format(index))
+                         for index in range(3)]
+
+    def _file_metadata(self, basename, directory='/dir'):
+        return {
+            'basename': basename,
+            'directory': directory,
+            'filesize': 5,
+            'project': self.dreq2.project,
+            'institute': self.dreq2.institute,
+            'climate_model': self.dreq2.climate_model,
+            'activity_id': ActivityId.objects.get(short_name='HighResMIP'),
+            'experiment': self.dreq2.experiment,
+            'variable': self.dreq2.variable_request,
+            'data_request': self.dreq2,
+            'frequency': 'ann',
+            'rip_code': 'r1i1p1f1',
+            'start_date': None,
+            'end_date': None,
+            'calendar': None,
+            'grid': 'gn',
+            'checksum_type': 'ADLER32',
+            'checksum_value': '1234'
+        }
 
     def test_submission_status(self):
+        update_database_submission(self.metadata, self.ds)
         self.ds.refresh_from_db()
         self.assertEqual(self.ds.status, 'VALIDATED')
 
-    def test_create_db_file_called(self):
-        self.mock_create_file.assert_called_once_with(self.metadata[0],
-                                                      self.ds, True, None)
+    def test_files_created(self):
+        update_database_submission(self.metadata, self.ds,
+                                   file_version='v20200101')
+        self.assertEqual(
+            list(self.ds.datafile_set.order_by('name').
+                 values_list('name', 'version', 'directory')),
+            [('file0', 'v20200101', '/dir'), ('file1', 'v20200101', '/dir'),
+             ('file2', 'v20200101', '/dir')]
+        )
+        self.assertEqual(
+            Checksum.objects.filter(data_file__data_submission=self.ds,
+                                    checksum_value='1234').count(),
+            3
+        )
+
+    def test_cached_values_updated(self):
+        update_database_submission(self.metadata, self.ds)
+        self.dreq2.refresh_from_db()
+        self.assertEqual(self.dreq2.cached_num_files, 4)
+        self.assertEqual(self.dreq2.cached_size, 17)
+        self.ds.refresh_from_db()
+        self.assertEqual(self.ds.cached_num_files, 3)
+        self.assertEqual(ReceivedDataSummary.objects.get(
+            data_request=self.dreq2).num_files, 4)
+
+    def test_integrity_error_names_file(self):
+        self.metadata.append(self._file_metadata('test2', '/some/dir'))
+        with self.assertRaisesRegex(SubmissionError, 'test2'):
+            update_database_submission(self.metadata, self.ds)
+        self.assertFalse(self.ds.datafile_set.exists())
+
+
+@tag('validation')
+class TestIdentifyAndValidate(TestCase):
+    def setUp(self):
+        patch = mock.patch('scripts.validate_data_submission.'
+                           '_identify_and_validate_file')
+        self.mock_validate = patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_failed_files_skipped(self):
+        self.mock_validate.side_effect = [{'basename': 'file1'}, None,
+                                          {'basename': 'file3'}]
+        validated = identify_and_validate(['file1', 'file2', 'file3'],
+                                          'CMIP6', 1, 'CMIP6', 10)
+        self.assertEqual(validated, [{'basename': 'file1'},
+                                     {'basename': 'file3'}])
+        self.mock_validate.assert_any_call('file2', 'CMIP6', 'CMIP6', 10)
+
+    def test_submission_error_stops(self):
+        self.mock_validate.side_effect = [{'basename': 'file1'},
+                                          SubmissionError('error'),
+                                          {'basename': 'file3'}]
+        self.assertRaises(SubmissionError, identify_and_validate,
+                          ['file1', 'file2', 'file3'], 'CMIP6', 1, 'CMIP6')
+        self.assertEqual(self.mock_validate.call_count, 2)
+
+
+@tag('validation')
+class TestContentsHdfCheck(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        with open(os.path.join(temp_dir, 'file1.nc'), 'wb') as fh:
+            fh.write(b'Wikipedia')
+        self.metadata = {'basename': 'file1.nc', 'directory': temp_dir}
+        patch = mock.patch('scripts.validate_data_submission.Dataset')
+        self.mock_dataset = patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_checksum_from_single_read(self):
+        self.assertTrue(_contents_hdf_check(self.metadata))
+        self.assertEqual(self.metadata['checksum_type'], 'ADLER32')
+        self.assertEqual(self.metadata['checksum_value'], '300286872')
+        self.mock_dataset.assert_called_once_with(
+            os.path.join(self.metadata['directory'], 'file1.nc'),
+            memory=b'Wikipedia'
+        )
+        # the buffer that the file was read into is used without a copy
+        self.assertIsInstance(self.mock_dataset.call_args[1]['memory'],
+                              bytearray)
+
+    def test_unreadable_data(self):
+        self.mock_dataset.side_effect = RuntimeError('NetCDF: HDF error')
+        self.assertRaises(FileValidationError, _contents_hdf_check,
+                          self.metadata)
+
+    def test_missing_file(self):
+        self.metadata['basename'] = 'missing.nc'
+        self.assertRaises(FileValidationError, _contents_hdf_check,
+                          self.metadata)
+        self.mock_dataset.assert_not_called()